@@ -3,8 +3,10 @@ from torch.utils.data import Dataset
 from ..misc.step_tracker import StepTracker
 from .dataset_re10k import DatasetRE10k, DatasetRE10kCfg
 from .dataset_dtu import DatasetDTU, DatasetDTUCfg
+from .dataset_re10k_evaluation import DatasetRE10kEvaluation
 from .types import Stage
 from .view_sampler import get_view_sampler
+from .view_sampler.view_sampler_evaluation import ViewSamplerEvaluation
 
 DATASETS: dict[str, Dataset] = {
     "re10k": DatasetRE10k,
@@ -31,4 +33,13 @@ def get_dataset(
         cfg.cameras_are_circular,
         step_tracker,
     )
+
+    # When testing on a fixed evaluation index, only the indexed scenes are loaded.
+    if (
+        cfg.name == "re10k"
+        and stage == "test"
+        and isinstance(view_sampler, ViewSamplerEvaluation)
+        and cfg.overfit_to_scene is None
+    ):
+        return DatasetRE10kEvaluation(cfg, stage, view_sampler)
     return DATASETS[cfg.name](cfg, stage, view_sampler)
@@ -0,0 +1,136 @@
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Condition, Thread
+from time import time
+from typing import Callable, Iterator
+
+from torch import Tensor
+
+
+@dataclass
+class PrefetchStats:
+    num_chunks: int = 0
+    # A stall happens when the next chunk is requested before it has been loaded.
+    num_stalls: int = 0
+    stall_seconds: float = 0.0
+    peak_bytes: int = 0
+
+
+def get_chunk_bytes(chunk: list[dict]) -> int:
+    """Estimate a chunk's memory footprint from the tensors it contains."""
+    num_bytes = 0
+    for example in chunk:
+        for value in example.values():
+            values = value if isinstance(value, list) else [value]
+            for tensor in values:
+                if isinstance(tensor, Tensor):
+                    num_bytes += tensor.nelement() * tensor.element_size()
+    return num_bytes
+
+
+class ChunkPrefetcher:
+    """Load chunks on a background thread while earlier chunks are being used.
+
+    At most depth chunks are loaded ahead of the one that's currently in use. If
+    max_bytes is set, loading also pauses while the chunks that are held (including the
+    one in use) exceed it. A chunk is released when the next one is requested. With a
+    depth of 0, chunks are loaded synchronously. Failed loads produce the exception
+    instead of the chunk, so that the caller can decide whether to skip it.
+    """
+
+    paths: list[Path]
+    load: Callable[[Path], list[dict]]
+    depth: int
+    max_bytes: int | None
+    stats: PrefetchStats
+
+    def __init__(
+        self,
+        paths: list[Path],
+        load: Callable[[Path], list[dict]],
+        depth: int,
+        max_bytes: int | None = None,
+    ) -> None:
+        self.paths = paths
+        self.load = load
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.stats = PrefetchStats()
+
+    def load_safely(self, path: Path) -> tuple[list[dict] | Exception, int]:
+        try:
+            chunk = self.load(path)
+        except Exception as e:
+            return e, 0
+        return chunk, get_chunk_bytes(chunk)
+
+    def __iter__(self) -> Iterator[tuple[Path, list[dict] | Exception]]:
+        if self.depth == 0:
+            for path in self.paths:
+                start_time = time()
+                chunk, num_bytes = self.load_safely(path)
+                self.stats.num_chunks += 1
+                self.stats.num_stalls += 1
+                self.stats.stall_seconds += time() - start_time
+                self.stats.peak_bytes = max(self.stats.peak_bytes, num_bytes)
+                yield path, chunk
+            return
+
+        condition = Condition()
+        ready = deque()
+        state = {"held_bytes": 0, "done": False, "stopped": False}
+
+        def can_load() -> bool:
+            if state["stopped"]:
+                return True
+            if len(ready) >= self.depth:
+                return False
+            held_bytes = state["held_bytes"]
+            return (
+                self.max_bytes is None or held_bytes == 0 or held_bytes < self.max_bytes
+            )
+
+        def produce() -> None:
+            for path in self.paths:
+                with condition:
+                    condition.wait_for(can_load)
+                    if state["stopped"]:
+                        return
+                chunk, num_bytes = self.load_safely(path)
+                with condition:
+                    ready.append((path, chunk, num_bytes))
+                    state["held_bytes"] += num_bytes
+                    self.stats.peak_bytes = max(
+                        self.stats.peak_bytes, state["held_bytes"]
+                    )
+                    condition.notify_all()
+            with condition:
+                state["done"] = True
+                condition.notify_all()
+
+        thread = Thread(target=produce, daemon=True)
+        thread.start()
+
+        released_bytes = 0
+        try:
+            while True:
+                with condition:
+                    state["held_bytes"] -= released_bytes
+                    condition.notify_all()
+                    if not ready and not state["done"]:
+                        self.stats.num_stalls += 1
+                    start_time = time()
+                    condition.wait_for(lambda: ready or state["done"])
+                    self.stats.stall_seconds += time() - start_time
+                    if not ready:
+                        break
+                    path, chunk, released_bytes = ready.popleft()
+                    condition.notify_all()
+                self.stats.num_chunks += 1
+                yield path, chunk
+        finally:
+            # This also runs when the consumer stops iterating early.
+            with condition:
+                state["stopped"] = True
+                condition.notify_all()
@@ -0,0 +1,86 @@
+from typing import Any
+
+import torch
+from jaxtyping import Bool
+from torch import Tensor
+from torch.utils.data import default_collate
+
+from .types import AnyViews, BatchedExample, BatchedViews, UnbatchedExample
+
+
+def pad_views(views: AnyViews, num_views: int) -> AnyViews:
+    """Pad unbatched views to the given number of views by repeating the last view.
+    Repeating a real view (rather than padding with zeros) keeps the padded cameras
+    valid, so that they can be rendered alongside the real ones. A boolean mask that
+    marks the real views is added under "mask".
+    """
+    n = len(views["index"])
+    padding = num_views - n
+
+    def pad(value: Any) -> Any:
+        if isinstance(value, Tensor):
+            return torch.cat((value, value[-1:].expand(padding, *value.shape[1:])))
+        if isinstance(value, list):
+            return value + value[-1:] * padding
+        return value
+
+    return {
+        **{key: pad(value) for key, value in views.items()},
+        "mask": torch.arange(num_views) < n,
+    }
+
+
+def collate_padded_examples(
+    examples: list[UnbatchedExample | None],
+) -> BatchedExample | None:
+    """Collate examples whose numbers of target views differ. Target views are padded
+    to the largest number of target views in the batch (see pad_views). Skipped (None)
+    examples are dropped, and a batch in which every example was skipped is None.
+    """
+    examples = [example for example in examples if example is not None]
+    if not examples:
+        return None
+    num_views = max(len(example["target"]["index"]) for example in examples)
+    return default_collate(
+        [
+            {**example, "target": pad_views(example["target"], num_views)}
+            for example in examples
+        ]
+    )
+
+
+def get_view_mask(views: BatchedViews) -> Bool[Tensor, "batch view"]:
+    """Return the mask of real (unpadded) views. Views that weren't padded are real."""
+    if "mask" in views:
+        return views["mask"]
+    b, v = views["index"].shape
+    return torch.ones((b, v), dtype=torch.bool, device=views["index"].device)
+
+
+def index_batch(batch: Any, indices: list[int]) -> Any:
+    """Select the given examples from a batch, e.g., to run per-scene code on a batch
+    that holds several scenes. Default collation turns lists (e.g., of per-view IDs)
+    into lists of batched tensors, so those are indexed element by element.
+    """
+    if isinstance(batch, dict):
+        return {key: index_batch(value, indices) for key, value in batch.items()}
+    if isinstance(batch, Tensor):
+        return batch[indices]
+    if isinstance(batch, list):
+        if batch and isinstance(batch[0], Tensor):
+            return [value[indices] for value in batch]
+        return [batch[index] for index in indices]
+    return batch
+
+
+def unpad_views(views: BatchedViews, num_views: int) -> BatchedViews:
+    """Drop padded views from a batch that holds a single scene (see index_batch)."""
+
+    def unpad(value: Any) -> Any:
+        if isinstance(value, Tensor):
+            return value[:, :num_views]
+        if isinstance(value, list):
+            return value[:num_views]
+        return value
+
+    return {key: unpad(value) for key, value in views.items()}
@@ -10,6 +10,9 @@ from torch.utils.data import DataLoader, Dataset, IterableDataset
 
 from ..misc.step_tracker import StepTracker
 from . import DatasetCfg, get_dataset
+from .collate import collate_padded_examples
+from .dataset_re10k_evaluation import DatasetRE10kEvaluation
+from .shims.uint8_shim import apply_float_shim
 from .types import DataShim, Stage
 from .validation_wrapper import ValidationWrapper
 
@@ -20,7 +23,9 @@ def get_data_shim(encoder: nn.Module) -> DataShim:
     because the modification depends on something outside the data loader.
     """
 
-    shims: list[DataShim] = []
+    # Datasets can send uint8 images, which are converted to float after they've been
+    # moved to the GPU.
+    shims: list[DataShim] = [apply_float_shim]
     if hasattr(encoder, "get_data_shim"):
         shims.append(encoder.get_data_shim())
 
@@ -104,6 +109,7 @@ class DataModule(LightningDataModule):
             ValidationWrapper(dataset, 1),
             self.data_loader_cfg.val.batch_size,
             num_workers=self.data_loader_cfg.val.num_workers,
+            collate_fn=collate_padded_examples,
             generator=self.get_generator(self.data_loader_cfg.val),
             worker_init_fn=worker_init_fn,
             persistent_workers=self.get_persistent(self.data_loader_cfg.val),
@@ -112,10 +118,17 @@ class DataModule(LightningDataModule):
     def test_dataloader(self):
         dataset = get_dataset(self.dataset_cfg, "test", self.step_tracker)
         dataset = self.dataset_shim(dataset, "test")
+        if isinstance(dataset, DatasetRE10kEvaluation):
+            dataset.interleave(
+                self.data_loader_cfg.test.num_workers,
+                self.data_loader_cfg.test.batch_size,
+            )
+        # Scenes can have different numbers of target views, so they're padded.
         return DataLoader(
             dataset,
             self.data_loader_cfg.test.batch_size,
             num_workers=self.data_loader_cfg.test.num_workers,
+            collate_fn=collate_padded_examples,
             generator=self.get_generator(self.data_loader_cfg.test),
             worker_init_fn=worker_init_fn,
             persistent_workers=self.get_persistent(self.data_loader_cfg.test),
@@ -20,8 +20,13 @@ from termcolor import colored
 
 
 from .dataset import DatasetCfgCommon
+from .dtu_packed import PackedDTU, get_packed_checksum
+from .dtu_scan_cache import DTUScanCache, DTUView, ViewKey
+from .image_decoding import decode_images
 from .shims.augmentation_shim import apply_augmentation_shim
+from .sharding import get_rank_and_world_size, get_worker_chunks
 from .shims.crop_shim import apply_crop_shim
+from .shims.uint8_shim import apply_uint8_shim
 from .types import Stage
 from .view_sampler import ViewSampler
 import random
@@ -29,8 +34,8 @@ import random
 from .scene_transform import get_boundingbox
 
 from torchvision import transforms as T
+from torchvision.io import ImageReadMode
 
-from transforms3d.quaternions import qinverse, qmult, rotate_vector, quat2mat, mat2quat
 
 
 random.seed(0)
@@ -119,6 +124,16 @@ class DatasetDTUCfg(DatasetCfgCommon):
     test_context_views: list[int]
     test_target_views: list[int]
     single_view: bool
+    # The number of threads (per data loader worker) used to decode images.
+    decoding_threads: int = 4
+    # Send images to the main process as uint8 (they're converted back on the GPU).
+    uint8_images: bool = False
+    # The memory (in bytes) of a cache of decoded views that's shared by the data loader
+    # workers. A cap of 0 disables the cache.
+    scan_cache_bytes: int = 0
+    # A directory written by preprocess_dtu. If set, views and cameras are read from it
+    # instead of the raw DTU files.
+    packed_root: Path | None = None
 
 
 class DatasetDTU(IterableDataset):
@@ -128,6 +143,12 @@ class DatasetDTU(IterableDataset):
 
     to_tensor: tf.ToTensor 
     chunks: list[Path] #* List of paths to chunks.
+    rank: int
+    world_size: int
+    epoch: int
+    scan_cache: DTUScanCache | None
+    packed: PackedDTU | None
+    camera_cache: dict[tuple[int, ...], dict]
     near: float = 0.1
     far: float = 1000.0
 
@@ -164,7 +185,26 @@ class DatasetDTU(IterableDataset):
         self.all_near_fars = []
         
         self.chunks, self.ref_src_pairs = self.build_metas()  # load ref-srcs view pairs info of the scene
+
+        # The rank has to be determined here, since spawned data loader workers can't
+        # access the process group. The epoch is counted per (persistent) worker.
+        self.rank, self.world_size = get_rank_and_world_size()
+        self.epoch = 0
+
+        # The cache has to be created here so that the data loader workers share it.
+        self.scan_cache = None
+        if self.cfg.scan_cache_bytes > 0:
+            self.scan_cache = DTUScanCache(
+                self.scans, tuple(self.cfg.image_shape), self.cfg.scan_cache_bytes
+            )
+        
+        
+        self.packed = None
+        if self.cfg.packed_root is not None:
+            checksum = get_packed_checksum(tuple(self.cfg.image_shape), self.cfg.roots[0])
+            self.packed = PackedDTU(self.cfg.packed_root, checksum)
         
+        self.camera_cache = {}
         
         self.allview_ids = [i for i in range(self.num_all_imgs)]
         self.load_cam_info()
@@ -179,21 +219,20 @@ class DatasetDTU(IterableDataset):
 
     def __iter__(self):
         # Chunks must be shuffled here (not inside __init__) for validation to show
-        # random chunks.
-        if self.stage in ("train"):
-            self.chunks = self.shuffle(self.chunks)
-
-        # When testing, the data loaders alternate chunks.
-        worker_info = torch.utils.data.get_worker_info()
-        if self.stage == "test" and worker_info is not None:
-            self.chunks = [
-                chunk
-                for chunk_index, chunk in enumerate(self.chunks)
-                if chunk_index % worker_info.num_workers == worker_info.id
-            ]
+        # random chunks. Each rank and data loader worker iterates over its own subset
+        # of the chunks, which is reshuffled every epoch.
+        chunks = get_worker_chunks(
+            self.chunks,
+            self.rank,
+            self.world_size,
+            self.epoch,
+            shuffle=self.stage == "train",
+            even=self.stage == "train",
+        )
+        self.epoch += 1
 
         #* iterate over all chunks
-        for idx, meta in enumerate(self.chunks):
+        for idx, meta in enumerate(chunks):
             # Load the chunk.
             scan, light_idx, ref_view, src_views = meta
             
@@ -205,131 +244,23 @@ class DatasetDTU(IterableDataset):
                 assert self.cfg.view_sampler.num_context_views == len(self.cfg.test_context_views), "Number of context views does not match the length of test context views"
                 ref_view = self.cfg.test_context_views[0]
                 
-            w2c_ref = self.all_extrinsics[self.remap[ref_view]]
-            w2c_ref_inv = np.linalg.inv(w2c_ref)
-
-            imgs, imgs_norm, depths_h, depths_mvs_h, masks = [], [], [], [], []
-            intrinsics, w2cs, near_fars = [], [], []
-            intrinsics_org_scale = []
-            monoNs = []
-            #TODO: duster code
-            img_paths = []
-            
-            #* each scene
-            proj_matrices = []
-            for i, vid in enumerate(view_ids):
-                # NOTE that the id in image file names is from 1 to 49 (not 0~48)
-                img_filename = os.path.join(str(self.cfg.roots[0]),
-                                            f'Rectified/{scan}_train/rect_{vid + 1:03d}_{light_idx}_r5000.png')
-                depth_filename = os.path.join(str(self.cfg.roots[0]),
-                                            f'Depths_raw/{scan}/depth_map_{vid:04d}.pfm')
-                
-                mask_filename = os.path.join(str(self.cfg.roots[0]),
-                                             f'Masks/{scan}_train/mask_{vid:04d}.png')
-                
-                normal_filename = os.path.join(str(self.cfg.roots[0]),
-                                            f'Rectified/{scan}_train/normal/rect_{vid + 1:03d}_{light_idx}_r5000_normal.npy')
-                
-                img_src = Image.open(img_filename) 
-                img = self.transform(img_src)
-                
-                imgs += [img]
-                
-                #TODO: duster code
-                img_paths += [img_filename]
-                
-                masks += [self.transform(Image.open(mask_filename).convert('L'))]
-                
-                monoNs += [self.transform(read_monoData(normal_filename).transpose(1, 2, 0))]
-                
-                index_mat = self.remap[vid]
-                near_fars.append(self.all_near_fars[index_mat])
-                intrinsics.append(self.all_intrinsics[index_mat])
-                intrinsics_org_scale.append(self.all_intrinsics_org_scale[index_mat])
-                w2cs.append(self.all_extrinsics[index_mat] @ w2c_ref_inv) #* reference view to source view
-                # w2cs.append(self.all_extrinsics[index_mat])
-                
-                if os.path.exists(depth_filename):
-                    depth_h = self.read_depth(depth_filename)
-                    depths_h += [depth_h]
-
-
-            scale_mat, scale_factor = self.cal_scale_mat(img_hw=[self.cfg.image_shape[0], self.cfg.image_shape[1]],
-                                                     intrinsics=intrinsics_org_scale, extrinsics=w2cs,
-                                                     near_fars=near_fars, factor=1.1)
-            new_near_fars = []
-            new_w2cs = []
-            new_c2ws = []
-            new_depths_h = [] 
-            new_qs = [] #* quaternion
-            new_rs = [] #* 3x3 rotation matrix
-            new_ts = [] #* translation vector
-            new_cs = [] #* camera origin
-            
-            for i, (intrinsic, extrinsic, depth) in enumerate(zip(intrinsics_org_scale, w2cs, depths_h)):
-            
-                P = intrinsic @ extrinsic @ scale_mat # perspective matrix scaled by scale_mat
-                P = P[:3, :4]
-                c2w = load_K_Rt_from_P(None, P)[1] #* camera to world
-
-                camera_o = c2w[:3, 3].copy() #* camera origin
-                
-                if i == 0:
-                    camera_o_canonical = camera_o.copy()
-                
-                # translate the camera to make the first camera located at the origin
-                c2w[:3, 3] -= camera_o_canonical
-                
-                
-                new_cs.append(camera_o)
-                
-                w2c = np.linalg.inv(c2w)
-                new_w2cs.append(w2c)
-                new_c2ws.append(c2w)
-                
-                new_qs.append(mat2quat(w2c[:3, :3]))
-                new_rs.append(c2w[:3, :3].copy())
-                new_ts.append(c2w[:3, 3].copy())
-                
-                dist = np.sqrt(np.sum(camera_o ** 2))
-                near = dist - 1 if dist > 1 else 0.1
-                far = dist + 1
-                new_near_fars.append([0.95 * near, 1.05 * far])
-                new_depths_h.append(depth * scale_factor)
-            
-            q1, t1 = new_qs[0], new_cs[0]
-            # quaternion and translation vector that transforms World-to-Cam
-            q2, t2 = new_qs[1], new_cs[1]
-            c1 = rotate_vector(-t1, qinverse(q1))  # center of camera 1 in world coordinates)
-            c2 = rotate_vector(-t2, qinverse(q2))  # center of camera 2 in world coordinates)
-
-            # get 4 x 4 relative pose transformation matrix (from im1 to im2)
-            # for val set, q1,t1 is the identity pose, so the relative pose matches the absolute pose
-            q12 = qmult(q2, qinverse(q1)) # meaning: q12 * q1 = q2
-            t12 = t2 - rotate_vector(t1, q12) # mening: t2 = t12 + q12 * t1
-            T = np.eye(4, dtype=np.float32)
-            T[:3, :3] = quat2mat(q12)
-            T[:3, -1] = t12
-            T = torch.from_numpy(T)
-
-            new_rs = torch.from_numpy(np.stack(new_rs).astype(np.float32))
-            new_ts = torch.from_numpy(np.stack(new_ts).astype(np.float32))
-
-            imgs = torch.stack(imgs)
-            depths_h = np.stack(new_depths_h)
-            
-            intrinsics, w2cs, c2ws, near_fars = np.stack(intrinsics), np.stack(new_w2cs), np.stack(new_c2ws), np.stack(new_near_fars)
-            intrinsics_org_scale = np.stack(intrinsics_org_scale)
-            
-            focal_lengths = repeat(intrinsics[0, :2, :2].diagonal(), 'xy -> b xy', b=len(intrinsics))
-            
-
-            # to tensor
-            intrinsics = torch.from_numpy(intrinsics.astype(np.float32)).float()
-            intrinsics_org_scale = torch.from_numpy(intrinsics_org_scale.astype(np.float32)).float()
-            w2cs = torch.from_numpy(w2cs.astype(np.float32)).float()
-            c2ws = torch.from_numpy(c2ws.astype(np.float32)).float()
-            near_fars = torch.from_numpy(near_fars.astype(np.float32)).float()
+            # The reference view comes first in view_ids in every stage.
+            assert view_ids[0] == ref_view
+            cameras = self.normalize_cameras(view_ids)
+            scale_mat, scale_factor = cameras["scale_mat"], cameras["scale_factor"]
+            focal_lengths = cameras["focal_lengths"]
+
+            views = self.load_views([(scan, light_idx, vid) for vid in view_ids])
+            imgs = torch.stack([view.image for view in views])
+            depths_h = np.stack([view.depth.numpy() * scale_factor for view in views if view.depth is not None])
+
+            # to tensor (this copies the cached arrays, which are modified below)
+            new_rs = torch.from_numpy(cameras["rs"].astype(np.float32))
+            new_ts = torch.from_numpy(cameras["ts"].astype(np.float32))
+            intrinsics = torch.from_numpy(cameras["intrinsics"].astype(np.float32)).float()
+            intrinsics_org_scale = torch.from_numpy(cameras["intrinsics_org_scale"].astype(np.float32)).float()
+            c2ws = torch.from_numpy(cameras["c2ws"].astype(np.float32)).float()
+            near_fars = torch.from_numpy(cameras["near_fars"].astype(np.float32)).float()
             depths_h = torch.from_numpy(depths_h.astype(np.float32)).float()
             
             # context_indices, target_indices = np.array([i for i in range(len(src_views))]), np.array([0]) 
@@ -405,7 +336,10 @@ class DatasetDTU(IterableDataset):
             }
             if self.stage == "train" and self.cfg.augment:
                 example = apply_augmentation_shim(example)
-            yield apply_crop_shim(example, tuple(self.cfg.image_shape))
+            example = apply_crop_shim(example, tuple(self.cfg.image_shape))
+            if self.cfg.uint8_images:
+                example = apply_uint8_shim(example)
+            yield example
             # return example
 
     
@@ -532,11 +466,97 @@ class DatasetDTU(IterableDataset):
 
         return metas, ref_src_pairs
 
+    def normalize_cameras(self, view_ids: list[int]) -> dict:
+        """Express the cameras relative to the first (reference) view and normalize
+        them so that the views' bounding box becomes a unit sphere. DTU scans share
+        their cameras, so the result only depends on the view IDs and is memoized.
+        """
+        key = tuple(view_ids)
+        if key in self.camera_cache:
+            return self.camera_cache[key]
+
+        indices = self.remap[view_ids]
+        w2c_ref_inv = np.linalg.inv(self.all_extrinsics[indices[0]])
+        w2cs = np.stack([self.all_extrinsics[i] for i in indices]) @ w2c_ref_inv #* reference view to source view
+        intrinsics = np.stack([self.all_intrinsics[i] for i in indices])
+        intrinsics_org_scale = np.stack([self.all_intrinsics_org_scale[i] for i in indices])
+        near_fars = [self.all_near_fars[i] for i in indices]
+        scale_mat, scale_factor = self.cal_scale_mat(img_hw=[self.cfg.image_shape[0], self.cfg.image_shape[1]],
+                                                     intrinsics=list(intrinsics_org_scale), extrinsics=list(w2cs),
+                                                     near_fars=near_fars, factor=1.1)
+
+        # Decomposing the scaled projection matrices (see load_K_Rt_from_P) yields the
+        # original rotations and the camera origins in the normalized space, so the
+        # latter can be computed directly for all views at once.
+        scaled = w2cs @ scale_mat
+        camera_origins = -np.linalg.solve(scaled[:, :3, :3], scaled[:, :3, 3:])[..., 0]
+        c2ws = repeat(np.eye(4, dtype=np.float32), "i j -> v i j", v=len(indices)).copy()
+        c2ws[:, :3, :3] = w2cs[:, :3, :3].transpose(0, 2, 1)
+
+        # translate the cameras to make the first camera located at the origin
+        c2ws[:, :3, 3] = camera_origins - camera_origins[0]
+
+        dist = np.linalg.norm(camera_origins, axis=-1)
+        near = np.where(dist > 1, dist - 1, 0.1)
+        far = dist + 1
+
+        cameras = {
+            "intrinsics": intrinsics,
+            "intrinsics_org_scale": intrinsics_org_scale,
+            "c2ws": c2ws,
+            "near_fars": np.stack([0.95 * near, 1.05 * far], axis=-1),
+            "rs": c2ws[:, :3, :3].copy(), #* 3x3 rotation matrix
+            "ts": c2ws[:, :3, 3].copy(), #* translation vector
+            "focal_lengths": repeat(intrinsics[0, :2, :2].diagonal(), 'xy -> b xy', b=len(intrinsics)),
+            "scale_mat": scale_mat,
+            "scale_factor": scale_factor,
+        }
+        self.camera_cache[key] = cameras
+        return cameras
+
+    def load_views(self, keys: list[ViewKey]) -> list[DTUView]:
+        if self.scan_cache is None:
+            return self.read_views(keys)
+        return self.scan_cache.get(keys, self.read_views)
+
+    def read_views(self, keys: list[ViewKey]) -> list[DTUView]:
+        if self.packed is not None:
+            return self.packed.read_views(keys)
+        root = str(self.cfg.roots[0])
+        img_paths, mask_paths, normals, depths = [], [], [], []
+        for scan, light_idx, vid in keys:
+            # NOTE that the id in image file names is from 1 to 49 (not 0~48)
+            img_paths.append(os.path.join(root, f'Rectified/{scan}_train/rect_{vid + 1:03d}_{light_idx}_r5000.png'))
+            mask_paths.append(os.path.join(root, f'Masks/{scan}_train/mask_{vid:04d}.png'))
+            normal_filename = os.path.join(root, f'Rectified/{scan}_train/normal/rect_{vid + 1:03d}_{light_idx}_r5000_normal.npy')
+            normals.append(self.transform(read_monoData(normal_filename).transpose(1, 2, 0)))
+            depth_filename = os.path.join(root, f'Depths_raw/{scan}/depth_map_{vid:04d}.pfm')
+            depth = None
+            if os.path.exists(depth_filename):
+                depth = torch.from_numpy(self.read_depth(depth_filename))
+            depths.append(depth)
+
+        # Decode the images and masks in parallel and resize them as whole batches.
+        imgs = self.resize(decode_images(img_paths, self.cfg.decoding_threads))
+        masks = self.resize(
+            decode_images(mask_paths, self.cfg.decoding_threads, ImageReadMode.GRAY)
+        )
+        return [
+            DTUView(img, mask, normal, depth)
+            for img, mask, normal, depth in zip(imgs, masks, normals, depths)
+        ]
+
     def load_cam_info(self):
+        cameras = None if self.packed is None else self.packed.read_cameras()
         for vid in range(self.num_all_imgs):
-            proj_mat_filename = os.path.join(str(self.cfg.roots[0]),
-                                             f'Cameras/train/{vid:08d}_cam.txt')
-            intrinsic, extrinsic, near_far = self.read_cam_file(proj_mat_filename)
+            if cameras is None:
+                proj_mat_filename = os.path.join(str(self.cfg.roots[0]),
+                                                 f'Cameras/train/{vid:08d}_cam.txt')
+                intrinsic, extrinsic, near_far = self.read_cam_file(proj_mat_filename)
+            else:
+                intrinsic = cameras["intrinsics"][vid].copy()
+                extrinsic = cameras["extrinsics"][vid].copy()
+                near_far = cameras["near_fars"][vid].tolist()
             # intrinsic[:2] *= 4  # * the provided intrinsics is 4x downsampled, now keep the same scale with image
             #TODO: normalize intrinsic by dividing first row with image width and second row with image height
             
@@ -622,6 +642,8 @@ class DatasetDTU(IterableDataset):
             
     def define_transforms(self):
         self.transform = T.Compose([T.ToTensor(), T.Resize((self.cfg.image_shape[0], self.cfg.image_shape[1]))])     
+        # Images are decoded into float tensors by decode_images and only need resizing.
+        self.resize = T.Resize((self.cfg.image_shape[0], self.cfg.image_shape[1]))
         self.transform_norm = T.Compose([T.ToTensor(), T.Resize((self.cfg.image_shape[0], self.cfg.image_shape[1])), T.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])])
             
                                            
@@ -21,6 +21,7 @@ from termcolor import colored
 from ..geometry.projection import get_fov
 from .dataset import DatasetCfgCommon
 from .shims.augmentation_shim import apply_augmentation_shim
+from .sharding import get_rank_and_world_size, get_worker_chunks
 from .shims.crop_shim import apply_crop_shim
 from .types import Stage
 from .view_sampler import ViewSampler
@@ -118,6 +119,9 @@ class DatasetDTU(IterableDataset):
 
     to_tensor: tf.ToTensor 
     chunks: list[Path] #* List of paths to chunks.
+    rank: int
+    world_size: int
+    epoch: int
     near: float = 0.1
     far: float = 1000.0
 
@@ -153,6 +157,11 @@ class DatasetDTU(IterableDataset):
         self.all_near_fars = []
         
         self.chunks, self.ref_src_pairs = self.build_metas()  # load ref-srcs view pairs info of the scene
+
+        # The rank has to be determined here, since spawned data loader workers can't
+        # access the process group. The epoch is counted per (persistent) worker.
+        self.rank, self.world_size = get_rank_and_world_size()
+        self.epoch = 0
         
         
         self.allview_ids = [i for i in range(self.num_all_imgs)]
@@ -168,21 +177,20 @@ class DatasetDTU(IterableDataset):
 
     def __iter__(self):
         # Chunks must be shuffled here (not inside __init__) for validation to show
-        # random chunks.
-        if self.stage in ("train", "val"):
-            self.chunks = self.shuffle(self.chunks)
-
-        # When testing, the data loaders alternate chunks.
-        worker_info = torch.utils.data.get_worker_info()
-        if self.stage == "test" and worker_info is not None:
-            self.chunks = [
-                chunk
-                for chunk_index, chunk in enumerate(self.chunks)
-                if chunk_index % worker_info.num_workers == worker_info.id
-            ]
+        # random chunks. Each rank and data loader worker iterates over its own subset
+        # of the chunks, which is reshuffled every epoch.
+        chunks = get_worker_chunks(
+            self.chunks,
+            self.rank,
+            self.world_size,
+            self.epoch,
+            shuffle=self.stage in ("train", "val"),
+            even=self.stage == "train",
+        )
+        self.epoch += 1
 
         #* iterate over all chunks
-        for idx, meta in enumerate(self.chunks):
+        for idx, meta in enumerate(chunks):
             # Load the chunk.
             scan, light_idx, ref_view, src_views = meta
             
@@ -1,22 +1,24 @@
 import json
 from dataclasses import dataclass
 from functools import cached_property
-from io import BytesIO
 from pathlib import Path
 from typing import Literal
 
 import torch
-import torchvision.transforms as tf
 from einops import rearrange, repeat
 from jaxtyping import Float, UInt8
-from PIL import Image
 from torch import Tensor
 from torch.utils.data import IterableDataset
 
 from ..geometry.projection import get_fov
+from .chunk_prefetcher import ChunkPrefetcher, PrefetchStats
 from .dataset import DatasetCfgCommon
+from .image_decoding import decode_images
+from .re10k_shards import SHARD_META_SUFFIX, load_shard
+from .sharding import get_rank_and_world_size, get_worker_chunks
 from .shims.augmentation_shim import apply_augmentation_shim
 from .shims.crop_shim import apply_crop_shim
+from .shims.uint8_shim import apply_uint8_shim
 from .types import Stage
 from .view_sampler import ViewSampler
 
@@ -29,6 +31,16 @@ class DatasetRE10kCfg(DatasetCfgCommon):
     max_fov: float
     make_baseline_1: bool
     augment: bool
+    # "shards" reads the memory-mapped format written by convert_re10k_to_shards.
+    storage: Literal["chunks", "shards"] = "chunks"
+    # How many chunks to load ahead of the current one (0 disables prefetching), and an
+    # optional cap on the memory taken up by loaded chunks.
+    prefetch_chunks: int = 1
+    prefetch_max_bytes: int | None = None
+    # The number of threads (per data loader worker) used to decode frames.
+    decoding_threads: int = 4
+    # Send images to the main process as uint8 (they're converted back on the GPU).
+    uint8_images: bool = False
 
 
 class DatasetRE10k(IterableDataset):
@@ -36,8 +48,11 @@ class DatasetRE10k(IterableDataset):
     stage: Stage
     view_sampler: ViewSampler
 
-    to_tensor: tf.ToTensor
     chunks: list[Path]
+    rank: int
+    world_size: int
+    epoch: int
+    prefetch_stats: PrefetchStats | None
     near: float = 0.1
     far: float = 1000.0
 
@@ -51,141 +66,175 @@ class DatasetRE10k(IterableDataset):
         self.cfg = cfg
         self.stage = stage
         self.view_sampler = view_sampler
-        self.to_tensor = tf.ToTensor()
 
         # Collect chunks.
         self.chunks = []
         for root in cfg.roots:
             root = root / self.data_stage
+            suffix = SHARD_META_SUFFIX if self.cfg.storage == "shards" else ".torch"
             root_chunks = sorted(
-                [path for path in root.iterdir() if path.suffix == ".torch"]
+                [path for path in root.iterdir() if path.suffix == suffix]
             )
             self.chunks.extend(root_chunks)
         if self.cfg.overfit_to_scene is not None:
             chunk_path = self.index[self.cfg.overfit_to_scene]
             self.chunks = [chunk_path] * len(self.chunks)
 
+        # The rank has to be determined here, since spawned data loader workers can't
+        # access the process group. The epoch is counted per (persistent) worker.
+        self.rank, self.world_size = get_rank_and_world_size()
+        self.epoch = 0
+        self.prefetch_stats = None
+
     def shuffle(self, lst: list) -> list:
         indices = torch.randperm(len(lst))
         return [lst[x] for x in indices]
 
     def __iter__(self):
         # Chunks must be shuffled here (not inside __init__) for validation to show
-        # random chunks.
-        if self.stage in ("train", "val"):
-            self.chunks = self.shuffle(self.chunks)
-
-        # When testing, the data loaders alternate chunks.
-        worker_info = torch.utils.data.get_worker_info()
-        if self.stage == "test" and worker_info is not None:
-            self.chunks = [
-                chunk
-                for chunk_index, chunk in enumerate(self.chunks)
-                if chunk_index % worker_info.num_workers == worker_info.id
-            ]
-
-        for chunk_path in self.chunks:
-            # Load the chunk.
-            try:
-                chunk = torch.load(chunk_path)
-            except Exception as e:
-                print(f"Failed to load {chunk_path}: {e}")
+        # random chunks. Each rank and data loader worker iterates over its own subset
+        # of the chunks, which is reshuffled every epoch.
+        chunks = get_worker_chunks(
+            self.chunks,
+            self.rank,
+            self.world_size,
+            self.epoch,
+            shuffle=self.stage in ("train", "val"),
+            even=self.stage == "train",
+        )
+        self.epoch += 1
+
+        # The next chunks are loaded in the background while this one is used.
+        prefetcher = ChunkPrefetcher(
+            chunks,
+            self.load_chunk,
+            self.cfg.prefetch_chunks,
+            self.cfg.prefetch_max_bytes,
+        )
+        self.prefetch_stats = prefetcher.stats
+        for chunk_path, chunk in prefetcher:
+            if isinstance(chunk, Exception):
+                print(f"Failed to load {chunk_path}: {chunk}")
                 continue
 
             if self.cfg.overfit_to_scene is not None:
-                item = [x for x in chunk if x["key"] == self.cfg.overfit_to_scene]
-                assert len(item) == 1
-                chunk = item * len(chunk)
+                chunk = [self.find_scene(chunk, self.cfg.overfit_to_scene)] * len(chunk)
 
             if self.stage in ("train", "val"):
                 chunk = self.shuffle(chunk)
 
             for example in chunk:
-                extrinsics, intrinsics = self.convert_poses(example["cameras"])
-                scene = example["key"] #* scene name
-
-                try:
-                    context_indices, target_indices = self.view_sampler.sample(
-                        scene,
-                        extrinsics,
-                        intrinsics,
-                    ) #* look at the assets/evaluation_index_re10k.json file
-                except ValueError:
-                    # Skip because the example doesn't have enough frames.
-                    continue
-
-                # Skip the example if the field of view is too wide.
-                if (get_fov(intrinsics).rad2deg() > self.cfg.max_fov).any():
-                    continue
-                
-                # restrict target indices to be too large
-                if len(target_indices) > 100:
-                    # downscale by selecting only 10 sliced indices
-                    values = torch.linspace(0, len(target_indices)-1, steps=10, dtype=torch.int64)
-                    target_indices = target_indices[values]   
-                    
-                # Load the images.
-                context_images = [
-                    example["images"][index.item()] for index in context_indices
-                ]
-                context_images = self.convert_images(context_images)
-                target_images = [
-                    example["images"][index.item()] for index in target_indices
-                ]
-                target_images = self.convert_images(target_images)
-
-                # Skip the example if the images don't have the right shape.
-                context_image_invalid = context_images.shape[1:] != (3, 360, 640)
-                target_image_invalid = target_images.shape[1:] != (3, 360, 640)
-                if context_image_invalid or target_image_invalid:
-                    print(
-                        f"Skipped bad example {example['key']}. Context shape was "
-                        f"{context_images.shape} and target shape was "
-                        f"{target_images.shape}."
-                    )
-                    continue
-
-                # Resize the world to make the baseline 1.
-                context_extrinsics = extrinsics[context_indices]
-                if context_extrinsics.shape[0] == 2 and self.cfg.make_baseline_1:
-                    a, b = context_extrinsics[:, :3, 3]
-                    scale = (a - b).norm()
-                    if scale < self.cfg.baseline_epsilon:
-                        print(
-                            f"Skipped {scene} because of insufficient baseline "
-                            f"{scale:.6f}"
-                        )
-                        continue
-                    extrinsics[:, :3, 3] /= scale
-                else:
-                    scale = 1
-
-                example = {
-                    "context": {
-                        "extrinsics": extrinsics[context_indices],
-                        "intrinsics": intrinsics[context_indices],
-                        "image": context_images,
-                        "near": self.get_bound("near", len(context_indices)) / scale,
-                        "far": self.get_bound("far", len(context_indices)) / scale,
-                        "R": extrinsics[context_indices][:, :3, :3],
-                        "T": extrinsics[context_indices][:, :3, 3],
-                        "index": context_indices,
-                    },
-                    "target": {
-                        "extrinsics": extrinsics[target_indices],
-                        "intrinsics": intrinsics[target_indices],
-                        "image": target_images,
-                        "near": self.get_bound("near", len(target_indices)) / scale,
-                        "far": self.get_bound("far", len(target_indices)) / scale,
-                        "R": extrinsics[target_indices][:, :3, :3],
-                        "T": extrinsics[target_indices][:, :3, 3],
-                        "index": target_indices,
-                    },
-                    "scene": scene,
-                }
-                if self.stage == "train" and self.cfg.augment:
-                    example = apply_augmentation_shim(example)
-                yield apply_crop_shim(example, tuple(self.cfg.image_shape))
+                example = self.process_example(example)
+                if example is not None:
+                    yield example
+
+    def process_example(self, example: dict) -> dict | None:
+        """Turn a raw example from a chunk into a training example, or return None if
+        the example should be skipped.
+        """
+        extrinsics, intrinsics = self.convert_poses(example["cameras"])
+        scene = example["key"] #* scene name
+
+        try:
+            context_indices, target_indices = self.view_sampler.sample(
+                scene,
+                extrinsics,
+                intrinsics,
+            ) #* look at the assets/evaluation_index_re10k.json file
+        except ValueError:
+            # Skip because the example doesn't have enough frames.
+            return None
+
+        # Skip the example if the field of view is too wide.
+        if (get_fov(intrinsics).rad2deg() > self.cfg.max_fov).any():
+            return None
+
+        # restrict target indices to be too large
+        if len(target_indices) > 100:
+            # downscale by selecting only 10 sliced indices
+            values = torch.linspace(0, len(target_indices)-1, steps=10, dtype=torch.int64)
+            target_indices = target_indices[values]   
+
+        # Load the images.
+        context_images = [
+            example["images"][index.item()] for index in context_indices
+        ]
+        context_images = self.convert_images(context_images)
+        target_images = [
+            example["images"][index.item()] for index in target_indices
+        ]
+        target_images = self.convert_images(target_images)
+
+        # Skip the example if the images don't have the right shape.
+        context_image_invalid = context_images.shape[1:] != (3, 360, 640)
+        target_image_invalid = target_images.shape[1:] != (3, 360, 640)
+        if context_image_invalid or target_image_invalid:
+            print(
+                f"Skipped bad example {example['key']}. Context shape was "
+                f"{context_images.shape} and target shape was "
+                f"{target_images.shape}."
+            )
+            return None
+
+        # Resize the world to make the baseline 1.
+        context_extrinsics = extrinsics[context_indices]
+        if context_extrinsics.shape[0] == 2 and self.cfg.make_baseline_1:
+            a, b = context_extrinsics[:, :3, 3]
+            scale = (a - b).norm()
+            if scale < self.cfg.baseline_epsilon:
+                print(
+                    f"Skipped {scene} because of insufficient baseline "
+                    f"{scale:.6f}"
+                )
+                return None
+            extrinsics[:, :3, 3] /= scale
+        else:
+            scale = 1
+
+        example = {
+            "context": {
+                "extrinsics": extrinsics[context_indices],
+                "intrinsics": intrinsics[context_indices],
+                "image": context_images,
+                "near": self.get_bound("near", len(context_indices)) / scale,
+                "far": self.get_bound("far", len(context_indices)) / scale,
+                "R": extrinsics[context_indices][:, :3, :3],
+                "T": extrinsics[context_indices][:, :3, 3],
+                "index": context_indices,
+            },
+            "target": {
+                "extrinsics": extrinsics[target_indices],
+                "intrinsics": intrinsics[target_indices],
+                "image": target_images,
+                "near": self.get_bound("near", len(target_indices)) / scale,
+                "far": self.get_bound("far", len(target_indices)) / scale,
+                "R": extrinsics[target_indices][:, :3, :3],
+                "T": extrinsics[target_indices][:, :3, 3],
+                "index": target_indices,
+            },
+            "scene": scene,
+        }
+        if self.stage == "train" and self.cfg.augment:
+            example = apply_augmentation_shim(example)
+        example = apply_crop_shim(example, tuple(self.cfg.image_shape))
+        if self.cfg.uint8_images:
+            example = apply_uint8_shim(example)
+        return example
+
+    def load_chunk(self, chunk_path: Path) -> list[dict]:
+        if self.cfg.storage == "shards":
+            return load_shard(chunk_path)
+        return torch.load(chunk_path)
+
+    def find_scene(self, chunk: list[dict], scene: str) -> dict:
+        """Find a scene in a loaded chunk. Shard indices store each scene's position,
+        so the chunk only has to be searched for indices that don't.
+        """
+        position = self.positions.get(scene)
+        if position is not None and chunk[position]["key"] == scene:
+            return chunk[position]
+        (example,) = [example for example in chunk if example["key"] == scene]
+        return example
 
     def convert_poses(
         self,
@@ -214,11 +263,7 @@ class DatasetRE10k(IterableDataset):
         self,
         images: list[UInt8[Tensor, "..."]],
     ) -> Float[Tensor, "batch 3 height width"]:
-        torch_images = []
-        for image in images:
-            image = Image.open(BytesIO(image.numpy().tobytes()))
-            torch_images.append(self.to_tensor(image))
-        return torch.stack(torch_images)
+        return decode_images(images, self.cfg.decoding_threads)
 
     def get_bound(
         self,
@@ -238,6 +283,21 @@ class DatasetRE10k(IterableDataset):
 
     @cached_property
     def index(self) -> dict[str, Path]:
+        return {scene: path for scene, (path, _) in self.index_entries.items()}
+
+    @cached_property
+    def positions(self) -> dict[str, int]:
+        return {
+            scene: position
+            for scene, (_, position) in self.index_entries.items()
+            if position is not None
+        }
+
+    @cached_property
+    def index_entries(self) -> dict[str, tuple[Path, int | None]]:
+        """Map each scene to its chunk and, for shards, its position in the chunk. Chunk
+        indices (and older shard indices) only hold the chunk's file name.
+        """
         merged_index = {}
         data_stages = [self.data_stage]
         if self.cfg.overfit_to_scene is not None:
@@ -247,7 +307,14 @@ class DatasetRE10k(IterableDataset):
                 # Load the root's index.
                 with (root / data_stage / "index.json").open("r") as f:
                     index = json.load(f)
-                index = {k: Path(root / data_stage / v) for k, v in index.items()}
+                index = {
+                    k: (
+                        (Path(root / data_stage / v), None)
+                        if isinstance(v, str)
+                        else (Path(root / data_stage / v[0]), v[1])
+                    )
+                    for k, v in index.items()
+                }
 
                 # The constituent datasets should have unique keys.
                 assert not (set(merged_index.keys()) & set(index.keys()))
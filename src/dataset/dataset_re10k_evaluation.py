@@ -0,0 +1,132 @@
+from itertools import groupby
+from pathlib import Path
+
+from torch.utils.data import Dataset
+
+from .dataset_re10k import DatasetRE10k, DatasetRE10kCfg
+from .types import Stage
+from .view_sampler.view_sampler_evaluation import ViewSamplerEvaluation
+
+
+class DatasetRE10kEvaluation(Dataset):
+    """A map-style test dataset that only visits the scenes in the evaluation index.
+
+    The streaming dataset loads every chunk and then discards the scenes that aren't
+    being evaluated. Here, the scene-to-chunk index is used to determine up front which
+    chunks are needed, which also makes the number of scenes known in advance. Scenes
+    are grouped by chunk, and the most recently loaded chunk is kept around, so that
+    each chunk is loaded only once per worker.
+
+    Under DDP, the distributed sampler hands rank r the indices r, r + world_size and
+    so on. Whole chunks are therefore assigned to ranks, and the scenes are laid out so
+    that this striding gives each rank its own. Ranks with fewer scenes are padded with
+    None (which the collate function drops) rather than repeated scenes.
+    """
+
+    dataset: DatasetRE10k
+    rank_scenes: list[list[str]]
+    scenes: list[str | None]
+    chunk_path: Path | None
+    chunk: list[dict]
+
+    def __init__(
+        self,
+        cfg: DatasetRE10kCfg,
+        stage: Stage,
+        view_sampler: ViewSamplerEvaluation,
+    ) -> None:
+        super().__init__()
+        self.dataset = DatasetRE10k(cfg, stage, view_sampler)
+        index = self.dataset.index
+        scenes = [
+            scene
+            for scene, entry in view_sampler.index.items()
+            if entry is not None and scene in index
+        ]
+        scenes = sorted(scenes, key=lambda scene: (index[scene], scene))
+        self.chunk_path = None
+        self.chunk = []
+
+        # Assign chunks to ranks, largest first, to balance the number of scenes.
+        groups = self.group_by_chunk(scenes)
+        self.rank_scenes = [[] for _ in range(self.dataset.world_size)]
+        for group in sorted(groups, key=len, reverse=True):
+            min(self.rank_scenes, key=len).extend(group)
+        self.lay_out()
+
+        print(
+            f"Evaluating {len(scenes)} scenes from {len(groups)} chunks "
+            f"({len(self.rank_scenes[self.dataset.rank])} on this rank)."
+        )
+
+    def group_by_chunk(self, scenes: list[str]) -> list[list[str]]:
+        return [
+            list(group)
+            for _, group in groupby(scenes, key=lambda x: self.dataset.index[x])
+        ]
+
+    def lay_out(self) -> None:
+        """Interleave the ranks' scenes for the distributed sampler's striding."""
+        length = max(len(scenes) for scenes in self.rank_scenes)
+        self.scenes = [
+            scenes[i] if i < len(scenes) else None
+            for i in range(length)
+            for scenes in self.rank_scenes
+        ]
+
+    def interleave(self, num_workers: int, batch_size: int) -> None:
+        """Reorder each rank's scenes for a data loader with the given number of
+        workers. The data loader hands out batches to its workers in turn, so without
+        this, each worker would end up loading every chunk. Instead, whole chunks are
+        assigned to workers, and the scenes are ordered so that each worker receives
+        its own.
+        """
+        if num_workers <= 1:
+            return
+        self.rank_scenes = [
+            self.interleave_rank(scenes, num_workers, batch_size)
+            for scenes in self.rank_scenes
+        ]
+        self.lay_out()
+
+    def interleave_rank(
+        self,
+        scenes: list[str],
+        num_workers: int,
+        batch_size: int,
+    ) -> list[str]:
+        # Assign chunks to workers, largest first, to balance the number of scenes.
+        queues = [[] for _ in range(num_workers)]
+        for group in sorted(self.group_by_chunk(scenes), key=len, reverse=True):
+            min(queues, key=len).extend(group)
+
+        # Hand out batches in the order the data loader dispatches them. Once a worker
+        # runs out of scenes, the remaining batches are taken from the longest queue.
+        scenes = []
+        worker = 0
+        while any(queues):
+            queue = queues[worker] if queues[worker] else max(queues, key=len)
+            scenes.extend(queue[:batch_size])
+            del queue[:batch_size]
+            worker = (worker + 1) % num_workers
+        return scenes
+
+    def __getitem__(self, index: int) -> dict | None:
+        scene = self.scenes[index]
+        if scene is None:
+            return None
+        chunk_path = self.dataset.index[scene]
+        if chunk_path != self.chunk_path:
+            self.chunk = self.dataset.load_chunk(chunk_path)
+            self.chunk_path = chunk_path
+        return self.dataset.process_example(self.dataset.find_scene(self.chunk, scene))
+
+    def __iter__(self):
+        # Allow the dataset to be iterated over directly, like the streaming dataset.
+        for index in range(len(self)):
+            example = self[index]
+            if example is not None:
+                yield example
+
+    def __len__(self) -> int:
+        return len(self.scenes)
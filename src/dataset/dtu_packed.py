@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from .dtu_scan_cache import DTUView, ViewKey
+
+# Bump this whenever the way views are decoded, resized, or stored changes.
+PACKED_FORMAT_VERSION = 1
+PACKED_VIEW_ARRAYS = ("images", "masks", "normals", "depths", "has_depth")
+PACKED_CAMERA_ARRAYS = ("intrinsics", "extrinsics", "near_fars")
+
+
+def get_packed_checksum(image_shape: tuple[int, int], root: Path) -> str:
+    """Identify the settings that a packed dataset was created with. A dataset whose
+    configuration leads to a different checksum can't use the packed data.
+    """
+    settings = {
+        "version": PACKED_FORMAT_VERSION,
+        "image_shape": list(image_shape),
+        "root": str(Path(root).resolve()),
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def get_file_checksum(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 24), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def encode_view_key(key: ViewKey) -> str:
+    scan, light_index, view_index = key
+    return f"{scan}/{light_index}/{view_index}"
+
+
+def write_packed_dtu(
+    path: Path,
+    checksum: str,
+    keys: list[ViewKey],
+    read_views: Callable[[list[ViewKey]], list[DTUView]],
+    cameras: dict[str, np.ndarray],
+    batch_size: int = 49,
+) -> None:
+    """Write views and cameras into memory-mappable .npy files, along with a metadata
+    file that records the settings checksum, the view index, and file checksums. Views
+    are read and written in batches, so the whole dataset never has to fit in memory.
+    """
+    path.mkdir(exist_ok=True, parents=True)
+    arrays = None
+    for start in tqdm(range(0, len(keys), batch_size), desc="Packing views"):
+        views = read_views(keys[start : start + batch_size])
+        if arrays is None:
+            n = len(keys)
+            _, h, w = views[0].image.shape
+            shapes = {
+                "images": (np.float32, (n, 3, h, w)),
+                "masks": (np.float32, (n, 1, h, w)),
+                "normals": (np.float32, (n, 3, h, w)),
+                "depths": (np.float32, (n, h, w)),
+                "has_depth": (np.bool_, (n,)),
+            }
+            arrays = {
+                name: np.lib.format.open_memmap(
+                    path / f"{name}.npy", "w+", dtype, shape
+                )
+                for name, (dtype, shape) in shapes.items()
+            }
+        for row, view in enumerate(views, start):
+            arrays["images"][row] = view.image.numpy()
+            arrays["masks"][row] = view.mask.numpy()
+            arrays["normals"][row] = view.normal.numpy()
+            arrays["has_depth"][row] = view.depth is not None
+            arrays["depths"][row] = 0 if view.depth is None else view.depth.numpy()
+    for array in arrays.values():
+        array.flush()
+    for name in PACKED_CAMERA_ARRAYS:
+        np.save(path / f"{name}.npy", cameras[name])
+
+    names = PACKED_VIEW_ARRAYS + PACKED_CAMERA_ARRAYS
+    metadata = {
+        "checksum": checksum,
+        "keys": [encode_view_key(key) for key in keys],
+        "file_checksums": {
+            name: get_file_checksum(path / f"{name}.npy") for name in names
+        },
+    }
+    with (path / "metadata.json").open("w") as f:
+        json.dump(metadata, f)
+
+
+def verify_packed_dtu(path: Path) -> list[str]:
+    """Return the names of the packed files whose contents don't match the checksums
+    that were recorded when they were written.
+    """
+    with (path / "metadata.json").open("r") as f:
+        metadata = json.load(f)
+    return [
+        name
+        for name, checksum in metadata["file_checksums"].items()
+        if get_file_checksum(path / f"{name}.npy") != checksum
+    ]
+
+
+class PackedDTU:
+    """Read views and cameras from a packed DTU dataset (see preprocess_dtu). The files
+    are memory-mapped lazily in each process, so that pickling this for data loader
+    workers doesn't copy their contents.
+    """
+
+    path: Path
+    rows: dict[str, int]
+    arrays: dict[str, np.ndarray] | None
+    pid: int | None
+
+    def __init__(self, path: Path, checksum: str) -> None:
+        self.path = path
+        with (path / "metadata.json").open("r") as f:
+            metadata = json.load(f)
+        if metadata["checksum"] != checksum:
+            raise ValueError(
+                f"The packed DTU dataset at {path} was created with different settings "
+                "(e.g., a different image_shape). Rerun preprocess_dtu."
+            )
+        self.rows = {key: row for row, key in enumerate(metadata["keys"])}
+        self.arrays = None
+        self.pid = None
+
+    def get_arrays(self) -> dict[str, np.ndarray]:
+        if self.arrays is None or self.pid != os.getpid():
+            self.arrays = {
+                name: np.load(self.path / f"{name}.npy", mmap_mode="r")
+                for name in PACKED_VIEW_ARRAYS
+            }
+            self.pid = os.getpid()
+        return self.arrays
+
+    def __getstate__(self) -> dict:
+        return {**self.__dict__, "arrays": None, "pid": None}
+
+    def read_cameras(self) -> dict[str, np.ndarray]:
+        return {
+            name: np.load(self.path / f"{name}.npy") for name in PACKED_CAMERA_ARRAYS
+        }
+
+    def read_views(self, keys: list[ViewKey]) -> list[DTUView]:
+        arrays = self.get_arrays()
+        views = []
+        for key in keys:
+            row = self.rows[encode_view_key(key)]
+            depth = None
+            if arrays["has_depth"][row]:
+                depth = torch.from_numpy(np.array(arrays["depths"][row]))
+            views.append(
+                DTUView(
+                    torch.from_numpy(np.array(arrays["images"][row])),
+                    torch.from_numpy(np.array(arrays["masks"][row])),
+                    torch.from_numpy(np.array(arrays["normals"][row])),
+                    depth,
+                )
+            )
+        return views
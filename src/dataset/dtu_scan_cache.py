@@ -0,0 +1,118 @@
+import multiprocessing
+from dataclasses import dataclass
+from typing import Callable
+
+import torch
+from jaxtyping import Float
+from torch import Tensor
+
+# A view is identified by its scan, light index, and view index.
+ViewKey = tuple[str, int, int]
+
+
+@dataclass
+class DTUView:
+    image: Float[Tensor, "3 height width"]
+    mask: Float[Tensor, "1 height width"]
+    normal: Float[Tensor, "3 height width"]
+    depth: Float[Tensor, "height width"] | None
+
+
+class DTUScanCache:
+    """A cache of decoded and resized DTU views that all data loader workers share.
+
+    The cache consists of a fixed number of slots in shared memory, which are allocated
+    up front (when the dataset is created) so that the workers inherit them. The number
+    of slots is determined by the memory cap. When all slots are taken, the least
+    recently used view is evicted. Views are loaded outside the lock, so workers that
+    miss the cache don't block each other.
+    """
+
+    scans: dict[str, int]
+    num_slots: int
+
+    def __init__(
+        self,
+        scans: list[str],
+        image_shape: tuple[int, int],
+        max_bytes: int,
+    ) -> None:
+        self.scans = {scan: index for index, scan in enumerate(scans)}
+        h, w = image_shape
+
+        # Each view takes up an image, a mask, a normal map, and a depth map.
+        bytes_per_view = 4 * h * w * (3 + 1 + 3 + 1)
+        self.num_slots = max_bytes // bytes_per_view
+        assert self.num_slots > 0, "The cache is too small to hold a single view."
+        n = self.num_slots
+        self.images = torch.zeros((n, 3, h, w), dtype=torch.float32).share_memory_()
+        self.masks = torch.zeros((n, 1, h, w), dtype=torch.float32).share_memory_()
+        self.normals = torch.zeros((n, 3, h, w), dtype=torch.float32).share_memory_()
+        self.depths = torch.zeros((n, h, w), dtype=torch.float32).share_memory_()
+        self.has_depth = torch.zeros((n,), dtype=torch.bool).share_memory_()
+
+        # Empty slots have the key -1.
+        self.keys = torch.full((n,), -1, dtype=torch.int64).share_memory_()
+        self.last_used = torch.zeros((n,), dtype=torch.int64).share_memory_()
+        self.clock = torch.zeros((), dtype=torch.int64).share_memory_()
+        self.lock = multiprocessing.Lock()
+
+    def encode_key(self, key: ViewKey) -> int:
+        scan, light_index, view_index = key
+        return (self.scans[scan] * 256 + light_index) * 256 + view_index
+
+    def find_slot(self, key: int) -> int | None:
+        (slots,) = (self.keys == key).nonzero(as_tuple=True)
+        return slots[0].item() if len(slots) > 0 else None
+
+    def read_slot(self, slot: int) -> DTUView:
+        self.clock += 1
+        self.last_used[slot] = self.clock
+        return DTUView(
+            self.images[slot].clone(),
+            self.masks[slot].clone(),
+            self.normals[slot].clone(),
+            self.depths[slot].clone() if self.has_depth[slot] else None,
+        )
+
+    def write_slot(self, key: int, view: DTUView) -> None:
+        # Use an empty slot if there is one. Otherwise, evict the least recently used.
+        empty = self.find_slot(-1)
+        slot = self.last_used.argmin().item() if empty is None else empty
+        self.clock += 1
+        self.keys[slot] = key
+        self.last_used[slot] = self.clock
+        self.images[slot] = view.image
+        self.masks[slot] = view.mask
+        self.normals[slot] = view.normal
+        self.has_depth[slot] = view.depth is not None
+        if view.depth is not None:
+            self.depths[slot] = view.depth
+
+    def get(
+        self,
+        keys: list[ViewKey],
+        load: Callable[[list[ViewKey]], list[DTUView]],
+    ) -> list[DTUView]:
+        """Get the given views, loading the ones that aren't cached in a single call."""
+        encoded = [self.encode_key(key) for key in keys]
+        views: list[DTUView | None] = [None] * len(keys)
+        with self.lock:
+            for index, key in enumerate(encoded):
+                slot = self.find_slot(key)
+                if slot is not None:
+                    views[index] = self.read_slot(slot)
+
+        missing = [index for index, view in enumerate(views) if view is None]
+        if not missing:
+            return views
+
+        loaded = load([keys[index] for index in missing])
+        with self.lock:
+            for index, view in zip(missing, loaded):
+                views[index] = view
+
+                # Another worker may have cached the view in the meantime.
+                if self.find_slot(encoded[index]) is None:
+                    self.write_slot(encoded[index], view)
+        return views
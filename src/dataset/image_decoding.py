@@ -0,0 +1,59 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import torch
+from jaxtyping import Float, UInt8
+from torch import Tensor
+from torchvision.io import ImageReadMode, decode_image, read_file
+
+# Thread pools are created per process, since they don't survive a fork (e.g., into a
+# data loader worker).
+_executors: dict[tuple[int, int], ThreadPoolExecutor] = {}
+
+
+def get_executor(num_threads: int) -> ThreadPoolExecutor:
+    key = (os.getpid(), num_threads)
+    if key not in _executors:
+        _executors[key] = ThreadPoolExecutor(num_threads)
+    return _executors[key]
+
+
+def decode_images(
+    images: list[UInt8[Tensor, " byte"] | Path | str],
+    num_threads: int,
+    mode: ImageReadMode = ImageReadMode.RGB,
+) -> Float[Tensor, "batch channel height width"]:
+    """Decode JPEG or PNG images into a float batch with values in [0, 1], matching
+    torchvision's ToTensor. Images can be given as encoded uint8 buffers, which are
+    decoded without being copied, or as file paths. Images are decoded in parallel
+    (torchvision's decoders release the GIL) and written straight into a preallocated
+    batch, so all images must have the same shape.
+    """
+
+    def decode(index: int) -> UInt8[Tensor, "channel height width"]:
+        image = images[index]
+        if isinstance(image, (Path, str)):
+            image = read_file(str(image))
+        return decode_image(image, mode)
+
+    # The first image determines the shape of the batch.
+    first = decode(0)
+    batch = torch.empty((len(images), *first.shape), dtype=torch.float32)
+
+    def decode_into_batch(index: int, image: Tensor | None = None) -> None:
+        image = decode(index) if image is None else image
+        if image.shape != first.shape:
+            raise ValueError(
+                f"Image {index} has shape {tuple(image.shape)}, but the batch has "
+                f"shape {tuple(first.shape)}."
+            )
+        torch.div(image, 255, out=batch[index])
+
+    decode_into_batch(0, first)
+    if num_threads > 1 and len(images) > 2:
+        list(get_executor(num_threads).map(decode_into_batch, range(1, len(images))))
+    else:
+        for index in range(1, len(images)):
+            decode_into_batch(index)
+    return batch
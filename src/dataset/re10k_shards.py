@@ -0,0 +1,74 @@
+from pathlib import Path
+
+import numpy as np
+import torch
+from jaxtyping import Int64, UInt8
+from torch import Tensor
+
+# A shard consists of two files that share a stem. The ".bin" file holds the encoded
+# frames of all scenes back to back. The ".shard" file is a small torch file with each
+# scene's key, cameras, and the (offset, length) byte range of each of its frames.
+SHARD_DATA_SUFFIX = ".bin"
+SHARD_META_SUFFIX = ".shard"
+
+
+class ShardImages:
+    """Lazily read a scene's encoded frames from a memory-mapped shard. This mimics the
+    list of encoded images found in the original chunks, but only the frames that are
+    indexed are ever read from disk.
+    """
+
+    data: np.memmap
+    ranges: Int64[Tensor, "frame 2"]
+
+    def __init__(self, data: np.memmap, ranges: Int64[Tensor, "frame 2"]) -> None:
+        self.data = data
+        self.ranges = ranges
+
+    def __len__(self) -> int:
+        return self.ranges.shape[0]
+
+    def __getitem__(self, index: int) -> UInt8[Tensor, " byte"]:
+        offset, length = self.ranges[index].tolist()
+        return torch.from_numpy(np.array(self.data[offset : offset + length]))
+
+
+def write_shard(chunk: list[dict], path: Path) -> dict[str, int]:
+    """Write a chunk in the sharded format. The path is the shard's stem. Returns each
+    scene's position within the shard.
+    """
+    path.parent.mkdir(exist_ok=True, parents=True)
+    scenes = []
+    offset = 0
+    with path.with_suffix(SHARD_DATA_SUFFIX).open("wb") as f:
+        for example in chunk:
+            ranges = []
+            for image in example["images"]:
+                data = image.numpy().tobytes()
+                f.write(data)
+                ranges.append((offset, len(data)))
+                offset += len(data)
+            scenes.append(
+                {
+                    "key": example["key"],
+                    "cameras": example["cameras"],
+                    "ranges": torch.tensor(ranges, dtype=torch.int64),
+                }
+            )
+    torch.save(scenes, path.with_suffix(SHARD_META_SUFFIX))
+    return {scene["key"]: position for position, scene in enumerate(scenes)}
+
+
+def load_shard(meta_path: Path) -> list[dict]:
+    """Load a shard's scenes in the same format as the original chunks."""
+    scenes = torch.load(meta_path)
+    data_path = meta_path.with_suffix(SHARD_DATA_SUFFIX)
+    data = np.memmap(data_path, dtype=np.uint8, mode="r")
+    return [
+        {
+            "key": scene["key"],
+            "cameras": scene["cameras"],
+            "images": ShardImages(data, scene["ranges"]),
+        }
+        for scene in scenes
+    ]
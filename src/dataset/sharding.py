@@ -0,0 +1,70 @@
+from typing import TypeVar
+
+import torch
+from torch.utils.data import get_worker_info
+
+T = TypeVar("T")
+
+
+def get_rank_and_world_size() -> tuple[int, int]:
+    """This has to be called in the main process, since data loader workers that were
+    spawned (rather than forked) don't have access to the process group.
+    """
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        return torch.distributed.get_rank(), torch.distributed.get_world_size()
+    return 0, 1
+
+
+def get_shared_seed() -> int:
+    """Get a seed that is identical across a data loader's workers. When the data loader
+    has a seeded generator, the seed is also identical across ranks. It changes every
+    time a data loader without persistent workers is iterated over.
+    """
+    worker_info = get_worker_info()
+    if worker_info is None:
+        return torch.initial_seed()
+    return worker_info.seed - worker_info.id
+
+
+def shard_chunks(
+    chunks: list[T],
+    rank: int,
+    world_size: int,
+    worker_id: int,
+    num_workers: int,
+    seed: int | None,
+    even: bool = False,
+) -> list[T]:
+    """Select the chunks that one data loader worker on one rank should iterate over.
+    Across all ranks and workers, every chunk is selected exactly once. If a seed is
+    given, the chunks are shuffled first, which requires the seed to be the same for
+    all ranks and workers. If even is set, chunks are dropped so that every rank gets
+    the same number of chunks, which keeps distributed training from stalling when one
+    rank runs out of data early.
+    """
+    if seed is not None:
+        generator = torch.Generator()
+        generator.manual_seed(seed)
+        chunks = [chunks[i] for i in torch.randperm(len(chunks), generator=generator)]
+    if even:
+        chunks = chunks[: len(chunks) // world_size * world_size]
+    return chunks[rank::world_size][worker_id::num_workers]
+
+
+def get_worker_chunks(
+    chunks: list[T],
+    rank: int,
+    world_size: int,
+    epoch: int,
+    shuffle: bool,
+    even: bool = False,
+) -> list[T]:
+    """Select the current data loader worker's chunks for the given epoch."""
+    worker_info = get_worker_info()
+    worker_id, num_workers = (
+        (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+    )
+    seed = get_shared_seed() + epoch if shuffle else None
+    return shard_chunks(
+        chunks, rank, world_size, worker_id, num_workers, seed, even=even
+    )
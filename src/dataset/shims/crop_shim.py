@@ -1,5 +1,6 @@
 import numpy as np
 import torch
+import torch.nn.functional as F
 from einops import rearrange
 from jaxtyping import Float
 from PIL import Image
@@ -22,6 +23,21 @@ def rescale(
     return rearrange(image_new, "h w c -> c h w")
 
 
+def rescale_batch(
+    images: Float[Tensor, "batch c h_in w_in"],
+    shape: tuple[int, int],
+) -> Float[Tensor, "batch c h_out w_out"]:
+    """Resize a batch of images at once. Unlike rescale, this stays in floating point,
+    so it neither quantizes the images nor copies them through NumPy and PIL. PIL's
+    Lanczos filter isn't available in PyTorch, so an antialiased bicubic filter, which
+    is designed to match PIL's, is used instead.
+    """
+    if images.shape[-2:] == shape:
+        return images
+    images = F.interpolate(images, shape, mode="bicubic", antialias=True)
+    return images.clip(min=0, max=1)
+
+
 def center_crop(
     images: Float[Tensor, "*#batch c h w"],
     intrinsics: Float[Tensor, "*#batch 3 3"],
@@ -69,7 +85,7 @@ def rescale_and_crop(
     # changing the intrinsics based on how the images are rounded.
     *batch, c, h, w = images.shape
     images = images.reshape(-1, c, h, w)
-    images = torch.stack([rescale(image, (h_scaled, w_scaled)) for image in images])
+    images = rescale_batch(images, (h_scaled, w_scaled))
     images = images.reshape(*batch, c, h_scaled, w_scaled)
 
     return center_crop(images, intrinsics, shape)
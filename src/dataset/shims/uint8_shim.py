@@ -0,0 +1,37 @@
+import torch
+
+from ...misc.image_io import images_to_float, images_to_uint8
+from ..types import AnyExample, AnyViews
+
+
+def apply_uint8_shim_to_views(views: AnyViews) -> AnyViews:
+    return {**views, "image": images_to_uint8(views["image"])}
+
+
+def apply_uint8_shim(example: AnyExample) -> AnyExample:
+    """Convert the example's images to uint8. This makes examples 4x smaller to send
+    from data loader workers to the main process and GPU. The model's data shim
+    converts the images back to float (see apply_float_shim).
+    """
+    return {
+        **example,
+        "context": apply_uint8_shim_to_views(example["context"]),
+        "target": apply_uint8_shim_to_views(example["target"]),
+    }
+
+
+def apply_float_shim_to_views(views: AnyViews) -> AnyViews:
+    if views["image"].dtype != torch.uint8:
+        return views
+    return {**views, "image": images_to_float(views["image"])}
+
+
+def apply_float_shim(example: AnyExample) -> AnyExample:
+    """Convert uint8 images (see apply_uint8_shim) back to float. Examples that already
+    have float images are left unchanged.
+    """
+    return {
+        **example,
+        "context": apply_float_shim_to_views(example["context"]),
+        "target": apply_float_shim_to_views(example["target"]),
+    }
@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Literal
 
 
 @dataclass
@@ -21,3 +22,14 @@ class EvaluationCfg:
     side_by_side_path: Path | None
     animate_side_by_side: bool
     highlighted: list[SceneCfg]
+    # LPIPS runs VGG on this many images at once, optionally in reduced precision.
+    lpips_chunk_size: int = 16
+    lpips_precision: Literal["float32", "float16", "bfloat16"] = "float32"
+    # Per-scene results are cached here, keyed by the contents of each method's images,
+    # so that reruns only evaluate new or changed methods. Disabled (null) by default,
+    # e.g., enable it with evaluation.cache_path=baselines/re10k/metric_cache.
+    cache_path: Path | None = None
+    # The number of threads that read and decode images.
+    num_load_threads: int = 8
+    # The number of side-by-side animations that are encoded at once in the background.
+    num_encoding_workers: int = 2
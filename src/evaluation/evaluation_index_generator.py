@@ -1,15 +1,18 @@
+import hashlib
 import json
 from dataclasses import asdict, dataclass
 from pathlib import Path
 
 import torch
 from einops import rearrange
+from jaxtyping import Float, Int64
 from pytorch_lightning import LightningModule
+from torch import Tensor
 from tqdm import tqdm
 
 from ..geometry.epipolar_lines import project_rays
 from ..geometry.projection import get_world_rays, sample_image_grid
-from ..misc.image_io import save_image
+from ..misc.image_io import images_to_float, save_image
 from ..visualization.annotation import add_label
 from ..visualization.layout import add_border, hcat
 
@@ -24,6 +27,8 @@ class EvaluationIndexGeneratorCfg:
     output_path: Path
     save_previews: bool
     seed: int
+    # The number of view pairs whose overlaps are computed in one batched call.
+    overlap_batch_size: int = 32
 
 
 @dataclass
@@ -32,6 +37,17 @@ class IndexEntry:
     target: tuple[int, ...]
 
 
+def get_scene_generator(seed: int, scene: str) -> torch.Generator:
+    """Get a generator that depends only on the seed and the scene. Unlike a generator
+    shared across scenes, this makes a scene's entry independent of which other scenes
+    were indexed before it (and by which process).
+    """
+    digest = hashlib.sha256(f"{seed}/{scene}".encode()).digest()
+    generator = torch.Generator()
+    generator.manual_seed(int.from_bytes(digest[:8], "little") & (2**63 - 1))
+    return generator
+
+
 class EvaluationIndexGenerator(LightningModule):
     generator: torch.Generator
     cfg: EvaluationIndexGeneratorCfg
@@ -44,60 +60,120 @@ class EvaluationIndexGenerator(LightningModule):
         self.generator.manual_seed(cfg.seed)
         self.index = {}
 
+    def compute_overlaps(
+        self,
+        xy: Float[Tensor, "ray 2"],
+        extrinsics: Float[Tensor, "view 4 4"],
+        intrinsics: Float[Tensor, "view 3 3"],
+        pairs: Int64[Tensor, "pair 2"],
+    ) -> Float[Tensor, " pair"]:
+        """For each (source, target) pair, compute the fraction of the source view's
+        rays that overlap the target view's image. Pairs are processed in batches.
+        """
+        overlaps = []
+        for batch_pairs in pairs.split(self.cfg.overlap_batch_size):
+            source, target = batch_pairs.unbind(dim=-1)
+            origins, directions = get_world_rays(
+                xy,
+                extrinsics[source][:, None],
+                intrinsics[source][:, None],
+            )
+            projection = project_rays(
+                origins,
+                directions,
+                extrinsics[target][:, None],
+                intrinsics[target][:, None],
+            )
+            overlaps.append(projection["overlaps_image"].float().mean(dim=-1))
+        return torch.cat(overlaps)
+
     def test_step(self, batch, batch_idx):
-        b, v, _, h, w = batch["target"]["image"].shape
+        b, _, _, _, _ = batch["target"]["image"].shape
         assert b == 1
-        extrinsics = batch["target"]["extrinsics"][0]
-        intrinsics = batch["target"]["intrinsics"][0]
         scene = batch["scene"][0]
 
-        context_indices = torch.randperm(v, generator=self.generator)
+        # The data loader can produce uint8 images (see apply_uint8_shim). This module
+        # can't import the shim, since src.dataset imports it.
+        images = batch["target"]["image"][0]
+        if images.dtype == torch.uint8:
+            images = images_to_float(images)
+        self.index[scene] = self.index_scene(
+            scene,
+            images,
+            batch["target"]["extrinsics"][0],
+            batch["target"]["intrinsics"][0],
+            self.generator,
+        )
+
+    def index_scene(
+        self,
+        scene: str,
+        images: Float[Tensor, "view 3 height width"],
+        extrinsics: Float[Tensor, "view 4 4"],
+        intrinsics: Float[Tensor, "view 3 3"],
+        generator: torch.Generator,
+    ) -> IndexEntry | None:
+        """Pick context and target views for a scene, using the given generator for all
+        random choices. Return None if no pair of views is suitable.
+        """
+        v, _, h, w = images.shape
+        xy, _ = sample_image_grid((h, w), self.device)
+        xy = rearrange(xy, "h w xy -> (h w) xy")
+
+        # Overlaps are computed lazily, since the search below usually stops long before
+        # every pair of views has been visited. Entry (i, j) is the fraction of view i's
+        # rays that overlap view j's image. NaN marks entries that aren't computed yet.
+        overlaps = torch.full((v, v), torch.nan, dtype=torch.float32)
+
+        def get_overlaps(context_index: int, candidates: list[int]) -> None:
+            candidates = [i for i in candidates if overlaps[i, context_index].isnan()]
+            if not candidates:
+                return
+            pairs = [(i, context_index) for i in candidates]
+            pairs += [(context_index, i) for i in candidates]
+            pairs = torch.tensor(pairs, dtype=torch.int64, device=self.device)
+            values = self.compute_overlaps(xy, extrinsics, intrinsics, pairs).cpu()
+            overlaps[pairs[:, 0].cpu(), pairs[:, 1].cpu()] = values
+
+        context_indices = torch.randperm(v, generator=generator)
         for context_index in tqdm(context_indices, "Finding context pair"):
-            xy, _ = sample_image_grid((h, w), self.device)
-            context_origins, context_directions = get_world_rays(
-                rearrange(xy, "h w xy -> (h w) xy"),
-                extrinsics[context_index],
-                intrinsics[context_index],
-            )
+            context_index = context_index.item()
 
             # Step away from context view until the minimum overlap threshold is met.
+            # The overlaps for the next few steps are computed together.
+            steps_per_batch = max(self.cfg.overlap_batch_size // 2, 1)
             valid_indices = []
             for step in (1, -1):
                 min_distance = self.cfg.min_distance
                 max_distance = self.cfg.max_distance
                 current_index = context_index + step * min_distance
 
-                while 0 <= current_index.item() < v:
-                    # Compute overlap.
-                    current_origins, current_directions = get_world_rays(
-                        rearrange(xy, "h w xy -> (h w) xy"),
-                        extrinsics[current_index],
-                        intrinsics[current_index],
+                while 0 <= current_index < v:
+                    # Look up the overlap. Views beyond the maximum distance (plus the
+                    # one step that ends the search) are never visited.
+                    candidates = range(
+                        current_index,
+                        current_index + step * steps_per_batch,
+                        step,
                     )
-                    projection_onto_current = project_rays(
-                        context_origins,
-                        context_directions,
-                        extrinsics[current_index],
-                        intrinsics[current_index],
+                    get_overlaps(
+                        context_index,
+                        [
+                            i
+                            for i in candidates
+                            if 0 <= i < v and abs(i - context_index) <= max_distance + 1
+                        ],
                     )
-                    projection_onto_context = project_rays(
-                        current_origins,
-                        current_directions,
-                        extrinsics[context_index],
-                        intrinsics[context_index],
-                    )
-                    overlap_a = projection_onto_context["overlaps_image"].float().mean()
-                    overlap_b = projection_onto_current["overlaps_image"].float().mean()
+                    overlap_a = overlaps[current_index, context_index]
+                    overlap_b = overlaps[context_index, current_index]
 
                     overlap = min(overlap_a, overlap_b)
-                    delta = (current_index - context_index).abs()
+                    delta = abs(current_index - context_index)
 
                     min_overlap = self.cfg.min_overlap
                     max_overlap = self.cfg.max_overlap
                     if min_overlap <= overlap <= max_overlap:
-                        valid_indices.append(
-                            (current_index.item(), overlap_a, overlap_b)
-                        )
+                        valid_indices.append((current_index, overlap_a, overlap_b))
 
                     # Stop once the camera has panned away too much.
                     if overlap < min_overlap or delta > max_distance:
@@ -109,12 +185,12 @@ class EvaluationIndexGenerator(LightningModule):
                 # Pick a random valid view. Index the resulting views.
                 num_options = len(valid_indices)
                 chosen = torch.randint(
-                    0, num_options, size=tuple(), generator=self.generator
+                    0, num_options, size=tuple(), generator=generator
                 )
                 chosen, overlap_a, overlap_b = valid_indices[chosen]
 
-                context_left = min(chosen, context_index.item())
-                context_right = max(chosen, context_index.item())
+                context_left = min(chosen, context_index)
+                context_right = max(chosen, context_index)
                 delta = context_right - context_left
 
                 # Pick non-repeated random target views.
@@ -123,13 +199,13 @@ class EvaluationIndexGenerator(LightningModule):
                         context_left,
                         context_right + 1,
                         (self.cfg.num_target_views,),
-                        generator=self.generator,
+                        generator=generator,
                     )
                     if (target_views.unique(return_counts=True)[1] == 1).all():
                         break
 
                 target = tuple(sorted(target_views.tolist()))
-                self.index[scene] = IndexEntry(
+                entry = IndexEntry(
                     context=(context_left, context_right),
                     target=target,
                 )
@@ -138,17 +214,17 @@ class EvaluationIndexGenerator(LightningModule):
                 if self.cfg.save_previews:
                     preview_path = self.cfg.output_path / "previews"
                     preview_path.mkdir(exist_ok=True, parents=True)
-                    a = batch["target"]["image"][0, chosen]
+                    a = images[chosen]
                     a = add_label(a, f"Overlap: {overlap_a * 100:.1f}%")
-                    b = batch["target"]["image"][0, context_index]
+                    b = images[context_index]
                     b = add_label(b, f"Overlap: {overlap_b * 100:.1f}%")
                     vis = add_border(add_border(hcat(a, b)), 1, 0)
                     vis = add_label(vis, f"Distance: {delta} frames")
                     save_image(add_border(vis), preview_path / f"{scene}.png")
-                break
-        else:
-            # This happens if no starting frame produces a valid evaluation example.
-            self.index[scene] = None
+                return entry
+
+        # This happens if no starting frame produces a valid evaluation example.
+        return None
 
     def save_index(self) -> None:
         self.cfg.output_path.mkdir(exist_ok=True, parents=True)
@@ -0,0 +1,117 @@
+from dataclasses import dataclass
+from functools import cache
+from time import time
+
+import torch
+from jaxtyping import Float
+from lpips import LPIPS, normalize_tensor
+from torch import Tensor
+
+# The number of images that go through VGG at once. This bounds the memory taken up by
+# activations, which is substantial for large images.
+LPIPS_CHUNK_SIZE = 16
+
+# The VGG features of a batch of images, one tensor per LPIPS layer.
+LpipsFeatures = list[Float[Tensor, "batch channel height width"]]
+
+
+@dataclass
+class LpipsStats:
+    num_images: int = 0
+    seconds: float = 0.0
+
+    @property
+    def seconds_per_image(self) -> float:
+        return self.seconds / max(self.num_images, 1)
+
+
+class LpipsService:
+    """A single LPIPS (VGG) model per device that's shared by the LPIPS loss and the
+    LPIPS metric. Metrics are computed in memory-bounded chunks, optionally in reduced
+    precision, and the ground truth's features can be extracted once and reused when
+    several predictions are compared against the same ground truth.
+    """
+
+    model: LPIPS
+    stats: LpipsStats
+
+    def __init__(self, device: torch.device) -> None:
+        self.model = LPIPS(net="vgg").to(device).eval()
+        self.model.requires_grad_(False)
+        self.stats = LpipsStats()
+
+    def forward(
+        self,
+        predicted: Float[Tensor, "batch channel height width"],
+        ground_truth: Float[Tensor, "batch channel height width"],
+        training: bool,
+    ) -> Float[Tensor, "batch 1 1 1"]:
+        """Compute LPIPS in a differentiable way (for the loss). The model's weights are
+        frozen, but gradients flow to the images. In training mode, LPIPS's dropout
+        layers are active, as they were when the loss had its own LPIPS module.
+        """
+        self.model.train(training)
+        try:
+            return self.model.forward(predicted, ground_truth, normalize=True)
+        finally:
+            self.model.eval()
+
+    @torch.no_grad()
+    def extract_features(
+        self,
+        images: Float[Tensor, "batch channel height width"],
+        chunk_size: int = LPIPS_CHUNK_SIZE,
+        dtype: torch.dtype | None = None,
+    ) -> LpipsFeatures:
+        """Extract normalized VGG features for images with values in [0, 1]."""
+        chunks = []
+        for chunk in images.split(chunk_size):
+            with torch.autocast(images.device.type, dtype, enabled=dtype is not None):
+                chunk = self.model.scaling_layer(2 * chunk - 1)
+                features = self.model.net.forward(chunk)
+            chunks.append([normalize_tensor(feature.float()) for feature in features])
+        return [torch.cat(layer) for layer in zip(*chunks)]
+
+    @torch.no_grad()
+    def compute(
+        self,
+        ground_truth: Float[Tensor, "batch channel height width"],
+        predicted: Float[Tensor, "batch channel height width"],
+        ground_truth_features: LpipsFeatures | None = None,
+        chunk_size: int = LPIPS_CHUNK_SIZE,
+        dtype: torch.dtype | None = None,
+    ) -> Float[Tensor, " batch"]:
+        """Compute LPIPS between images with values in [0, 1]. The ground truth's
+        features (from extract_features) can be passed in to avoid extracting them
+        again. This trades memory for time, since all of them are kept around.
+        """
+        start_time = time()
+        values = []
+        for start in range(0, predicted.shape[0], chunk_size):
+            end = start + chunk_size
+            if ground_truth_features is None:
+                features_a = self.extract_features(
+                    ground_truth[start:end], chunk_size, dtype
+                )
+            else:
+                features_a = [feature[start:end] for feature in ground_truth_features]
+            features_b = self.extract_features(predicted[start:end], chunk_size, dtype)
+
+            # This matches LPIPS.forward.
+            value = 0
+            for lin, a, b in zip(self.model.lins, features_a, features_b):
+                value = value + lin((a - b) ** 2).mean(dim=(2, 3))
+            values.append(value[:, 0])
+        values = torch.cat(values)
+
+        # Synchronize to make the timings meaningful.
+        if predicted.device.type == "cuda":
+            torch.cuda.synchronize(predicted.device)
+        self.stats.num_images += predicted.shape[0]
+        self.stats.seconds += time() - start_time
+        return values
+
+
+@cache
+def get_lpips(device: torch.device) -> LpipsService:
+    return LpipsService(device)
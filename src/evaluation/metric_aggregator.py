@@ -0,0 +1,222 @@
+import json
+from pathlib import Path
+from typing import Iterator
+
+from ..misc.journal import open_journal
+
+# The quantiles that are estimated for every metric.
+QUANTILES = (0.1, 0.5, 0.9)
+
+
+class P2Quantile:
+    """Estimates a quantile in constant memory and time per value using the P² algorithm
+    (Jain and Chlamtac, 1985). Until five values have been seen, the quantile is exact.
+    """
+
+    def __init__(self, p: float) -> None:
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        h = self.heights
+        if len(h) < 5:
+            h.append(value)
+            h.sort()
+            return
+
+        # Find the cell that the value falls into and update the extreme markers.
+        if value < h[0]:
+            h[0] = value
+            k = 0
+        elif value >= h[4]:
+            h[4] = value
+            k = 3
+        else:
+            k = max(i for i in range(4) if h[i] <= value)
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers toward their desired positions.
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = h[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not h[i - 1] < height < h[i + 1]:
+                    height = h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+                h[i] = height
+                n[i] += d
+
+    @property
+    def value(self) -> float:
+        h = self.heights
+        if len(h) == 0:
+            return float("nan")
+        if self.count <= 5:
+            # Every value is still stored, so interpolate between them.
+            x = self.p * (len(h) - 1)
+            i = int(x)
+            j = min(i + 1, len(h) - 1)
+            return h[i] + (x - i) * (h[j] - h[i])
+        return h[2]
+
+
+class RunningStatistic:
+    """Tracks a metric's mean, variance (using Welford's algorithm), extremes and
+    approximate quantiles in constant memory and time per value.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.quantiles = {q: P2Quantile(q) for q in QUANTILES}
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        for quantile in self.quantiles.values():
+            quantile.add(value)
+
+    @property
+    def std(self) -> float:
+        return (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else 0.0
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "std": self.std,
+            "min": self.min,
+            "max": self.max,
+            **{f"p{round(q * 100)}": v.value for q, v in self.quantiles.items()},
+        }
+
+
+class MetricAggregator:
+    """Aggregates per-scene test metrics as they come in. Each rank appends its scenes'
+    metrics to its own JSONL file in the given directory, which is flushed every
+    flush_interval scenes. When resuming, every rank's file is replayed, which tells the
+    caller which scenes are already finished. Scenes that weren't flushed before a crash
+    are simply evaluated again. Once all ranks are done, merge combines their files.
+
+    Replaying restores the count, mean, variance and extremes exactly. The P² quantile
+    estimates depend on the order of the values, so they're only approximately restored
+    when resuming. To make the final statistics independent of the number of ranks and
+    of resuming, merge replays the scenes sorted by key.
+    """
+
+    path: Path
+    flush_interval: int
+    stats: dict[str, RunningStatistic]
+    scenes: set[str]
+
+    def __init__(
+        self,
+        path: Path,
+        rank: int,
+        world_size: int,
+        flush_interval: int,
+        resume: bool,
+    ) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.stats = {}
+        self.scenes = set()
+        self.pending = []
+
+        path.mkdir(exist_ok=True, parents=True)
+        file_path = path / f"{rank:0>3}.jsonl"
+        if resume:
+            for record in self.read_records():
+                self.update(record["scene"], record["metrics"])
+            self.file = open_journal(file_path)
+        else:
+            # Files left behind by ranks that don't exist in this run would otherwise
+            # be merged in. Every other rank truncates its own file.
+            if rank == 0:
+                for stale_path in path.glob("*.jsonl"):
+                    if stale_path.stem.isdigit() and int(stale_path.stem) >= world_size:
+                        stale_path.unlink()
+            self.file = file_path.open("w")
+
+    def update(self, scene: str, metrics: dict[str, float]) -> None:
+        self.scenes.add(scene)
+        for name, value in metrics.items():
+            if name not in self.stats:
+                self.stats[name] = RunningStatistic()
+            self.stats[name].add(value)
+
+    def add(self, scene: str, metrics: dict[str, float]) -> None:
+        self.update(scene, metrics)
+        self.pending.append({"scene": scene, "metrics": metrics})
+        if len(self.pending) >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        for record in self.pending:
+            self.file.write(f"{json.dumps(record)}\n")
+        self.file.flush()
+        self.pending = []
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+
+    def merge(self) -> None:
+        """Replace the statistics with those of every rank's flushed records. Call this
+        after every rank has closed its aggregator.
+        """
+        self.stats = {}
+        self.scenes = set()
+        for record in self.read_sorted_records():
+            self.update(record["scene"], record["metrics"])
+
+    def read_sorted_records(self) -> list[dict]:
+        return sorted(self.read_records(), key=lambda record: record["scene"])
+
+    def read_records(self) -> Iterator[dict]:
+        """Read every rank's flushed records. A line that was cut off by a crash is
+        ignored. A scene that several ranks evaluated (a distributed sampler repeats
+        scenes to even out the ranks) is only read once.
+        """
+        scenes = set()
+        for journal_path in sorted(self.path.glob("*.jsonl")):
+            with journal_path.open("r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record["scene"] not in scenes:
+                        scenes.add(record["scene"])
+                        yield record
+
+    def read_scores(self) -> dict[str, list[float]]:
+        """Read every flushed score, grouped by metric and sorted by scene."""
+        scores = {}
+        for record in self.read_sorted_records():
+            for name, value in record["metrics"].items():
+                scores.setdefault(name, []).append(value)
+        return scores
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        return {name: stat.summary() for name, stat in self.stats.items()}
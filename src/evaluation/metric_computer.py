@@ -1,96 +1,307 @@
-import os
+import hashlib
+import json
 from pathlib import Path
 
 import torch
+from jaxtyping import Float, Int64
 from pytorch_lightning import LightningModule
 from tabulate import tabulate
+from torch import Tensor
 
-from ..misc.image_io import load_image, save_image
+from ..dataset.collate import get_view_mask
+from ..dataset.image_decoding import decode_images, get_executor
+from ..dataset.shims.uint8_shim import apply_float_shim
+from ..misc.image_io import save_image
+from ..misc.journal import open_journal
+from ..misc.video_encoder import VideoEncoder
 from ..visualization.annotation import add_label
 from ..visualization.layout import add_border, hcat
 from .evaluation_cfg import EvaluationCfg
-from .metrics import compute_lpips, compute_psnr, compute_ssim
+from .lpips_service import get_lpips
+from .metrics import METRIC_VERSION, compute_psnr, compute_ssim
+
+
+def read_cache(path: Path) -> dict[str, dict[str, float]]:
+    """Read every cache file in the directory. A line that was cut off by a crash is
+    ignored, which means that its result is computed again.
+    """
+    cache = {}
+    for cache_path in sorted(path.glob("*.jsonl")):
+        with cache_path.open("r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                cache[record["key"]] = record["metrics"]
+    return cache
 
 
 class MetricComputer(LightningModule):
     cfg: EvaluationCfg
+    cache: dict[str, dict[str, float]]
 
     def __init__(self, cfg: EvaluationCfg) -> None:
         super().__init__()
         self.cfg = cfg
+        self.cache = {}
+        self.cache_file = None
+        self.video_encoder = None
 
-    def test_step(self, batch, batch_idx):
-        scene = batch["scene"][0]
-        b, cv, _, _, _ = batch["context"]["image"].shape
-        assert b == 1
-        _, v, _, _, _ = batch["target"]["image"].shape
+    def on_test_start(self) -> None:
+        # Load the results of earlier runs. Each rank appends its new results to its
+        # own file, which makes the cache safe to write from several processes.
+        self.cache = {}
+        self.cache_file = None
+        if self.cfg.cache_path is not None:
+            self.cache = read_cache(self.cfg.cache_path)
+            self.cfg.cache_path.mkdir(exist_ok=True, parents=True)
+            self.cache_file = open_journal(
+                self.cfg.cache_path / f"{self.global_rank:0>3}.jsonl"
+            )
+            print(f"Loaded {len(self.cache)} cached results.")
+
+        self.video_encoder = None
+        if self.cfg.side_by_side_path is not None and self.cfg.animate_side_by_side:
+            self.video_encoder = VideoEncoder(self.cfg.num_encoding_workers)
 
-        # Skip scenes.
+    def read_images(
+        self,
+        scene: str,
+        indices: Int64[Tensor, " view"],
+    ) -> dict[str, list[bytearray]] | None:
+        """Read each method's encoded images for the given scene on a thread pool, or
+        return None if any are missing.
+        """
         for method in self.cfg.methods:
             if not (method.path / scene).exists():
-                print(f'Skipping "{scene}".')
-                return
-
-        # Load the images.
-        all_images = {}
+                return None
+        paths = [
+            method.path / scene / f"color/{index.item():0>6}.png"
+            for method in self.cfg.methods
+            for index in indices
+        ]
+        executor = get_executor(self.cfg.num_load_threads)
         try:
-            for method in self.cfg.methods:
-                images = [
-                    load_image(method.path / scene / f"color/{index.item():0>6}.png")
-                    for index in batch["target"]["index"][0]
-                ]
-                all_images[method.key] = torch.stack(images).to(self.device)
+            images = list(
+                executor.map(lambda path: bytearray(path.read_bytes()), paths)
+            )
         except FileNotFoundError:
-            print(f'Skipping "{scene}".')
+            return None
+        v = len(indices)
+        return {
+            method.key: images[i * v : (i + 1) * v]
+            for i, method in enumerate(self.cfg.methods)
+        }
+
+    def decode(self, images: list[bytearray]) -> Float[Tensor, "view 3 height width"]:
+        images = [torch.frombuffer(image, dtype=torch.uint8) for image in images]
+        return decode_images(images, self.cfg.num_load_threads).to(self.device)
+
+    def get_cache_key(
+        self,
+        ground_truth_digest: str,
+        images: list[bytearray],
+    ) -> str:
+        """Key a method's result for a scene by the contents of its images, the ground
+        truth, the metrics' implementation version, and the settings that affect the
+        metrics.
+        """
+        digest = hashlib.sha256()
+        digest.update(
+            f"{ground_truth_digest}/{METRIC_VERSION}/{self.cfg.lpips_precision}".encode()
+        )
+        for image in images:
+            digest.update(hashlib.sha256(image).digest())
+        return digest.hexdigest()
+
+    def test_step(self, batch, batch_idx):
+        # The data loader produces None when every example in a batch is skipped.
+        if batch is None:
             return
+        # The data loader can produce uint8 images (see apply_uint8_shim).
+        batch = apply_float_shim(batch)
 
-        # Compute metrics.
-        all_metrics = {}
-        rgb_gt = batch["target"]["image"][0]
-        for key, images in all_images.items():
+        # A batch can hold several scenes, whose target views are padded to the same
+        # number of views. Skip scenes whose images are missing.
+        num_views = get_view_mask(batch["target"]).sum(dim=1).tolist()
+        scenes = []
+        for i, scene in enumerate(batch["scene"]):
+            n = num_views[i]
+            encoded = self.read_images(scene, batch["target"]["index"][i, :n])
+            if encoded is None:
+                print(f'Skipping "{scene}".')
+                continue
+
+            # Look up each method's result. Results are keyed by content, so a method
+            # whose images changed is evaluated again.
+            rgb_gt = batch["target"]["image"][i, :n]
+            gt_bytes = (rgb_gt * 255).round().to(torch.uint8).cpu().contiguous()
+            gt_digest = hashlib.sha256(gt_bytes.numpy().tobytes()).hexdigest()
+            keys = {
+                method.key: self.get_cache_key(gt_digest, encoded[method.key])
+                for method in self.cfg.methods
+            }
+            metrics = {
+                method.key: self.cache[keys[method.key]]
+                for method in self.cfg.methods
+                if keys[method.key] in self.cache
+            }
+            scenes.append((i, scene, encoded, keys, metrics))
+        if not scenes:
+            return
+
+        # Compute metrics for every uncached (scene, method) pair at once, then split
+        # them by pair. The ground truth's LPIPS features are extracted once per scene
+        # and reused for every method.
+        pending = [
+            (j, method.key)
+            for j, (_, _, _, _, metrics) in enumerate(scenes)
+            for method in self.cfg.methods
+            if method.key not in metrics
+        ]
+        if pending:
+            pending_scenes = sorted({j for j, _ in pending})
+            rgb_gt = torch.cat(
+                [
+                    batch["target"]["image"][scenes[j][0], : num_views[scenes[j][0]]]
+                    for j in pending_scenes
+                ]
+            )
+            lpips = get_lpips(self.device)
+            lpips_chunk_size = self.cfg.lpips_chunk_size
+            lpips_dtype = None
+            if self.cfg.lpips_precision != "float32":
+                lpips_dtype = getattr(torch, self.cfg.lpips_precision)
+            gt_features = lpips.extract_features(rgb_gt, lpips_chunk_size, lpips_dtype)
+
+            # Select each pair's ground truth views.
+            offsets = {}
+            offset = 0
+            for j in pending_scenes:
+                offsets[j] = offset
+                offset += num_views[scenes[j][0]]
+            counts = [num_views[scenes[j][0]] for j, _ in pending]
+            gt_indices = torch.cat(
+                [
+                    torch.arange(offsets[j], offsets[j] + n, device=self.device)
+                    for (j, _), n in zip(pending, counts)
+                ]
+            )
+            gt_features = [feature[gt_indices] for feature in gt_features]
+            rgb_gt = rgb_gt[gt_indices]
+            images = self.decode(
+                [image for j, key in pending for image in scenes[j][2][key]]
+            )
+
+            scores = {
+                "lpips": lpips.compute(
+                    rgb_gt, images, gt_features, lpips_chunk_size, lpips_dtype
+                ),
+                "ssim": compute_ssim(rgb_gt, images),
+                "psnr": compute_psnr(rgb_gt, images),
+            }
+            scores = {
+                metric: [score.mean().item() for score in values.split(counts)]
+                for metric, values in scores.items()
+            }
+            for p, (j, key) in enumerate(pending):
+                _, scene, _, keys, metrics = scenes[j]
+                metrics[key] = {metric: scores[metric][p] for metric in scores}
+                self.add_to_cache(scene, key, keys[key], metrics[key])
+
+        for i, scene, encoded, _, metrics in scenes:
             all_metrics = {
-                **all_metrics,
-                f"lpips_{key}": compute_lpips(rgb_gt, images).mean(),
-                f"ssim_{key}": compute_ssim(rgb_gt, images).mean(),
-                f"psnr_{key}": compute_psnr(rgb_gt, images).mean(),
+                f"{metric}_{method.key}": value
+                for method in self.cfg.methods
+                for metric, value in metrics[method.key].items()
             }
-        self.log_dict(all_metrics)
-        self.print_preview_metrics(all_metrics)
+            self.log_dict(all_metrics, batch_size=1)
+            self.print_preview_metrics(all_metrics)
 
-        # Skip the rest if no side-by-side is needed.
-        if self.cfg.side_by_side_path is None:
-            return
+            # Skip the rest if no side-by-side is needed.
+            if self.cfg.side_by_side_path is not None:
+                self.save_side_by_side(
+                    f"{batch_idx:0>6}_{scene}",
+                    scene,
+                    batch["target"]["image"][i, : num_views[i]],
+                    batch["target"]["index"][i, : num_views[i]],
+                    {key: self.decode(images) for key, images in encoded.items()},
+                )
 
+    def add_to_cache(
+        self,
+        scene: str,
+        method: str,
+        key: str,
+        metrics: dict[str, float],
+    ) -> None:
+        self.cache[key] = metrics
+        if self.cache_file is not None:
+            record = {"key": key, "scene": scene, "method": method, "metrics": metrics}
+            self.cache_file.write(f"{json.dumps(record)}\n")
+            self.cache_file.flush()
+
+    def save_side_by_side(
+        self,
+        scene_key: str,
+        scene: str,
+        rgb_gt: Float[Tensor, "view 3 height width"],
+        indices: Int64[Tensor, " view"],
+        all_images: dict[str, Float[Tensor, "view 3 height width"]],
+    ) -> None:
         # Create side-by-side.
-        scene_key = f"{batch_idx:0>6}_{scene}"
-        for i in range(v):
-            true_index = batch["target"]["index"][0, i]
-            row = [add_label(batch["target"]["image"][0, i], "Ground Truth")]
+        rows = []
+        for i, true_index in enumerate(indices):
+            row = [add_label(rgb_gt[i], "Ground Truth")]
             for method in self.cfg.methods:
                 image = all_images[method.key][i]
                 image = add_label(image, method.name)
                 row.append(image)
-            start_frame = batch["target"]["index"][0, 0]
-            end_frame = batch["target"]["index"][0, -1]
-            label = f"Scene {batch['scene'][0]} (frames {start_frame} to {end_frame})"
+            start_frame = indices[0]
+            end_frame = indices[-1]
+            label = f"Scene {scene} (frames {start_frame} to {end_frame})"
             row = add_border(add_label(hcat(*row), label, font_size=16))
             save_image(
                 row,
                 self.cfg.side_by_side_path / scene_key / f"{true_index:0>6}.png",
             )
+            rows.append(row)
 
-        # Create an animation.
+        # Queue an animation, which is encoded in the background.
         if self.cfg.animate_side_by_side:
-            (self.cfg.side_by_side_path / "videos").mkdir(exist_ok=True, parents=True)
-            command = (
-                'ffmpeg -y -framerate 30 -pattern_type glob -i "*.png"  -c:v libx264 '
-                '-pix_fmt yuv420p -vf "pad=ceil(iw/2)*2:ceil(ih/2)*2"'
-            )
-            os.system(
-                f"cd {self.cfg.side_by_side_path / scene_key} && {command} "
-                f"{Path.cwd()}/{self.cfg.side_by_side_path}/videos/{scene_key}.mp4"
+            self.video_encoder.submit(
+                torch.stack(rows),
+                self.cfg.side_by_side_path / "videos" / f"{scene_key}.mp4",
             )
 
+    def on_test_end(self) -> None:
+        # The animations are cosmetic, so failed encodes are reported rather than
+        # raised, which would discard the metrics.
+        try:
+            if self.video_encoder is not None:
+                try:
+                    videos, errors = self.video_encoder.flush()
+                finally:
+                    self.video_encoder.close()
+                    self.video_encoder = None
+                for video in videos:
+                    print(
+                        f"Encoded {video.path} ({video.num_frames} frames) in "
+                        f"{video.seconds:.2f} seconds."
+                    )
+                for error in errors:
+                    print(f"Failed to encode a side-by-side animation: {error}")
+        finally:
+            if self.cache_file is not None:
+                self.cache_file.close()
+                self.cache_file = None
+        stats = get_lpips(self.device).stats
+        print(
+            f"LPIPS: {stats.num_images} images, "
+            f"{stats.seconds_per_image:.4f} seconds per image"
+        )
+
     def print_preview_metrics(self, metrics: dict[str, float]) -> None:
         if getattr(self, "running_metrics", None) is None:
             self.running_metrics = metrics
@@ -1,12 +1,18 @@
 from functools import cache
 
 import torch
-from einops import reduce
+import torch.nn.functional as F
+from einops import rearrange, reduce
 from jaxtyping import Float
-from lpips import LPIPS
 from skimage.metrics import structural_similarity
 from torch import Tensor
 
+from .lpips_service import LPIPS_CHUNK_SIZE, LpipsFeatures, get_lpips
+
+# Cached metric values (see MetricComputer) are keyed by this version. Bump it whenever
+# a change to a metric's implementation changes its values.
+METRIC_VERSION = 1
+
 
 @torch.no_grad()
 def compute_psnr(
@@ -19,25 +25,93 @@ def compute_psnr(
     return -10 * mse.log10()
 
 
+@torch.no_grad()
+def compute_lpips(
+    ground_truth: Float[Tensor, "batch channel height width"],
+    predicted: Float[Tensor, "batch channel height width"],
+    ground_truth_features: LpipsFeatures | None = None,
+    chunk_size: int = LPIPS_CHUNK_SIZE,
+    dtype: torch.dtype | None = None,
+) -> Float[Tensor, " batch"]:
+    return get_lpips(predicted.device).compute(
+        ground_truth, predicted, ground_truth_features, chunk_size, dtype
+    )
+
+
+# These match skimage.metrics.structural_similarity with gaussian_weights=True, which
+# is how SSIM was computed originally (see compute_ssim_skimage).
+SSIM_WINDOW_SIZE = 11
+SSIM_SIGMA = 1.5
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+
+
 @cache
-def get_lpips(device: torch.device) -> LPIPS:
-    return LPIPS(net="vgg").to(device)
+def get_ssim_kernel(device: torch.device, dtype: torch.dtype) -> Float[Tensor, " tap"]:
+    x = torch.arange(SSIM_WINDOW_SIZE, dtype=torch.float64) - SSIM_WINDOW_SIZE // 2
+    kernel = torch.exp(-0.5 * (x / SSIM_SIGMA) ** 2)
+    return (kernel / kernel.sum()).to(device=device, dtype=dtype)
+
+
+def filter_ssim_window(
+    images: Float[Tensor, "batch channel height width"],
+) -> Float[Tensor, "batch channel cropped_height cropped_width"]:
+    """Apply the Gaussian window as two 1D convolutions. No padding is used, since
+    skimage discards the pixels within the window's radius of the border anyway.
+    """
+    b, c, _, _ = images.shape
+    kernel = get_ssim_kernel(images.device, images.dtype)
+    images = rearrange(images, "b c h w -> (b c) () h w")
+    images = F.conv2d(images, kernel[None, None, :, None])
+    images = F.conv2d(images, kernel[None, None, None, :])
+    return rearrange(images, "(b c) () h w -> b c h w", b=b, c=c)
 
 
 @torch.no_grad()
-def compute_lpips(
+def compute_ssim(
     ground_truth: Float[Tensor, "batch channel height width"],
     predicted: Float[Tensor, "batch channel height width"],
 ) -> Float[Tensor, " batch"]:
-    value = get_lpips(predicted.device).forward(ground_truth, predicted, normalize=True)
-    return value[:, 0, 0, 0]
+    """Compute SSIM for a batch of images on their device. This matches the per-image
+    scikit-image computation in compute_ssim_skimage to within 1e-4.
+    """
+    _, c, _, _ = ground_truth.shape
+    moments = filter_ssim_window(
+        torch.cat(
+            (
+                ground_truth,
+                predicted,
+                ground_truth * ground_truth,
+                predicted * predicted,
+                ground_truth * predicted,
+            ),
+            dim=1,
+        )
+    )
+    mu_x, mu_y, mu_xx, mu_yy, mu_xy = moments.split(c, dim=1)
+
+    # Like skimage, use the sample (rather than population) covariance.
+    num_samples = SSIM_WINDOW_SIZE**2
+    covariance_norm = num_samples / (num_samples - 1)
+    var_x = covariance_norm * (mu_xx - mu_x * mu_x)
+    var_y = covariance_norm * (mu_yy - mu_y * mu_y)
+    cov_xy = covariance_norm * (mu_xy - mu_x * mu_y)
+
+    # The data range is 1.
+    c1 = SSIM_K1**2
+    c2 = SSIM_K2**2
+    ssim = ((2 * mu_x * mu_y + c1) * (2 * cov_xy + c2)) / (
+        (mu_x**2 + mu_y**2 + c1) * (var_x + var_y + c2)
+    )
+    return ssim.mean(dim=(1, 2, 3), dtype=torch.float64).type(predicted.dtype)
 
 
 @torch.no_grad()
-def compute_ssim(
+def compute_ssim_skimage(
     ground_truth: Float[Tensor, "batch channel height width"],
     predicted: Float[Tensor, "batch channel height width"],
 ) -> Float[Tensor, " batch"]:
+    """The original scikit-image SSIM, which compute_ssim is checked against."""
     ssim = [
         structural_similarity(
             gt.detach().cpu().numpy(),
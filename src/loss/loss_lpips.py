@@ -3,11 +3,10 @@ from dataclasses import dataclass
 import torch
 from einops import rearrange
 from jaxtyping import Float
-from lpips import LPIPS
 from torch import Tensor
 
 from ..dataset.types import BatchedExample
-from ..misc.nn_module_tools import convert_to_buffer
+from ..evaluation.lpips_service import get_lpips
 from ..model.decoder.decoder import DecoderOutput
 from ..model.types import Gaussians
 from .loss import Loss
@@ -25,14 +24,6 @@ class LossLpipsCfgWrapper:
 
 
 class LossLpips(Loss[LossLpipsCfg, LossLpipsCfgWrapper]):
-    lpips: LPIPS
-
-    def __init__(self, cfg: LossLpipsCfgWrapper) -> None:
-        super().__init__(cfg)
-
-        self.lpips = LPIPS(net="vgg")
-        convert_to_buffer(self.lpips, persistent=False)
-
     def forward(
         self,
         prediction: DecoderOutput,
@@ -46,9 +37,11 @@ class LossLpips(Loss[LossLpipsCfg, LossLpipsCfgWrapper]):
         if global_step < self.cfg.apply_after_step:
             return torch.tensor(0, dtype=torch.float32, device=image.device)
 
-        loss = self.lpips.forward(
+        # The LPIPS model is shared with the LPIPS metric. It isn't a submodule, so it's
+        # neither optimized nor saved in checkpoints.
+        loss = get_lpips(image.device).forward(
             rearrange(prediction.color, "b v c h w -> (b v) c h w"),
             rearrange(image, "b v c h w -> (b v) c h w"),
-            normalize=True,
+            self.training,
         )
         return self.cfg.weight * loss.mean()
@@ -34,6 +34,18 @@ def fig_to_image(
     return (torch.tensor(data, device=device, dtype=torch.float32) / 255)[:3]
 
 
+def images_to_uint8(
+    images: Float[Tensor, "*batch c h w"],
+) -> UInt8[Tensor, "*batch c h w"]:
+    return (images * 255).round().clip(min=0, max=255).type(torch.uint8)
+
+
+def images_to_float(
+    images: UInt8[Tensor, "*batch c h w"],
+) -> Float[Tensor, "*batch c h w"]:
+    return images.type(torch.float32) / 255
+
+
 def prep_image(image: FloatImage) -> UInt8[np.ndarray, "height width channel"]:
     # Handle batched images.
     if image.ndim == 4:
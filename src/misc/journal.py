@@ -0,0 +1,21 @@
+import os
+from pathlib import Path
+from typing import TextIO
+
+
+def open_journal(path: Path) -> TextIO:
+    """Open a JSONL journal for appending. If a crash cut off the last line, the line is
+    terminated first, so that the next record doesn't get appended to it (readers skip
+    the cut-off line, but would otherwise skip the new record with it).
+    """
+    cut_off = False
+    if path.exists():
+        with path.open("rb") as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                cut_off = f.read(1) != b"\n"
+    file = path.open("a")
+    if cut_off:
+        file.write("\n")
+        file.flush()
+    return file
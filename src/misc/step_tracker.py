@@ -1,23 +1,37 @@
-from multiprocessing import RLock
-
+import numpy as np
 import torch
 from jaxtyping import Int64
 from torch import Tensor
-from torch.multiprocessing import Manager
 
 
 class StepTracker:
-    lock: RLock
+    """Share the current step with data loader workers.
+
+    The step is a single int64 in shared memory. There's only one writer (the training
+    loop), and aligned 64-bit loads and stores are atomic on the platforms PyTorch
+    supports, so no lock (and no Manager process to provide one) is needed. Reads and
+    writes go through a NumPy view of the shared tensor, which is much cheaper than
+    Tensor.item() and Tensor.fill_(). The view is recreated after unpickling, which
+    makes this work with both the fork and spawn start methods.
+    """
+
     step: Int64[Tensor, ""]
+    view: np.ndarray
 
     def __init__(self):
-        self.lock = Manager().RLock()
         self.step = torch.tensor(0, dtype=torch.int64).share_memory_()
+        self.view = self.step.numpy()
+
+    def __getstate__(self) -> dict:
+        # Pickling the NumPy view would copy the step instead of sharing it.
+        return {"step": self.step}
+
+    def __setstate__(self, state: dict) -> None:
+        self.step = state["step"]
+        self.view = self.step.numpy()
 
     def set_step(self, step: int) -> None:
-        with self.lock:
-            self.step.fill_(step)
+        self.view[()] = step
 
     def get_step(self) -> int:
-        with self.lock:
-            return self.step.item()
+        return int(self.view)
@@ -0,0 +1,113 @@
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from threading import BoundedSemaphore
+from time import time
+
+import numpy as np
+import torch
+from einops import rearrange
+from jaxtyping import Float, UInt8
+from torch import Tensor
+
+
+@dataclass
+class EncodedVideo:
+    path: Path
+    num_frames: int
+    seconds: float
+
+
+class VideoEncoder:
+    """Encodes videos with ffmpeg on a bounded pool of background threads, so that the
+    caller doesn't wait for encodes to finish. Frames are piped to ffmpeg from memory.
+    Since queued frames take up memory, submit blocks while max_pending videos are
+    waiting to be encoded.
+    """
+
+    executor: ThreadPoolExecutor
+    pending: BoundedSemaphore
+    futures: list[Future]
+    encoded: list[EncodedVideo]
+
+    def __init__(self, num_workers: int, max_pending: int | None = None) -> None:
+        self.executor = ThreadPoolExecutor(num_workers)
+        self.pending = BoundedSemaphore(max_pending or 2 * num_workers)
+        self.futures = []
+        self.encoded = []
+
+    def submit(
+        self,
+        frames: Float[Tensor, "frame 3 height width"],
+        path: Path,
+        fps: int = 30,
+    ) -> None:
+        # Convert the frames on the caller's thread, which releases GPU memory early.
+        frames = (frames.detach().clip(min=0, max=1) * 255).type(torch.uint8)
+        frames = rearrange(frames, "f c h w -> f h w c").cpu().numpy()
+        self.pending.acquire()
+        try:
+            future = self.executor.submit(self.encode, frames, path, fps)
+        except BaseException:
+            self.pending.release()
+            raise
+        future.add_done_callback(lambda _: self.pending.release())
+        self.futures.append(future)
+
+    def encode(
+        self,
+        frames: UInt8[np.ndarray, "frame height width 3"],
+        path: Path,
+        fps: int,
+    ) -> None:
+        start_time = time()
+        path.parent.mkdir(exist_ok=True, parents=True)
+        _, h, w, _ = frames.shape
+        command = [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgb24",
+            "-s",
+            f"{w}x{h}",
+            "-framerate",
+            str(fps),
+            "-i",
+            "-",
+            "-c:v",
+            "libx264",
+            "-pix_fmt",
+            "yuv420p",
+            "-vf",
+            "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+            str(path),
+        ]
+        result = subprocess.run(command, input=frames.tobytes(), capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(
+                f"ffmpeg failed to encode {path}: {result.stderr.decode().strip()}"
+            )
+        self.encoded.append(EncodedVideo(path, len(frames), time() - start_time))
+
+    def flush(self) -> tuple[list[EncodedVideo], list[Exception]]:
+        """Wait for every submitted video to be encoded. Return the encoded videos and
+        the errors of the encodes that failed (e.g., because ffmpeg exited with an
+        error), which are left to the caller to report.
+        """
+        futures, self.futures = self.futures, []
+        errors = []
+        for future in futures:
+            try:
+                future.result()
+            except Exception as error:
+                errors.append(error)
+        encoded, self.encoded = self.encoded, []
+        return encoded, errors
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,160 @@
+import hashlib
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Literal
+
+import torch
+from jaxtyping import Float
+from torch import Tensor, nn
+
+from ...dataset.types import BatchedViews
+from ..types import Gaussians
+from .encoder import Encoder
+
+CompilationMode = Literal["export", "compile"]
+
+
+def get_checkpoint_key(checkpoint_path: Path) -> str:
+    """Identify a checkpoint without hashing its (potentially very large) contents."""
+    stat = checkpoint_path.stat()
+    key = f"{checkpoint_path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+class EncoderTensorWrapper(nn.Module):
+    """Expose the encoder as a function of plain tensors. This hides the context
+    dictionary and the Gaussians dataclass, neither of which can be traced directly.
+    """
+
+    encoder: Encoder
+    global_step: int
+    deterministic: bool
+
+    def __init__(self, encoder: Encoder, global_step: int, deterministic: bool) -> None:
+        super().__init__()
+        self.encoder = encoder
+        self.global_step = global_step
+        self.deterministic = deterministic
+
+    def forward(
+        self,
+        image: Float[Tensor, "batch view 3 height width"],
+        extrinsics: Float[Tensor, "batch view 4 4"],
+        intrinsics: Float[Tensor, "batch view 3 3"],
+        near: Float[Tensor, "batch view"],
+        far: Float[Tensor, "batch view"],
+    ) -> tuple[
+        Float[Tensor, "batch gaussian 3"],  # means
+        Float[Tensor, "batch gaussian 3 3"],  # covariances
+        Float[Tensor, "batch gaussian 3 d_sh"],  # harmonics
+        Float[Tensor, "batch gaussian"],  # opacities
+    ]:
+        context = {
+            "image": image,
+            "extrinsics": extrinsics,
+            "intrinsics": intrinsics,
+            "near": near,
+            "far": far,
+        }
+        gaussians = self.encoder(context, self.global_step, self.deterministic)
+        return (
+            gaussians.means,
+            gaussians.covariances,
+            gaussians.harmonics,
+            gaussians.opacities,
+        )
+
+
+class CompiledEncoder:
+    """Run an encoder through graphs that are specialized to fixed input shapes.
+
+    In "export" mode, one torch.export program is created per input shape and saved to
+    disk, so later processes only have to load it. In "compile" mode, the encoder is
+    passed to torch.compile, and Inductor's FX graph cache is pointed at the same
+    directory. Since torch.compile compiles lazily, the cache settings are only applied
+    around calls, which keeps them from affecting other compiled code in the process.
+    In both cases, artifacts are stored per checkpoint, since the weights are baked
+    into the exported programs.
+    """
+
+    wrapper: EncoderTensorWrapper
+    mode: CompilationMode
+    cache_dir: Path
+    programs: dict[tuple[int, ...], Callable]
+
+    def __init__(
+        self,
+        encoder: Encoder,
+        cache_dir: Path,
+        checkpoint_key: str,
+        global_step: int,
+        deterministic: bool = True,
+        mode: CompilationMode = "export",
+    ) -> None:
+        self.wrapper = EncoderTensorWrapper(encoder, global_step, deterministic).eval()
+        self.mode = mode
+        self.cache_dir = cache_dir / checkpoint_key
+        self.programs = {}
+
+        if mode == "compile":
+            self.cache_dir.mkdir(exist_ok=True, parents=True)
+            self.compiled = torch.compile(self.wrapper, dynamic=False)
+
+    @contextmanager
+    def inductor_cache(self) -> Iterator[None]:
+        """Point Inductor's FX graph cache at this encoder's cache directory. Inductor
+        reads the cache directory from the environment whenever it compiles a graph.
+        """
+        previous = os.environ.get("TORCHINDUCTOR_CACHE_DIR")
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = str(self.cache_dir / "inductor")
+        try:
+            with torch._inductor.config.patch(fx_graph_cache=True):
+                yield
+        finally:
+            if previous is None:
+                del os.environ["TORCHINDUCTOR_CACHE_DIR"]
+            else:
+                os.environ["TORCHINDUCTOR_CACHE_DIR"] = previous
+
+    def get_program_path(self, shape: tuple[int, ...]) -> Path:
+        shape_key = "x".join(str(x) for x in shape)
+        return self.cache_dir / (
+            f"encoder_{shape_key}_step{self.wrapper.global_step}_"
+            f"{'det' if self.wrapper.deterministic else 'prob'}.pt2"
+        )
+
+    def get_program(self, args: tuple[Tensor, ...]) -> Callable:
+        b, v, _, h, w = args[0].shape
+        shape = (b, v, h, w)
+        if shape in self.programs:
+            return self.programs[shape]
+
+        if self.mode == "compile":
+            program = self.compiled
+        else:
+            path = self.get_program_path(shape)
+            if path.exists():
+                exported = torch.export.load(path)
+            else:
+                with torch.no_grad():
+                    exported = torch.export.export(self.wrapper, args)
+                path.parent.mkdir(exist_ok=True, parents=True)
+                torch.export.save(exported, path)
+            program = exported.module().to(args[0].device)
+
+        self.programs[shape] = program
+        return program
+
+    @torch.no_grad()
+    def __call__(self, context: BatchedViews) -> Gaussians:
+        args = tuple(
+            context[key] for key in ("image", "extrinsics", "intrinsics", "near", "far")
+        )
+        program = self.get_program(args)
+        if self.mode == "compile":
+            with self.inductor_cache():
+                means, covariances, harmonics, opacities = program(*args)
+        else:
+            means, covariances, harmonics, opacities = program(*args)
+        return Gaussians(means, covariances, harmonics, opacities)
@@ -3,7 +3,7 @@ from typing import Literal, Optional
 
 import torch
 from einops import rearrange
-from jaxtyping import Float
+from jaxtyping import Float, Int64, Shaped
 from torch import Tensor, nn
 
 from ...dataset.shims.bounds_shim import apply_bounds_shim
@@ -19,6 +19,16 @@ from .epipolar.epipolar_transformer import EpipolarTransformer, EpipolarTransfor
 from .visualization.encoder_visualizer_epipolar_cfg import EncoderVisualizerEpipolarCfg
 
 
+def gather_gaussian_attribute(
+    attribute: Shaped[Tensor, "batch gaussian *rest"],
+    index: Int64[Tensor, "batch selected"],
+) -> Shaped[Tensor, "batch selected *rest"]:
+    b, s = index.shape
+    _, _, *rest = attribute.shape
+    index = index.reshape(b, s, *((1,) * len(rest))).expand(b, s, *rest)
+    return attribute.gather(dim=1, index=index)
+
+
 @dataclass
 class OpacityMappingCfg:
     initial: float
@@ -43,6 +53,7 @@ class EncoderEpipolarCfg:
     gaussians_per_pixel: int
     use_epipolar_transformer: bool
     use_transmittance: bool
+    gaussian_budget: int | None
 
 
 class EncoderEpipolar(Encoder[EncoderEpipolarCfg]):
@@ -115,15 +126,44 @@ class EncoderEpipolar(Encoder[EncoderEpipolarCfg]):
         global_step: int,
         deterministic: bool = False,
         visualization_dump: Optional[dict] = None,
+        num_scene_samples: int = 1,
     ) -> Gaussians:
-        device = context["image"].device
-        b, v, _, h, w = context["image"].shape
+        """Predict Gaussians for the context views. If num_scene_samples is greater
+        than 1, that many independent sets of Gaussians are sampled from a single pass
+        through the network and returned along the batch dimension as "(b k)".
+        """
+        return self.forward_from_features(
+            self.encode_views(context),
+            context,
+            global_step,
+            deterministic,
+            visualization_dump,
+            num_scene_samples,
+        )
 
-        # Encode the context images.
+    def encode_views(
+        self,
+        context: dict,
+    ) -> Float[Tensor, "batch view channel height width"]:
+        """Compute the per-view backbone features. These don't depend on the other
+        context views, so they can be cached and reused.
+        """
         features = self.backbone(context)
         features = rearrange(features, "b v c h w -> b v h w c")
         features = self.backbone_projection(features)
-        features = rearrange(features, "b v h w c -> b v c h w")
+        return rearrange(features, "b v h w c -> b v c h w")
+
+    def forward_from_features(
+        self,
+        features: Float[Tensor, "batch view channel height width"],
+        context: dict,
+        global_step: int,
+        deterministic: bool = False,
+        visualization_dump: Optional[dict] = None,
+        num_scene_samples: int = 1,
+    ) -> Gaussians:
+        device = context["image"].device
+        b, v, _, h, w = context["image"].shape
 
         # Run the epipolar transformer.
         if self.cfg.use_epipolar_transformer:
@@ -148,6 +188,7 @@ class EncoderEpipolar(Encoder[EncoderEpipolarCfg]):
             context["far"],
             deterministic,
             1 if deterministic else self.cfg.gaussians_per_pixel,
+            num_scene_samples,
         )
 
         # Convert the features and depths into Gaussians.
@@ -162,13 +203,18 @@ class EncoderEpipolar(Encoder[EncoderEpipolarCfg]):
         pixel_size = 1 / torch.tensor((w, h), dtype=torch.float32, device=device)
         xy_ray = xy_ray + (offset_xy - 0.5) * pixel_size
         gpp = self.cfg.gaussians_per_pixel
+        k = num_scene_samples
         gaussians = self.gaussian_adapter.forward(
-            rearrange(context["extrinsics"], "b v i j -> b v () () () i j"),
-            rearrange(context["intrinsics"], "b v i j -> b v () () () i j"),
-            rearrange(xy_ray, "b v r srf xy -> b v r srf () xy"),
-            depths,
-            self.map_pdf_to_opacity(densities, global_step) / gpp,
-            rearrange(gaussians[..., 2:], "b v r srf c -> b v r srf () c"),
+            rearrange(context["extrinsics"], "b v i j -> b () v () () () i j"),
+            rearrange(context["intrinsics"], "b v i j -> b () v () () () i j"),
+            rearrange(xy_ray, "b v r srf xy -> b () v r srf () xy"),
+            rearrange(depths, "b v r srf (k s) -> b k v r srf s", k=k),
+            rearrange(
+                self.map_pdf_to_opacity(densities, global_step) / gpp,
+                "b v r srf (k s) -> b k v r srf s",
+                k=k,
+            ),
+            rearrange(gaussians[..., 2:], "b v r srf c -> b () v r srf () c"),
             (h, w),
         )
 
@@ -178,40 +224,84 @@ class EncoderEpipolar(Encoder[EncoderEpipolarCfg]):
                 depths, "b v (h w) srf s -> b v h w srf s", h=h, w=w
             )
             visualization_dump["scales"] = rearrange(
-                gaussians.scales, "b v r srf spp xyz -> b (v r srf spp) xyz"
+                gaussians.scales, "b k v r srf spp xyz -> (b k) (v r srf spp) xyz"
             )
             visualization_dump["rotations"] = rearrange(
-                gaussians.rotations, "b v r srf spp xyzw -> b (v r srf spp) xyzw"
+                gaussians.rotations,
+                "b k v r srf spp xyzw -> (b k) (v r srf spp) xyzw",
             )
             if self.cfg.use_epipolar_transformer:
                 visualization_dump["sampling"] = sampling
 
         # Optionally apply a per-pixel opacity.
         opacity_multiplier = (
-            rearrange(self.to_opacity(features), "b v r () -> b v r () ()")
+            rearrange(self.to_opacity(features), "b v r () -> b () v r () ()")
             if self.cfg.predict_opacity
             else 1
         )
 
-        return Gaussians(
+        result = Gaussians(
             rearrange(
                 gaussians.means,
-                "b v r srf spp xyz -> b (v r srf spp) xyz",
+                "b k v r srf spp xyz -> (b k) (v r srf spp) xyz",
             ),
             rearrange(
                 gaussians.covariances,
-                "b v r srf spp i j -> b (v r srf spp) i j",
+                "b k v r srf spp i j -> (b k) (v r srf spp) i j",
             ),
             rearrange(
                 gaussians.harmonics,
-                "b v r srf spp c d_sh -> b (v r srf spp) c d_sh",
+                "b k v r srf spp c d_sh -> (b k) (v r srf spp) c d_sh",
             ),
             rearrange(
                 opacity_multiplier * gaussians.opacities,
-                "b v r srf spp -> b (v r srf spp)",
+                "b k v r srf spp -> (b k) (v r srf spp)",
             ),
         )
 
+        # Optionally keep only the Gaussians that contribute the most.
+        if self.cfg.gaussian_budget is not None:
+            index = self.select_gaussians(
+                result.opacities,
+                rearrange(
+                    gaussians.scales,
+                    "b k v r srf spp xyz -> (b k) (v r srf spp) xyz",
+                ),
+                self.cfg.gaussian_budget,
+            )
+            result = Gaussians(
+                *(
+                    gather_gaussian_attribute(attribute, index)
+                    for attribute in (
+                        result.means,
+                        result.covariances,
+                        result.harmonics,
+                        result.opacities,
+                    )
+                )
+            )
+            if visualization_dump is not None:
+                for key in ("scales", "rotations"):
+                    visualization_dump[key] = gather_gaussian_attribute(
+                        visualization_dump[key], index
+                    )
+
+        return result
+
+    def select_gaussians(
+        self,
+        opacities: Float[Tensor, "batch gaussian"],
+        scales: Float[Tensor, "batch gaussian 3"],
+        budget: int,
+    ) -> Int64[Tensor, "batch selected"]:
+        """Pick the indices of the Gaussians with the largest opacity-weighted
+        footprints. The footprint is approximated as the area of a sphere with the same
+        volume as the Gaussian's scale ellipsoid.
+        """
+        _, g = opacities.shape
+        footprint = scales.prod(dim=-1) ** (2 / 3)
+        return (opacities * footprint).topk(min(budget, g), dim=-1).indices
+
     def get_data_shim(self) -> DataShim:
         def data_shim(batch: BatchedExample) -> BatchedExample:
             batch = apply_patch_shim(
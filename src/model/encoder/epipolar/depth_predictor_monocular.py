@@ -1,5 +1,5 @@
 import torch
-from einops import rearrange
+from einops import rearrange, repeat
 from jaxtyping import Float
 from torch import Tensor, nn
 
@@ -41,10 +41,16 @@ class DepthPredictorMonocular(nn.Module):
         far: Float[Tensor, "batch view"],
         deterministic: bool,
         gaussians_per_pixel: int,
+        num_scene_samples: int = 1,
     ) -> tuple[
         Float[Tensor, "batch view ray surface sample"],  # depth
         Float[Tensor, "batch view ray surface sample"],  # pdf
     ]:
+        """Sample depths from the predicted distribution. When num_scene_samples is
+        greater than 1, the sample dimension holds num_scene_samples independent sets
+        of gaussians_per_pixel samples (ordered as "(scene_sample sample)"), all of
+        which are drawn from the same projected distribution.
+        """
         s = self.num_samples
 
         # Convert the features into a depth distribution plus intra-bucket offsets.
@@ -55,8 +61,16 @@ class DepthPredictorMonocular(nn.Module):
         pdf = self.to_pdf(pdf_raw)
         offset = self.to_offset(offset_raw)
 
-        # Sample from the depth distribution.
-        index, pdf_i = self.sampler.sample(pdf, deterministic, gaussians_per_pixel)
+        # Sample from the depth distribution. Deterministic sampling picks the most
+        # likely buckets, so every scene sample would be identical.
+        if deterministic:
+            index, pdf_i = self.sampler.sample(pdf, True, gaussians_per_pixel)
+            index = repeat(index, "... s -> ... (k s)", k=num_scene_samples)
+            pdf_i = repeat(pdf_i, "... s -> ... (k s)", k=num_scene_samples)
+        else:
+            index, pdf_i = self.sampler.sample(
+                pdf, False, gaussians_per_pixel * num_scene_samples
+            )
         offset = self.sampler.gather(index, offset)
 
         # Convert the sampled bucket and offset to a depth.
@@ -0,0 +1,143 @@
+from dataclasses import dataclass
+
+import torch
+from jaxtyping import Float
+from torch import Tensor
+
+from ..types import Gaussians
+from .encoder_epipolar import EncoderEpipolar
+
+
+@dataclass
+class CachedView:
+    extrinsics: Float[Tensor, "4 4"]
+    intrinsics: Float[Tensor, "3 3"]
+    image: Float[Tensor, "3 height width"]
+    near: Float[Tensor, ""]
+    far: Float[Tensor, ""]
+    features: Float[Tensor, "channel height width"]
+    neighbors: tuple[int, ...] | None = None
+    gaussians: Gaussians | None = None
+
+
+class IncrementalEncoderSession:
+    """Reconstruct a scene from context views that arrive one at a time.
+
+    The epipolar transformer is trained on a fixed number of context views, so each
+    view is encoded together with its nearest other views (by camera position). Adding
+    a view runs the backbone on that view only. The epipolar transformer and Gaussian
+    heads are then rerun only for views whose set of neighbors changed, and the
+    Gaussians of all other views are reused.
+    """
+
+    encoder: EncoderEpipolar
+    global_step: int
+    deterministic: bool
+    num_neighbors: int
+    views: list[CachedView]
+
+    def __init__(
+        self,
+        encoder: EncoderEpipolar,
+        global_step: int,
+        deterministic: bool = False,
+    ) -> None:
+        # The budget is applied across all views at once, which would mix Gaussians
+        # from different views and prevent them from being cached per view.
+        assert encoder.cfg.gaussian_budget is None
+        self.encoder = encoder
+        self.global_step = global_step
+        self.deterministic = deterministic
+        self.num_neighbors = (
+            encoder.epipolar_transformer.epipolar_sampler.index_v.shape[0] - 1
+            if encoder.epipolar_transformer is not None
+            else 0
+        )
+        self.views = []
+
+    @torch.no_grad()
+    def add_view(
+        self,
+        image: Float[Tensor, "3 height width"],
+        extrinsics: Float[Tensor, "4 4"],
+        intrinsics: Float[Tensor, "3 3"],
+        near: Float[Tensor, ""],
+        far: Float[Tensor, ""],
+    ) -> Gaussians | None:
+        """Add a view and return the Gaussians for all views that could be encoded so
+        far. This is None until there are enough views for the epipolar transformer.
+        """
+        context = self.make_context([extrinsics], [intrinsics], [image], [near], [far])
+        (features,) = self.encoder.encode_views(context)[0]
+        self.views.append(
+            CachedView(extrinsics, intrinsics, image, near, far, features)
+        )
+
+        # Views can only be encoded once they have enough neighbors.
+        if len(self.views) <= self.num_neighbors:
+            return self.gaussians
+
+        for index, view in enumerate(self.views):
+            neighbors = self.find_neighbors(index)
+            if view.neighbors != neighbors or view.gaussians is None:
+                view.neighbors = neighbors
+                view.gaussians = self.encode_view(index)
+
+        return self.gaussians
+
+    def find_neighbors(self, index: int) -> tuple[int, ...]:
+        origins = torch.stack([view.extrinsics[:3, 3] for view in self.views])
+        distances = (origins - origins[index]).norm(dim=-1)
+        distances[index] = float("inf")
+        neighbors = distances.topk(self.num_neighbors, largest=False).indices
+        return tuple(sorted(neighbors.tolist()))
+
+    def encode_view(self, index: int) -> Gaussians:
+        # The view being encoded comes first, so its Gaussians come first, too.
+        group = [self.views[i] for i in (index, *self.views[index].neighbors)]
+        context = self.make_context(
+            [view.extrinsics for view in group],
+            [view.intrinsics for view in group],
+            [view.image for view in group],
+            [view.near for view in group],
+            [view.far for view in group],
+        )
+        features = torch.stack([view.features for view in group])[None]
+        gaussians = self.encoder.forward_from_features(
+            features,
+            context,
+            self.global_step,
+            self.deterministic,
+        )
+
+        # Gaussians are ordered as (view ray surface sample), so the first view's
+        # Gaussians are a contiguous slice.
+        _, g = gaussians.opacities.shape
+        g_view = g // len(group)
+        return Gaussians(
+            gaussians.means[:, :g_view],
+            gaussians.covariances[:, :g_view],
+            gaussians.harmonics[:, :g_view],
+            gaussians.opacities[:, :g_view],
+        )
+
+    def make_context(self, extrinsics, intrinsics, image, near, far) -> dict:
+        return {
+            "extrinsics": torch.stack(extrinsics)[None],
+            "intrinsics": torch.stack(intrinsics)[None],
+            "image": torch.stack(image)[None],
+            "near": torch.stack(near)[None],
+            "far": torch.stack(far)[None],
+        }
+
+    @property
+    def gaussians(self) -> Gaussians | None:
+        encoded = [view.gaussians for view in self.views if view.gaussians is not None]
+        if not encoded:
+            return None
+        return Gaussians(
+            torch.cat([gaussians.means for gaussians in encoded], dim=1),
+            torch.cat([gaussians.covariances for gaussians in encoded], dim=1),
+            torch.cat([gaussians.harmonics for gaussians in encoded], dim=1),
+            torch.cat([gaussians.opacities for gaussians in encoded], dim=1),
+        )
@@ -0,0 +1,89 @@
+from collections import defaultdict
+from copy import deepcopy
+from dataclasses import dataclass, field
+
+import torch
+from torch import nn
+from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic
+
+from .encoder_epipolar import EncoderEpipolar
+
+# These are the linear layers that dominate the encoder's CPU time. The backbone's own
+# layers are left alone, since they're pretrained and more sensitive to quantization.
+QUANTIZED_MODULE_PREFIXES = (
+    "backbone_projection",
+    "to_gaussians",
+    "depth_predictor.projection",
+    "epipolar_transformer.transformer",
+)
+
+
+def get_quantizable_layers(encoder: EncoderEpipolar) -> list[str]:
+    """Return the names of the linear layers that dynamic quantization is applied to."""
+    return [
+        name
+        for name, module in encoder.named_modules()
+        if isinstance(module, nn.Linear)
+        and any(
+            name == prefix or name.startswith(f"{prefix}.")
+            for prefix in QUANTIZED_MODULE_PREFIXES
+        )
+    ]
+
+
+def quantize_encoder(encoder: EncoderEpipolar) -> EncoderEpipolar:
+    """Return a CPU copy of the encoder whose selected linear layers use dynamic int8
+    quantization. Weights are quantized ahead of time, while activation scales are
+    computed on the fly, so no calibration pass is needed to run the result.
+    """
+    encoder = deepcopy(encoder).cpu().eval()
+    qconfig_spec = {
+        name: default_dynamic_qconfig for name in get_quantizable_layers(encoder)
+    }
+    return quantize_dynamic(encoder, qconfig_spec, dtype=torch.qint8)
+
+
+@dataclass
+class LayerRange:
+    input_min: float = float("inf")
+    input_max: float = float("-inf")
+    output_min: float = float("inf")
+    output_max: float = float("-inf")
+    num_calls: int = 0
+
+
+@dataclass
+class CalibrationRecorder:
+    """Records the activation ranges seen by the quantizable layers of an fp32 encoder.
+    Since int8 uses 256 levels per tensor, layers with a few extreme activations are
+    the ones that lose the most precision, and these ranges help find them.
+    """
+
+    encoder: EncoderEpipolar
+    ranges: dict[str, LayerRange] = field(
+        default_factory=lambda: defaultdict(LayerRange)
+    )
+
+    def __enter__(self) -> "CalibrationRecorder":
+        def make_hook(name: str):
+            def hook(module, input, output):
+                (x,) = input
+                entry = self.ranges[name]
+                entry.input_min = min(entry.input_min, x.min().item())
+                entry.input_max = max(entry.input_max, x.max().item())
+                entry.output_min = min(entry.output_min, output.min().item())
+                entry.output_max = max(entry.output_max, output.max().item())
+                entry.num_calls += 1
+
+            return hook
+
+        modules = dict(self.encoder.named_modules())
+        self.handles = [
+            modules[name].register_forward_hook(make_hook(name))
+            for name in get_quantizable_layers(self.encoder)
+        ]
+        return self
+
+    def __exit__(self, *_) -> None:
+        for handle in self.handles:
+            handle.remove()
@@ -14,8 +14,10 @@ from pytorch_lightning.loggers.wandb import WandbLogger
 from pytorch_lightning.utilities import rank_zero_only
 from torch import Tensor, nn, optim
 
+from ..dataset.collate import get_view_mask, index_batch, unpad_views
 from ..dataset.data_module import get_data_shim
 from ..dataset.types import BatchedExample
+from ..evaluation.metric_aggregator import MetricAggregator
 from ..evaluation.metrics import compute_lpips, compute_psnr, compute_ssim
 from ..global_cfg import get_cfg
 from ..loss import Loss
@@ -73,6 +75,10 @@ class TestCfg:
     pred_pose_path: str | None
     noisy_level: float
     save_image: bool
+    # Per-scene scores are appended to scores/<rank>.jsonl every this many scenes. With
+    # resume_scores, a test run skips the scenes that are already in those files.
+    score_flush_interval: int = 10
+    resume_scores: bool = False
     
 @dataclass
 class TrainCfg:
@@ -131,8 +137,8 @@ class ModelWrapper(LightningModule):
         # This is used for testing.
         self.benchmarker = Benchmarker()
         
+        self.scores = None
         if self.test_cfg.compute_scores:
-            self.test_step_outputs = {}
             self.time_skip_steps_dict = {"encoder": 0, "decoder": 0}
 
         if self.test_cfg.pred_pose_path is not None:        # TODO PRED POSE
@@ -192,64 +198,101 @@ class ModelWrapper(LightningModule):
 
         return total_loss
 
+    def on_test_start(self) -> None:
+        if self.test_cfg.compute_scores:
+            name = get_cfg()["wandb"]["name"]
+            self.scores = MetricAggregator(
+                self.test_cfg.output_path / name / "scores",
+                self.global_rank,
+                self.trainer.world_size,
+                self.test_cfg.score_flush_interval,
+                self.test_cfg.resume_scores,
+            )
+            if self.scores.scenes:
+                print(f"Resuming with {len(self.scores.scenes)} scored scenes.")
+
     def test_step(self, batch, batch_idx):
+        # The evaluation dataset produces None when every example in a batch is skipped.
+        if batch is None:
+            return
+
+        # Skip scenes that were scored before the test run was resumed.
+        if self.scores is not None:
+            keep = [
+                i
+                for i, scene in enumerate(batch["scene"])
+                if scene not in self.scores.scenes
+            ]
+            if not keep:
+                return
+            if len(keep) < len(batch["scene"]):
+                batch = index_batch(batch, keep)
         batch: BatchedExample = self.data_shim(batch)
- 
+        scene_metrics = {scene: {} for scene in batch["scene"]}
+
+        # A batch can hold several scenes. Their target views are padded to the same
+        # number of views, and the padded views are rendered but otherwise ignored.
         gt_extrinsics = batch["context"]["extrinsics"]
-        R_gt = rearrange(gt_extrinsics, 'b v x y -> (b v) x y')[:,:3,:3]
-        T_gt = rearrange(gt_extrinsics, 'b v x y -> (b v) x y')[:,:3,3]
 
         if self.test_cfg.noisy_pose:
             n_context_views = batch["context"]["extrinsics"].shape[1]
-            n_target_views = batch["target"]["extrinsics"].shape[1]
-            
-            gt_scene_scale = full_scene_scale(batch['context'])
-            
-            gt_context_views = batch["context"]["extrinsics"][..., :3, :4]
-            noisy_context_views, error_R, error_T = initialize_noisy_poses(gt_context_views, noise_level=self.test_cfg.noisy_level, gt_scene_scale=gt_scene_scale)
-            
-            # # #! FOR DEPTH CHEERY RENDERING!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!1
-            # if batch["scene"][0] not in CHERRY_PICKED:
-            #     return
-            # # #! !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
-            print("mean Rotation error angle:", np.mean(error_R))
-            print("mean Translation error:", np.mean(error_T))
-            
-            # add to mean error 
-            self.log("info/mean_rotation_error", np.mean(error_R))
-            self.log("info/mean_translation_error", np.mean(error_T))
-            
-            if "mean_rotation_error" not in self.test_step_outputs:
-                self.test_step_outputs["mean_rotation_error"] = []
-                self.test_step_outputs["mean_translation_error"] = []
-            self.test_step_outputs["mean_rotation_error"].append(np.mean(error_R).item())
-            self.test_step_outputs["mean_translation_error"].append(np.mean(error_T).item())
-            
+
+            # Noise is added scene by scene, just like with one scene per batch.
+            noisy_extrinsics = []
+            for i in range(len(batch["scene"])):
+                context = index_batch(batch["context"], [i])
+                gt_scene_scale = full_scene_scale(context)
+
+                gt_context_views = context["extrinsics"][..., :3, :4]
+                noisy_context_views, error_R, error_T = initialize_noisy_poses(gt_context_views, noise_level=self.test_cfg.noisy_level, gt_scene_scale=gt_scene_scale)
+
+                print("mean Rotation error angle:", np.mean(error_R))
+                print("mean Translation error:", np.mean(error_T))
+
+                # add to mean error
+                self.log("info/mean_rotation_error", np.mean(error_R), batch_size=1)
+                self.log("info/mean_translation_error", np.mean(error_T), batch_size=1)
+
+                metrics = scene_metrics[batch["scene"][i]]
+                metrics["mean_rotation_error"] = np.mean(error_R).item()
+                metrics["mean_translation_error"] = np.mean(error_T).item()
+                noisy_extrinsics.append(noisy_context_views[:, :n_context_views])
+
             #UPDATE poses to noisy poses
-            batch["context"]["extrinsics"] = noisy_context_views[:, :n_context_views]
+            batch["context"]["extrinsics"] = torch.cat(noisy_extrinsics)
             # batch["target"]["extrinsics"] = all_noisy_poses[:, n_context_views:]
 
         #! USE PRED POSES
         if self.pred_poses is not None:
-            scene = batch["scene"][0]
-            if scene not in self.pred_poses:
-                print(f"Scene {scene} not in pred_poses")
+            keep = []
+            for i, scene in enumerate(batch["scene"]):
+                if scene in self.pred_poses:
+                    keep.append(i)
+                else:
+                    print(f"Scene {scene} not in pred_poses")
+                    # Scenes without poses are only scored for their pose noise.
+                    if self.scores is not None and scene_metrics[scene]:
+                        self.scores.add(scene, scene_metrics[scene])
+            if not keep:
                 return
-            batch['context']['extrinsics'] = self.pred_poses[scene].unsqueeze(0).cuda().float()
+            batch = index_batch(batch, keep)
+            gt_extrinsics = gt_extrinsics[keep]
+            batch['context']['extrinsics'] = torch.stack([self.pred_poses[scene] for scene in batch["scene"]]).cuda().float()
 
         b, v, _, h, w = batch["target"]["image"].shape
-        assert b == 1
+        mask = get_view_mask(batch["target"])
+        num_views = mask.sum(dim=1).tolist()
         if batch_idx % 100 == 0:
             print(f"Test step {batch_idx:0>6}.")
 
         # Render Gaussians.
-        with self.benchmarker.time("encoder"):
+        with self.benchmarker.time("encoder", num_calls=b):
             gaussians = self.encoder(
                 batch["context"],
                 self.global_step,
                 deterministic=False,
             )
-        with self.benchmarker.time("decoder", num_calls=v):
+        with self.benchmarker.time("decoder", num_calls=sum(num_views)):
             output = self.decoder.forward(
                 gaussians,
                 batch["target"]["extrinsics"],
@@ -260,94 +303,84 @@ class ModelWrapper(LightningModule):
                 depth_mode='depth',
             )
 
-        (scene,) = batch["scene"]
         name = get_cfg()["wandb"]["name"]
         path = self.test_cfg.output_path / name
-        images_prob = output.color[0]
-        rgb_gt = batch["target"]["image"][0]
 
         # Save images.
         if self.test_cfg.save_image:
-            for index, color in zip(batch["target"]["index"][0], images_prob):
-                save_image(color, path / scene / f"color/{index:0>6}.png")
-            for index, color in zip(batch["target"]["index"][0], rgb_gt):
-                save_image(color, path / scene / f"tgt_gt/{index:0>6}.png")
-            for index, color in zip(batch["context"]["index"][0],  batch["context"]["image"][0]):
-                save_image(color, path / scene / f"ctxt_gt/{index:0>6}.png")
-            #! FOR DEPTH CHEERY RENDERING!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
-            color_depth = depth_map(output.depth[0])
-            for index, depth in zip(batch["target"]["index"][0], color_depth):
-                save_image(depth, path / scene / f"depth/{index:0>6}.png")
-            #! !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+            for i, scene in enumerate(batch["scene"]):
+                n = num_views[i]
+                target_index = batch["target"]["index"][i, :n]
+                for index, color in zip(target_index, output.color[i, :n]):
+                    save_image(color, path / scene / f"color/{index:0>6}.png")
+                for index, color in zip(target_index, batch["target"]["image"][i, :n]):
+                    save_image(color, path / scene / f"tgt_gt/{index:0>6}.png")
+                for index, color in zip(batch["context"]["index"][i],  batch["context"]["image"][i]):
+                    save_image(color, path / scene / f"ctxt_gt/{index:0>6}.png")
+                #! FOR DEPTH CHEERY RENDERING!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+                color_depth = depth_map(output.depth[i, :n])
+                for index, depth in zip(target_index, color_depth):
+                    save_image(depth, path / scene / f"depth/{index:0>6}.png")
+                #! !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
 
         # compute scores
         if self.test_cfg.compute_scores:
             #! IMAGE SCORES
             if batch_idx < self.test_cfg.eval_time_skip_steps:
-                self.time_skip_steps_dict["encoder"] += 1
-                self.time_skip_steps_dict["decoder"] += v
-            rgb = images_prob
-
-            if f"psnr" not in self.test_step_outputs:
-                self.test_step_outputs[f"psnr"] = []
-            if f"ssim" not in self.test_step_outputs:
-                self.test_step_outputs[f"ssim"] = []
-            if f"lpips" not in self.test_step_outputs:
-                self.test_step_outputs[f"lpips"] = []
-                
-            if f"rotation_angle" not in self.test_step_outputs:
-                self.test_step_outputs[f"rotation_angle"] = []
-            if f"translation_angle" not in self.test_step_outputs:
-                self.test_step_outputs[f"translation_angle"] = []
-
-            self.test_step_outputs[f"psnr"].append(
-                compute_psnr(rgb_gt, rgb).mean().item()
-            )
-            self.test_step_outputs[f"ssim"].append(
-                compute_ssim(rgb_gt, rgb).mean().item()
-            )
-            self.test_step_outputs[f"lpips"].append(
-                compute_lpips(rgb_gt, rgb).mean().item()
-            )
-
-            #! TIME SCORES
-            
-            pred_mats = rearrange(batch['context']['extrinsics'], 'b v x y -> (b v) x y')
-            
-            # R_gt = rearrange(batch['context']['R'], 'b v x y -> (b v) x y')
-            # T_gt = rearrange(batch['context']['T'], 'b v x -> (b v) x')
-            
-            #! CoPoNeRF Style evaluation
-            norm_pred = pred_mats[:,:3,3][1:] / torch.linalg.norm(pred_mats[:,:3,3][1:], dim = -1).unsqueeze(-1) + 1e-6
-            norm_gt =  T_gt[1:] / torch.linalg.norm(T_gt[1:], dim =-1).unsqueeze(-1)
-            if len(norm_pred) == 2: #DTU 3 views
-                cosine_similarity_0 = torch.dot(norm_pred[0], norm_gt[0])
-                cosine_similarity_1 = torch.dot(norm_pred[1], norm_gt[1])
-                angle_degree_1 = torch.arccos(torch.clip(cosine_similarity_0, -1.0,1.0)) * 180 / np.pi
-                angle_degree_2 = torch.arccos(torch.clip(cosine_similarity_1, -1.0,1.0)) * 180 / np.pi
-                avg_angle_degree = (angle_degree_1 + angle_degree_2) / 2
-                
-                geodesic = compute_geodesic_distance_from_two_matrices(pred_mats[..., :3, :3][1:], R_gt[..., :3, :3][1:]) * 180 / np.pi
-                self.test_step_outputs[f"rotation_angle"].append(geodesic.mean().item())
-                self.test_step_outputs[f"translation_angle"].append(avg_angle_degree.item())
-            else: #2views
-                cosine_similarity = torch.dot(norm_pred[0], norm_gt[0])
-                angle_degree = torch.arccos(torch.clip(cosine_similarity, -1.0,1.0)) * 180 / np.pi
-                avg_angle_degree = angle_degree
-
-                geodesic = compute_geodesic_distance_from_two_matrices(pred_mats[..., :3, :3][1:], R_gt[..., :3, :3][1:]) * 180 / np.pi
-                self.test_step_outputs[f"rotation_angle"].append(geodesic.mean().item())
-                self.test_step_outputs[f"translation_angle"].append(avg_angle_degree.item())
-        
-            print("Rotation:", geodesic, "translation_angle:", avg_angle_degree)
-            print("Rotation error so far:", np.mean(self.test_step_outputs[f"rotation_angle"]), 'Translation_angle so far:', np.mean(self.test_step_outputs[f"translation_angle"]))
-            
-            # print psnr
-            print("scene: ", scene, end=' ')
-            print(f"PSNR: {self.test_step_outputs[f'psnr'][-1]}, SSIM: {self.test_step_outputs[f'ssim'][-1]}, LPIPS: {self.test_step_outputs[f'lpips'][-1]}", end=' ')
-            print("PSNR_so_far: ", np.mean(self.test_step_outputs[f'psnr']))
-            
-            
+                self.time_skip_steps_dict["encoder"] += b
+                self.time_skip_steps_dict["decoder"] += sum(num_views)
+
+            # Score the real target views of all scenes at once, then split by scene.
+            rgb = output.color[mask]
+            rgb_gt = batch["target"]["image"][mask]
+            psnr = compute_psnr(rgb_gt, rgb).split(num_views)
+            ssim = compute_ssim(rgb_gt, rgb).split(num_views)
+            lpips = compute_lpips(rgb_gt, rgb).split(num_views)
+
+            for i, scene in enumerate(batch["scene"]):
+                metrics = scene_metrics[scene]
+                metrics["psnr"] = psnr[i].mean().item()
+                metrics["ssim"] = ssim[i].mean().item()
+                metrics["lpips"] = lpips[i].mean().item()
+
+                #! TIME SCORES
+
+                pred_mats = batch['context']['extrinsics'][i]
+                R_gt = gt_extrinsics[i, :, :3, :3]
+                T_gt = gt_extrinsics[i, :, :3, 3]
+
+                #! CoPoNeRF Style evaluation
+                norm_pred = pred_mats[:,:3,3][1:] / torch.linalg.norm(pred_mats[:,:3,3][1:], dim = -1).unsqueeze(-1) + 1e-6
+                norm_gt =  T_gt[1:] / torch.linalg.norm(T_gt[1:], dim =-1).unsqueeze(-1)
+                if len(norm_pred) == 2: #DTU 3 views
+                    cosine_similarity_0 = torch.dot(norm_pred[0], norm_gt[0])
+                    cosine_similarity_1 = torch.dot(norm_pred[1], norm_gt[1])
+                    angle_degree_1 = torch.arccos(torch.clip(cosine_similarity_0, -1.0,1.0)) * 180 / np.pi
+                    angle_degree_2 = torch.arccos(torch.clip(cosine_similarity_1, -1.0,1.0)) * 180 / np.pi
+                    avg_angle_degree = (angle_degree_1 + angle_degree_2) / 2
+
+                    geodesic = compute_geodesic_distance_from_two_matrices(pred_mats[..., :3, :3][1:], R_gt[1:]) * 180 / np.pi
+                    metrics["rotation_angle"] = geodesic.mean().item()
+                    metrics["translation_angle"] = avg_angle_degree.item()
+                else: #2views
+                    cosine_similarity = torch.dot(norm_pred[0], norm_gt[0])
+                    angle_degree = torch.arccos(torch.clip(cosine_similarity, -1.0,1.0)) * 180 / np.pi
+                    avg_angle_degree = angle_degree
+
+                    geodesic = compute_geodesic_distance_from_two_matrices(pred_mats[..., :3, :3][1:], R_gt[1:]) * 180 / np.pi
+                    metrics["rotation_angle"] = geodesic.mean().item()
+                    metrics["translation_angle"] = avg_angle_degree.item()
+
+                self.scores.add(scene, metrics)
+                stats = self.scores.stats
+
+                print("Rotation:", geodesic, "translation_angle:", avg_angle_degree)
+                print("Rotation error so far:", stats["rotation_angle"].mean, 'Translation_angle so far:', stats["translation_angle"].mean)
+
+                # print psnr
+                print("scene: ", scene, end=' ')
+                print(f"PSNR: {metrics['psnr']}, SSIM: {metrics['ssim']}, LPIPS: {metrics['lpips']}", end=' ')
+                print("PSNR_so_far: ", stats["psnr"].mean)
 
     def on_test_end(self) -> None:
         name = get_cfg()["wandb"]["name"]
@@ -357,13 +390,24 @@ class ModelWrapper(LightningModule):
             self.benchmarker.dump_memory(out_dir / "peak_memory.json")
             self.benchmarker.dump(out_dir / "benchmark.json")
 
-            for metric_name, metric_scores in self.test_step_outputs.items():
-                avg_scores = sum(metric_scores) / len(metric_scores)
-                saved_scores[metric_name] = avg_scores
-                print(metric_name, avg_scores)
+            # Each rank scores its own scenes. Rank zero merges them once all ranks
+            # are done.
+            self.scores.close()
+            self.trainer.strategy.barrier()
+            if self.global_rank != 0:
+                self.scores = None
+                self.benchmarker.clear_history()
+                return
+            self.scores.merge()
+            for metric_name, statistic in self.scores.stats.items():
+                saved_scores[metric_name] = statistic.mean
+                print(metric_name, statistic.mean)
+            for metric_name, metric_scores in self.scores.read_scores().items():
                 with (out_dir / f"scores_{metric_name}_all.json").open("w") as f:
                     json.dump(metric_scores, f)
-                metric_scores.clear()
+            with (out_dir / "scores_summary.json").open("w") as f:
+                json.dump(self.scores.summary(), f, indent=2)
+            self.scores = None
 
             for tag, times in self.benchmarker.execution_times.items():
                 times = times[int(self.time_skip_steps_dict[tag]) :]
@@ -394,9 +438,11 @@ class ModelWrapper(LightningModule):
                 f"context = {batch['context']['index'].tolist()}"
             )
 
-        # Render Gaussians.
+        # Render Gaussians. A batch can hold several scenes, whose target views are
+        # padded to the same number of views.
         b, _, _, h, w = batch["target"]["image"].shape
-        assert b == 1
+        mask = get_view_mask(batch["target"])
+        num_views = mask.sum(dim=1).tolist()
         gaussians_probabilistic = self.encoder(
             batch["context"],
             self.global_step,
@@ -410,7 +456,6 @@ class ModelWrapper(LightningModule):
             batch["target"]["far"],
             (h, w),
         )
-        rgb_probabilistic = output_probabilistic.color[0]
         gaussians_deterministic = self.encoder(
             batch["context"],
             self.global_step,
@@ -424,62 +469,84 @@ class ModelWrapper(LightningModule):
             batch["target"]["far"],
             (h, w),
         )
-        rgb_deterministic = output_deterministic.color[0]
 
-        # Compute validation metrics.
-        rgb_gt = batch["target"]["image"][0]
-        for tag, rgb in zip(
-            ("deterministic", "probabilistic"), (rgb_deterministic, rgb_probabilistic)
+        # Compute validation metrics on the real target views, scene by scene.
+        rgb_gt = batch["target"]["image"][mask]
+        for tag, output in (
+            ("deterministic", output_deterministic),
+            ("probabilistic", output_probabilistic),
         ):
-            psnr = compute_psnr(rgb_gt, rgb).mean()
-            self.log(f"val/psnr_{tag}", psnr)
-            lpips = compute_lpips(rgb_gt, rgb).mean()
-            self.log(f"val/lpips_{tag}", lpips)
-            ssim = compute_ssim(rgb_gt, rgb).mean()
-            self.log(f"val/ssim_{tag}", ssim)
-
-        # Construct comparison image.
-        comparison = hcat(
-            add_label(vcat(*batch["context"]["image"][0]), "Context"),
-            add_label(vcat(*rgb_gt), "Target (Ground Truth)"),
-            add_label(vcat(*rgb_probabilistic), "Target (Probabilistic)"),
-            add_label(vcat(*rgb_deterministic), "Target (Deterministic)"),
-        )
+            rgb = output.color[mask]
+            for metric, compute_metric in (
+                ("psnr", compute_psnr),
+                ("lpips", compute_lpips),
+                ("ssim", compute_ssim),
+            ):
+                for scores in compute_metric(rgb_gt, rgb).split(num_views):
+                    self.log(f"val/{metric}_{tag}", scores.mean(), batch_size=1)
+
+        # Construct comparison images.
+        comparisons = []
+        for i, n in enumerate(num_views):
+            rgb_gt = batch["target"]["image"][i, :n]
+            rgb_probabilistic = output_probabilistic.color[i, :n]
+            rgb_deterministic = output_deterministic.color[i, :n]
+            comparison = hcat(
+                add_label(vcat(*batch["context"]["image"][i]), "Context"),
+                add_label(vcat(*rgb_gt), "Target (Ground Truth)"),
+                add_label(vcat(*rgb_probabilistic), "Target (Probabilistic)"),
+                add_label(vcat(*rgb_deterministic), "Target (Deterministic)"),
+            )
+            comparisons.append(prep_image(add_border(comparison)))
         self.logger.log_image(
             "comparison",
-            [prep_image(add_border(comparison))],
+            comparisons,
             step=self.global_step,
             caption=batch["scene"],
         )
 
         # Render projections and construct projection image.
         # These are disabled for now, since RE10k scenes are effectively unbounded.
-        projections = vcat(
-            hcat(
-                *render_projections(
+        projections = [
+            prep_image(
+                add_border(
+                    vcat(
+                        hcat(*probabilistic),
+                        hcat(*deterministic),
+                        align="left",
+                    )
+                )
+            )
+            for probabilistic, deterministic in zip(
+                render_projections(
                     gaussians_probabilistic,
                     256,
                     extra_label="(Probabilistic)",
-                )[0]
-            ),
-            hcat(
-                *render_projections(
+                ),
+                render_projections(
                     gaussians_deterministic, 256, extra_label="(Deterministic)"
-                )[0]
-            ),
-            align="left",
-        )
+                ),
+            )
+        ]
         self.logger.log_image(
             "projection",
-            [prep_image(add_border(projections))],
+            projections,
             step=self.global_step,
         )
 
         # Draw cameras.
-        cameras = hcat(*render_cameras(batch, 256))
-        self.logger.log_image(
-            "cameras", [prep_image(add_border(cameras))], step=self.global_step
-        )
+        scene_batches = [
+            {
+                **index_batch(batch, [i]),
+                "target": unpad_views(index_batch(batch["target"], [i]), n),
+            }
+            for i, n in enumerate(num_views)
+        ]
+        cameras = [
+            prep_image(add_border(hcat(*render_cameras(scene_batch, 256))))
+            for scene_batch in scene_batches
+        ]
+        self.logger.log_image("cameras", cameras, step=self.global_step)
 
         if self.encoder_visualizer is not None:
             for k, image in self.encoder_visualizer.visualize(
@@ -487,11 +554,12 @@ class ModelWrapper(LightningModule):
             ).items():
                 self.logger.log_image(k, [prep_image(image)], step=self.global_step)
 
-        # Run video validation step.
-        self.render_video_interpolation(batch)
-        self.render_video_wobble(batch)
+        # Run video validation step. Videos are only rendered for the first scene,
+        # since rendering them is much more expensive than the rest of this step.
+        self.render_video_interpolation(scene_batches[0])
+        self.render_video_wobble(scene_batches[0])
         if self.train_cfg.extended_visualization:
-            self.render_video_interpolation_exaggerated(batch)
+            self.render_video_interpolation_exaggerated(scene_batches[0])
 
     @rank_zero_only
     def render_video_wobble(self, batch: BatchedExample) -> None:
@@ -0,0 +1,99 @@
+import json
+from pathlib import Path
+from time import time
+
+import hydra
+import torch
+from jaxtyping import install_import_hook
+
+# Configure beartype and jaxtyping.
+with install_import_hook(
+    ("src",),
+    ("beartype", "beartype"),
+):
+    from src.config import load_typed_root_config
+    from src.dataset.dataset_re10k import DatasetRE10k
+    from src.dataset.shims.crop_shim import rescale, rescale_batch
+    from src.dataset.view_sampler import get_view_sampler
+    from src.evaluation.metrics import compute_psnr
+    from src.global_cfg import set_cfg
+
+# Compare the batched tensor resize against the original per-image PIL resize on the
+# full-resolution frames of real RE10k scenes, e.g.:
+# python3 -m src.scripts.benchmark_crop_shim +experiment=re10k
+NUM_SCENES = 20
+VIEWS_PER_EXAMPLE = 12
+# Differences come from PIL's uint8 quantization and Lanczos (rather than bicubic)
+# filter. On RE10k, the per-image PSNR against PIL measures about 45 to 50 dB, so the
+# bound sits a few dB below the measured minimum. A visibly wrong resize (e.g., a
+# half-pixel shift or no antialiasing) falls well below it. Every image has to meet
+# the bound, not just the average.
+MIN_PSNR_BOUND = 42.0
+RESULT_PATH = Path("outputs/crop_shim_benchmark")
+
+
+@hydra.main(
+    version_base=None,
+    config_path="../../config",
+    config_name="main",
+)
+def benchmark_crop_shim(cfg_dict):
+    cfg = load_typed_root_config(cfg_dict)
+    set_cfg(cfg_dict)
+    torch.manual_seed(cfg_dict.seed)
+
+    view_sampler = get_view_sampler(
+        cfg.dataset.view_sampler, "test", False, False, None
+    )
+    dataset = DatasetRE10k(cfg.dataset, "test", view_sampler)
+
+    times_pil = []
+    times_tensor = []
+    max_error = 0.0
+    mean_errors = []
+    psnrs = []
+    for chunk_path in dataset.chunks:
+        if len(mean_errors) == NUM_SCENES:
+            break
+        for example in dataset.load_chunk(chunk_path):
+            if len(mean_errors) == NUM_SCENES:
+                break
+            num_views = min(VIEWS_PER_EXAMPLE, len(example["images"]))
+            images = [example["images"][index] for index in range(num_views)]
+            images = dataset.convert_images(images)
+            _, _, h, w = images.shape
+            shape = (h // 2, w // 2)
+
+            start_time = time()
+            expected = torch.stack([rescale(image, shape) for image in images])
+            times_pil.append(time() - start_time)
+
+            start_time = time()
+            actual = rescale_batch(images, shape)
+            times_tensor.append(time() - start_time)
+
+            error = (actual - expected).abs()
+            max_error = max(max_error, error.max().item())
+            mean_errors.append(error.mean().item())
+            psnrs.extend(compute_psnr(expected, actual).tolist())
+
+    results = {
+        "pil_seconds_per_example": sum(times_pil) / len(times_pil),
+        "tensor_seconds_per_example": sum(times_tensor) / len(times_tensor),
+        "speedup": sum(times_pil) / sum(times_tensor),
+        "max_error": max_error,
+        "mean_error": sum(mean_errors) / len(mean_errors),
+        "mean_psnr": sum(psnrs) / len(psnrs),
+        "min_psnr": min(psnrs),
+        "min_psnr_bound": MIN_PSNR_BOUND,
+        "within_bound": min(psnrs) >= MIN_PSNR_BOUND,
+    }
+    for key, value in results.items():
+        print(f"{key}: {value}")
+    RESULT_PATH.mkdir(exist_ok=True, parents=True)
+    with (RESULT_PATH / "benchmark.json").open("w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    benchmark_crop_shim()
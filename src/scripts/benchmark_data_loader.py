@@ -0,0 +1,242 @@
+import json
+from dataclasses import replace
+from pathlib import Path
+from time import perf_counter
+
+import hydra
+import torch
+from jaxtyping import install_import_hook
+from omegaconf import open_dict
+from torch import Tensor
+from torch.utils.data import Dataset
+
+# Configure beartype and jaxtyping.
+with install_import_hook(
+    ("src",),
+    ("beartype", "beartype"),
+):
+    from src.config import load_typed_root_config
+    from src.dataset import dataset_dtu, dataset_re10k
+    from src.dataset.data_module import DataModule
+    from src.dataset.types import Stage
+    from src.global_cfg import set_cfg
+    from src.misc.step_tracker import StepTracker
+
+# Iterate over the data loaders without a model to find out whether training or testing
+# is loader-bound, e.g.:
+# python3 -m src.scripts.benchmark_data_loader +experiment=re10k \
+#     +benchmark.stages=[train,test] +benchmark.num_workers=[0,4,8,16]
+# Stage timings are collected in the workers through shared memory. This relies on the
+# workers being forked (the default on Linux), since the instrumentation isn't
+# picklable. Stages can be nested (e.g., DTU's load includes decoding), and "busy" is
+# the total time spent producing examples, which determines worker utilization.
+STAGES = ("train", "val", "test")
+NUM_WORKERS = (0, 4, 8, 16)
+NUM_BATCHES = 50
+TIMED_STAGES = ("busy", "load", "decode", "view_sampling", "crop_shim", "augmentation")
+TIMED_FUNCTIONS = {
+    "decode": "decode_images",
+    "crop_shim": "apply_crop_shim",
+    "augmentation": "apply_augmentation_shim",
+}
+DATASET_MODULES = (dataset_re10k, dataset_dtu)
+RESULT_PATH = Path("outputs/data_loader_benchmark")
+
+
+class StageTimes:
+    """Per-process totals of the time spent in each stage. Row 0 is the main process,
+    and row i + 1 is data loader worker i. Each process only writes to its own row.
+    """
+
+    seconds: Tensor
+    calls: Tensor
+
+    def __init__(self, num_workers: int) -> None:
+        shape = (num_workers + 1, len(TIMED_STAGES))
+        self.seconds = torch.zeros(shape, dtype=torch.float64).share_memory_()
+        self.calls = torch.zeros(shape, dtype=torch.int64).share_memory_()
+
+    def add(self, stage: str, seconds: float) -> None:
+        worker_info = torch.utils.data.get_worker_info()
+        row = 0 if worker_info is None else worker_info.id + 1
+        column = TIMED_STAGES.index(stage)
+        self.seconds[row, column] += seconds
+        self.calls[row, column] += 1
+
+    def wrap(self, stage: str, fn):
+        def timed(*args, **kwargs):
+            start_time = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, perf_counter() - start_time)
+
+        return timed
+
+
+def instrument(dataset: Dataset, times: StageTimes) -> Dataset:
+    """Time the dataset's stages. The dataset's class is swapped for a subclass that
+    times how long each example takes to produce, which is the worker's busy time.
+    """
+    # The evaluation dataset delegates loading and processing to a wrapped dataset.
+    inner = getattr(dataset, "dataset", dataset)
+    for method in ("load_chunk", "load_views"):
+        if hasattr(inner, method):
+            setattr(inner, method, times.wrap("load", getattr(inner, method)))
+    view_sampler = inner.view_sampler
+    view_sampler.sample = times.wrap("view_sampling", view_sampler.sample)
+
+    base = type(dataset)
+
+    class TimedDataset(base):
+        def __iter__(self):
+            iterator = super().__iter__()
+            while True:
+                start_time = perf_counter()
+                try:
+                    example = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    times.add("busy", perf_counter() - start_time)
+                yield example
+
+        def __getitem__(self, index):
+            start_time = perf_counter()
+            try:
+                return super().__getitem__(index)
+            finally:
+                times.add("busy", perf_counter() - start_time)
+
+    TimedDataset.__name__ = f"Timed{base.__name__}"
+    dataset.__class__ = TimedDataset
+    return dataset
+
+
+def get_num_bytes(batch) -> int:
+    if isinstance(batch, Tensor):
+        return batch.nbytes
+    if isinstance(batch, dict):
+        return sum(get_num_bytes(value) for value in batch.values())
+    if isinstance(batch, (list, tuple)):
+        return sum(get_num_bytes(value) for value in batch)
+    return 0
+
+
+def get_batch_size(batch) -> int:
+    return 0 if batch is None else len(batch["scene"])
+
+
+def benchmark(cfg, stage: Stage, num_workers: int, num_batches: int) -> dict:
+    times = StageTimes(num_workers)
+
+    # Time the module-level functions the datasets call. Forked workers inherit this.
+    originals = {
+        (module, name): getattr(module, name)
+        for module in DATASET_MODULES
+        for name in TIMED_FUNCTIONS.values()
+    }
+    for stage_name, name in TIMED_FUNCTIONS.items():
+        for module in DATASET_MODULES:
+            setattr(module, name, times.wrap(stage_name, originals[(module, name)]))
+
+    loader_cfg = replace(
+        getattr(cfg.data_loader, stage),
+        num_workers=num_workers,
+        persistent_workers=False,
+    )
+    data_module = DataModule(
+        cfg.dataset,
+        replace(cfg.data_loader, **{stage: loader_cfg}),
+        StepTracker(),
+        lambda dataset, _: instrument(dataset, times),
+    )
+    loader = getattr(data_module, f"{stage}_dataloader")()
+
+    try:
+        start_time = perf_counter()
+        iterator = iter(loader)
+        startup_seconds = None
+        num_loaded_batches = 0
+        num_examples = 0
+        num_bytes = 0
+        for _ in range(num_batches):
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                break
+            if startup_seconds is None:
+                # The first batch includes starting workers and loading first chunks.
+                startup_seconds = perf_counter() - start_time
+            num_loaded_batches += 1
+            num_examples += get_batch_size(batch)
+            num_bytes += get_num_bytes(batch)
+        seconds = perf_counter() - start_time
+        del iterator
+    finally:
+        for (module, name), fn in originals.items():
+            setattr(module, name, fn)
+
+    # Busy times are measured in the processes that produce examples.
+    producers = times.seconds[1:] if num_workers > 0 else times.seconds
+    busy = producers[:, TIMED_STAGES.index("busy")]
+    utilization = (busy / seconds).tolist()
+    stage_seconds = times.seconds.sum(dim=0).tolist()
+    return {
+        "stage": stage,
+        "num_workers": num_workers,
+        "batch_size": loader_cfg.batch_size,
+        "num_batches": num_loaded_batches,
+        "num_examples": num_examples,
+        "seconds": seconds,
+        "startup_seconds": startup_seconds,
+        "examples_per_second": num_examples / seconds,
+        "bytes_per_second": num_bytes / seconds,
+        "stage_seconds": dict(zip(TIMED_STAGES, stage_seconds)),
+        "stage_seconds_per_example": {
+            name: value / max(num_examples, 1)
+            for name, value in zip(TIMED_STAGES, stage_seconds)
+        },
+        "stage_calls": dict(zip(TIMED_STAGES, times.calls.sum(dim=0).tolist())),
+        "worker_utilization": utilization,
+        "mean_worker_utilization": sum(utilization) / len(utilization),
+    }
+
+
+@hydra.main(
+    version_base=None,
+    config_path="../../config",
+    config_name="main",
+)
+def benchmark_data_loader(cfg_dict):
+    benchmark_cfg = cfg_dict.get("benchmark", {})
+    stages = benchmark_cfg.get("stages", STAGES)
+    all_num_workers = benchmark_cfg.get("num_workers", NUM_WORKERS)
+    num_batches = benchmark_cfg.get("num_batches", NUM_BATCHES)
+    with open_dict(cfg_dict):
+        cfg_dict.pop("benchmark", None)
+
+    cfg = load_typed_root_config(cfg_dict)
+    set_cfg(cfg_dict)
+    torch.manual_seed(cfg_dict.seed)
+
+    results = []
+    for stage in stages:
+        for num_workers in all_num_workers:
+            result = benchmark(cfg, stage, num_workers, num_batches)
+            results.append(result)
+            print(
+                f"{stage}, {num_workers} workers: "
+                f"{result['examples_per_second']:.2f} examples/s, "
+                f"{result['bytes_per_second'] / 2**20:.1f} MiB/s, "
+                f"utilization {result['mean_worker_utilization']:.2f}"
+            )
+
+    RESULT_PATH.mkdir(exist_ok=True, parents=True)
+    with (RESULT_PATH / "benchmark.json").open("w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    benchmark_data_loader()
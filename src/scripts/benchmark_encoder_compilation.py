@@ -0,0 +1,150 @@
+import json
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from time import time
+
+import hydra
+import torch
+from hydra.core.hydra_config import HydraConfig
+from jaxtyping import install_import_hook
+from lightning_fabric.utilities.apply_func import apply_to_collection
+from omegaconf import open_dict
+from torch import Tensor
+from torch.utils.data import default_collate
+
+# Configure beartype and jaxtyping.
+with install_import_hook(
+    ("src",),
+    ("beartype", "beartype"),
+):
+    from src.config import load_typed_root_config
+    from src.dataset import get_dataset
+    from src.global_cfg import set_cfg
+    from src.misc.wandb_tools import update_checkpoint_path
+    from src.model.decoder import get_decoder
+    from src.model.encoder import get_encoder
+    from src.model.encoder.compilation import CompiledEncoder, get_checkpoint_key
+    from src.model.model_wrapper import ModelWrapper
+
+# Compare eager execution against cold and warm starts of the compiled encoder, e.g.:
+# python3 -m src.scripts.benchmark_encoder_compilation +experiment=re10k
+# checkpointing.load=<checkpoint>
+# Warm starts are measured in a fresh process (this script with
+# +benchmark.warm_start_mode=<mode>), so that only the on-disk cache can be reused.
+NUM_WARM_CALLS = 10
+CACHE_PATH = Path("outputs/encoder_compilation_benchmark/cache")
+RESULT_PATH = Path("outputs/encoder_compilation_benchmark")
+
+
+def time_call(fn) -> float:
+    torch.cuda.synchronize()
+    start_time = time()
+    fn()
+    torch.cuda.synchronize()
+    return time() - start_time
+
+
+@hydra.main(
+    version_base=None,
+    config_path="../../config",
+    config_name="main",
+)
+def benchmark_encoder_compilation(cfg_dict):
+    warm_start_mode = cfg_dict.get("benchmark", {}).get("warm_start_mode")
+    with open_dict(cfg_dict):
+        cfg_dict.pop("benchmark", None)
+
+    cfg = load_typed_root_config(cfg_dict)
+    set_cfg(cfg_dict)
+    torch.manual_seed(cfg_dict.seed)
+    device = torch.device("cuda:0")
+
+    # Prepare the checkpoint for loading.
+    checkpoint_path = update_checkpoint_path(cfg.checkpointing.load, cfg.wandb)
+    checkpoint_key = get_checkpoint_key(checkpoint_path)
+
+    encoder, encoder_visualizer = get_encoder(cfg.model.encoder)
+    decoder = get_decoder(cfg.model.decoder, cfg.dataset)
+    model_wrapper = ModelWrapper.load_from_checkpoint(
+        checkpoint_path,
+        optimizer_cfg=cfg.optimizer,
+        test_cfg=cfg.test,
+        train_cfg=cfg.train,
+        encoder=encoder,
+        encoder_visualizer=encoder_visualizer,
+        decoder=decoder,
+        losses=[],
+        step_tracker=None,
+    )
+    model_wrapper.eval().to(device)
+    encoder = model_wrapper.encoder
+
+    # Use a single example, since the compiled graphs are specialized to its shape.
+    dataset = get_dataset(cfg.dataset, "test", None)
+    batch = model_wrapper.data_shim(default_collate([next(iter(dataset))]))
+    context = apply_to_collection(batch["context"], Tensor, lambda x: x.to(device))
+
+    # The opacity mapping depends on the step, so use the one the checkpoint ended at.
+    global_step = torch.load(checkpoint_path, map_location="cpu")["global_step"]
+
+    def time_first_call(mode: str) -> tuple[float, CompiledEncoder]:
+        compiled = CompiledEncoder(
+            encoder,
+            CACHE_PATH / mode,
+            checkpoint_key,
+            global_step,
+            deterministic=True,
+            mode=mode,
+        )
+        return time_call(lambda: compiled(context)), compiled
+
+    if warm_start_mode is not None:
+        seconds, _ = time_first_call(warm_start_mode)
+        with (RESULT_PATH / f"warm_start_{warm_start_mode}.json").open("w") as f:
+            json.dump(seconds, f)
+        return
+
+    results = {}
+    with torch.no_grad():
+        eager = [
+            time_call(lambda: encoder(context, global_step, deterministic=True))
+            for _ in range(NUM_WARM_CALLS)
+        ]
+        results["eager_seconds_per_call"] = sum(eager) / len(eager)
+
+    for mode in ("export", "compile"):
+        shutil.rmtree(CACHE_PATH / mode, ignore_errors=True)
+
+        # A cold start has to create (and save) the graph.
+        torch._dynamo.reset()
+        results[f"{mode}_cold_start_seconds"], compiled = time_first_call(mode)
+        steady = [time_call(lambda: compiled(context)) for _ in range(NUM_WARM_CALLS)]
+        results[f"{mode}_seconds_per_call"] = sum(steady) / len(steady)
+
+        # A warm start runs in a new process, which can only reuse the artifacts from
+        # the on-disk cache.
+        RESULT_PATH.mkdir(exist_ok=True, parents=True)
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "src.scripts.benchmark_encoder_compilation",
+                *HydraConfig.get().overrides.task,
+                f"+benchmark.warm_start_mode={mode}",
+            ],
+            check=True,
+        )
+        with (RESULT_PATH / f"warm_start_{mode}.json").open("r") as f:
+            results[f"{mode}_warm_start_seconds"] = json.load(f)
+
+    for key, value in results.items():
+        print(f"{key}: {value:.4f}")
+    RESULT_PATH.mkdir(exist_ok=True, parents=True)
+    with (RESULT_PATH / "benchmark.json").open("w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    benchmark_encoder_compilation()
@@ -0,0 +1,65 @@
+import json
+from argparse import ArgumentParser
+from pathlib import Path
+from time import time
+
+import torch
+
+from src.dataset.re10k_shards import SHARD_META_SUFFIX, load_shard
+
+# Each example uses a handful of frames, which is what the shards are optimized for.
+FRAMES_PER_EXAMPLE = 5
+
+
+def read_examples(chunk: list[dict], generator: torch.Generator) -> int:
+    num_bytes = 0
+    for example in chunk:
+        num_frames = len(example["images"])
+        indices = torch.randint(num_frames, (FRAMES_PER_EXAMPLE,), generator=generator)
+        for index in indices.tolist():
+            num_bytes += example["images"][index].numel()
+    return num_bytes
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare reading chunks and shards.")
+    parser.add_argument("chunks", type=Path, help="stage directory of .torch chunks")
+    parser.add_argument("shards", type=Path, help="stage directory of shards")
+    parser.add_argument("--num-chunks", type=int, default=10)
+    args = parser.parse_args()
+
+    chunk_paths = sorted(args.chunks.glob("*.torch"))[: args.num_chunks]
+    results = {}
+    for name, paths, load in (
+        ("chunks", chunk_paths, torch.load),
+        (
+            "shards",
+            [
+                args.shards / path.with_suffix(SHARD_META_SUFFIX).name
+                for path in chunk_paths
+            ],
+            load_shard,
+        ),
+    ):
+        # The same seed is used for both formats so that the same frames are read.
+        generator = torch.Generator()
+        generator.manual_seed(0)
+        num_examples = 0
+        num_bytes = 0
+        start_time = time()
+        for path in paths:
+            chunk = load(path)
+            num_examples += len(chunk)
+            num_bytes += read_examples(chunk, generator)
+        elapsed = time() - start_time
+        results[name] = {
+            "examples_per_second": num_examples / elapsed,
+            "seconds": elapsed,
+            "frame_bytes_read": num_bytes,
+        }
+
+    results["speedup"] = (
+        results["shards"]["examples_per_second"]
+        / results["chunks"]["examples_per_second"]
+    )
+    print(json.dumps(results, indent=2))
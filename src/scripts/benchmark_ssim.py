@@ -0,0 +1,87 @@
+import json
+from pathlib import Path
+from time import time
+
+import torch
+import torch.nn.functional as F
+from jaxtyping import install_import_hook
+
+# Configure beartype and jaxtyping.
+with install_import_hook(
+    ("src",),
+    ("beartype", "beartype"),
+):
+    from src.evaluation.metrics import compute_ssim, compute_ssim_skimage
+
+# Compare the batched torch SSIM against the original per-image scikit-image SSIM on
+# batches of rendering-like image pairs, e.g.:
+# python3 -m src.scripts.benchmark_ssim
+BATCH_SIZE = 30
+IMAGE_SHAPE = (256, 256)
+NUM_TRIALS = 5
+MAX_ERROR_BOUND = 1e-4
+RESULT_PATH = Path("outputs/ssim_benchmark")
+
+
+def generate_images(generator: torch.Generator) -> tuple[torch.Tensor, torch.Tensor]:
+    # Smooth random images with some sharp detail, and degraded copies of them.
+    h, w = IMAGE_SHAPE
+    shape = (BATCH_SIZE, 3, h // 8, w // 8)
+    ground_truth = F.interpolate(
+        torch.rand(shape, generator=generator), IMAGE_SHAPE, mode="bilinear"
+    )
+    ground_truth = ground_truth + 0.1 * torch.rand(
+        ground_truth.shape, generator=generator
+    )
+    noise = torch.randn(ground_truth.shape, generator=generator)
+    strength = torch.rand((BATCH_SIZE, 1, 1, 1), generator=generator) * 0.2
+    predicted = F.avg_pool2d(ground_truth, 3, 1, 1) + strength * noise
+    return ground_truth.clip(min=0, max=1), predicted.clip(min=0, max=1)
+
+
+if __name__ == "__main__":
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    generator = torch.Generator()
+    generator.manual_seed(0)
+
+    times_skimage = []
+    times_torch = []
+    max_error = 0.0
+    for _ in range(NUM_TRIALS):
+        ground_truth, predicted = generate_images(generator)
+        ground_truth = ground_truth.to(device)
+        predicted = predicted.to(device)
+
+        start_time = time()
+        expected = compute_ssim_skimage(ground_truth, predicted)
+        times_skimage.append(time() - start_time)
+
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start_time = time()
+        actual = compute_ssim(ground_truth, predicted)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        times_torch.append(time() - start_time)
+
+        max_error = max(max_error, (actual - expected).abs().max().item())
+
+    # The first torch call includes one-time setup (e.g., CUDA kernel loading).
+    results = {
+        "device": str(device),
+        "batch_size": BATCH_SIZE,
+        "image_shape": list(IMAGE_SHAPE),
+        "skimage_seconds_per_batch": sum(times_skimage) / len(times_skimage),
+        "torch_seconds_per_batch": sum(times_torch[1:]) / max(len(times_torch) - 1, 1),
+        "max_error": max_error,
+        "max_error_bound": MAX_ERROR_BOUND,
+        "within_bound": max_error <= MAX_ERROR_BOUND,
+    }
+    results["speedup"] = (
+        results["skimage_seconds_per_batch"] / results["torch_seconds_per_batch"]
+    )
+    for key, value in results.items():
+        print(f"{key}: {value}")
+    RESULT_PATH.mkdir(exist_ok=True, parents=True)
+    with (RESULT_PATH / "benchmark.json").open("w") as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,86 @@
+import json
+from multiprocessing import RLock
+from pathlib import Path
+from time import perf_counter
+
+import torch
+import torch.multiprocessing as mp
+from torch.multiprocessing import Manager
+
+from src.misc.step_tracker import StepTracker
+
+NUM_CALLS = 100_000
+RESULT_PATH = Path("outputs/step_tracker_benchmark")
+
+
+class ManagerStepTracker:
+    """The previous implementation, which is kept here as a baseline."""
+
+    lock: RLock
+
+    def __init__(self):
+        self.lock = Manager().RLock()
+        self.step = torch.tensor(0, dtype=torch.int64).share_memory_()
+
+    def set_step(self, step: int) -> None:
+        with self.lock:
+            self.step.fill_(step)
+
+    def get_step(self) -> int:
+        with self.lock:
+            return self.step.item()
+
+
+def time_calls(fn, num_calls: int) -> float:
+    start_time = perf_counter()
+    for step in range(num_calls):
+        fn(step)
+    return (perf_counter() - start_time) / num_calls
+
+
+def measure_worker(step_tracker, expected_step: int, num_calls: int, results) -> None:
+    # Check that the step set by the parent process is visible here.
+    assert step_tracker.get_step() == expected_step
+    results.put(time_calls(lambda _: step_tracker.get_step(), num_calls))
+
+
+def measure_in_child(step_tracker, start_method: str, num_calls: int) -> float:
+    step_tracker.set_step(1234)
+    context = mp.get_context(start_method)
+    results = context.Queue()
+    process = context.Process(
+        target=measure_worker, args=(step_tracker, 1234, num_calls, results)
+    )
+    process.start()
+    seconds = results.get()
+    process.join()
+    assert process.exitcode == 0
+    return seconds
+
+
+if __name__ == "__main__":
+    results = {}
+    for name, step_tracker_class in (
+        ("shared_memory", StepTracker),
+        ("manager", ManagerStepTracker),
+    ):
+        # The manager-based tracker is far slower, so it gets fewer calls.
+        num_calls = NUM_CALLS if name == "shared_memory" else NUM_CALLS // 100
+        step_tracker = step_tracker_class()
+        results[name] = {
+            "set_step_seconds": time_calls(step_tracker.set_step, num_calls),
+            "get_step_seconds": time_calls(
+                lambda _: step_tracker.get_step(), num_calls
+            ),
+        }
+        for start_method in ("fork", "spawn"):
+            results[name][f"get_step_{start_method}_worker_seconds"] = measure_in_child(
+                step_tracker, start_method, num_calls
+            )
+
+    for name, timings in results.items():
+        for key, value in timings.items():
+            print(f"{name} {key}: {value * 1e9:.0f} ns per call")
+    RESULT_PATH.mkdir(exist_ok=True, parents=True)
+    with (RESULT_PATH / "benchmark.json").open("w") as f:
+        json.dump(results, f, indent=2)
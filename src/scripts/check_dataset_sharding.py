@@ -0,0 +1,62 @@
+from collections import Counter
+
+import torch
+from torch.utils.data import DataLoader, IterableDataset
+
+from src.dataset.sharding import get_worker_chunks
+
+# This simulates several ranks, each with its own data loader, and checks that every
+# chunk is seen exactly once per epoch and that the order changes between epochs.
+NUM_CHUNKS = 103
+WORLD_SIZE = 3
+NUM_WORKERS = 4
+NUM_EPOCHS = 3
+SEED = 1234
+
+
+class ChunkDataset(IterableDataset):
+    def __init__(self, rank: int, world_size: int) -> None:
+        super().__init__()
+        self.chunks = list(range(NUM_CHUNKS))
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+
+    def __iter__(self):
+        chunks = get_worker_chunks(
+            self.chunks, self.rank, self.world_size, self.epoch, shuffle=True
+        )
+        self.epoch += 1
+        yield from chunks
+
+
+def check(persistent_workers: bool) -> None:
+    loaders = []
+    for rank in range(WORLD_SIZE):
+        # All ranks use the same data loader seed, as they do during training.
+        generator = torch.Generator()
+        generator.manual_seed(SEED)
+        loaders.append(
+            DataLoader(
+                ChunkDataset(rank, WORLD_SIZE),
+                batch_size=None,
+                num_workers=NUM_WORKERS,
+                generator=generator,
+                persistent_workers=persistent_workers,
+            )
+        )
+
+    orders = []
+    for epoch in range(NUM_EPOCHS):
+        seen = [int(chunk) for loader in loaders for chunk in loader]
+        counts = Counter(seen)
+        assert sorted(counts.keys()) == list(range(NUM_CHUNKS)), f"epoch {epoch}"
+        assert all(count == 1 for count in counts.values()), f"epoch {epoch}"
+        orders.append(seen)
+    assert all(a != b for a, b in zip(orders, orders[1:])), "order did not change"
+
+
+if __name__ == "__main__":
+    for persistent_workers in (False, True):
+        check(persistent_workers)
+        print(f"Sharding OK (persistent_workers={persistent_workers}).")
@@ -0,0 +1,49 @@
+import json
+from argparse import ArgumentParser
+from pathlib import Path
+
+import torch
+from tqdm import tqdm
+
+from src.dataset.re10k_shards import SHARD_META_SUFFIX, load_shard, write_shard
+
+STAGES = ("train", "test")
+
+
+def verify_shard(chunk: list[dict], meta_path: Path) -> None:
+    shard = load_shard(meta_path)
+    assert [x["key"] for x in chunk] == [x["key"] for x in shard]
+    for original, converted in zip(chunk, shard):
+        assert torch.equal(original["cameras"], converted["cameras"])
+        assert len(original["images"]) == len(converted["images"])
+        for index, image in enumerate(original["images"]):
+            assert torch.equal(image, converted["images"][index])
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Convert RE10k-style .torch chunks into memory-mapped shards."
+    )
+    parser.add_argument("input", type=Path, help="dataset root with train/test dirs")
+    parser.add_argument("output", type=Path, help="root for the converted dataset")
+    parser.add_argument("--verify", action="store_true", help="re-read every shard")
+    args = parser.parse_args()
+
+    for stage in STAGES:
+        chunk_paths = sorted((args.input / stage).glob("*.torch"))
+        if not chunk_paths:
+            continue
+
+        index = {}
+        for chunk_path in tqdm(chunk_paths, desc=f"Converting {stage}"):
+            chunk = torch.load(chunk_path)
+            stem = args.output / stage / chunk_path.stem
+            for key, position in write_shard(chunk, stem).items():
+                index[key] = [stem.with_suffix(SHARD_META_SUFFIX).name, position]
+            if args.verify:
+                verify_shard(chunk, stem.with_suffix(SHARD_META_SUFFIX))
+
+        # Unlike the chunked dataset's index, which maps each scene to its chunk, this
+        # maps each scene to its shard and its position within the shard.
+        with (args.output / stage / "index.json").open("w") as f:
+            json.dump(index, f)
@@ -0,0 +1,183 @@
+import json
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import hydra
+import torch
+import torch.multiprocessing as mp
+from jaxtyping import install_import_hook
+from omegaconf import DictConfig, OmegaConf
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+# Configure beartype and jaxtyping.
+with install_import_hook(
+    ("src",),
+    ("beartype", "beartype"),
+):
+    from src.config import load_typed_config
+    from src.dataset import DatasetCfg, get_dataset
+    from src.dataset.data_module import DataLoaderCfg, worker_init_fn
+    from src.dataset.dataset_re10k import DatasetRE10k
+    from src.dataset.shims.uint8_shim import apply_float_shim
+    from src.evaluation.evaluation_index_generator import (
+        EvaluationIndexGenerator,
+        EvaluationIndexGeneratorCfg,
+        get_scene_generator,
+    )
+    from src.global_cfg import set_cfg
+    from src.misc.journal import open_journal
+
+# Index scenes in several processes, e.g.:
+# python3 -m src.scripts.generate_evaluation_index_parallel +num_processes=8
+# Each process appends its entries to its own journal file as soon as they're computed.
+# Rerunning the same command resumes from the journals and skips finished scenes (and
+# chunks). Once every scene is indexed, the journals are merged into
+# evaluation_index.json. Each scene's random choices are seeded from the seed and the
+# scene's key, so an entry doesn't depend on the number of processes or on resuming.
+JOURNAL_DIRECTORY = "journal"
+
+
+@dataclass
+class RootCfg:
+    dataset: DatasetCfg
+    data_loader: DataLoaderCfg
+    index_generator: EvaluationIndexGeneratorCfg
+    seed: int
+    num_processes: int = 1
+
+
+def get_settings(cfg: RootCfg) -> dict:
+    """Get the settings that determine the entries. A journal written with different
+    settings can't be resumed.
+    """
+    generator_cfg = cfg.index_generator
+    return {
+        "num_target_views": generator_cfg.num_target_views,
+        "min_distance": generator_cfg.min_distance,
+        "max_distance": generator_cfg.max_distance,
+        "min_overlap": generator_cfg.min_overlap,
+        "max_overlap": generator_cfg.max_overlap,
+        "seed": generator_cfg.seed,
+        "roots": [str(root) for root in cfg.dataset.roots],
+        "image_shape": list(cfg.dataset.image_shape),
+    }
+
+
+def read_journal(path: Path) -> dict[str, dict | None]:
+    """Read every journal file in the directory. A line that was cut off by a crash is
+    ignored, which means that its scene is indexed again.
+    """
+    entries = {}
+    for journal_path in sorted(path.glob("*.jsonl")):
+        with journal_path.open("r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entries[record["scene"]] = record["entry"]
+    return entries
+
+
+def index_shard(
+    rank: int,
+    cfg: RootCfg,
+    cfg_container: dict,
+    finished: set[str],
+) -> None:
+    set_cfg(OmegaConf.create(cfg_container))
+    if torch.cuda.is_available():
+        device = torch.device(f"cuda:{rank % torch.cuda.device_count()}")
+    else:
+        device = torch.device("cpu")
+    index_generator = EvaluationIndexGenerator(cfg.index_generator).to(device)
+
+    # Split the chunks between the processes the same way they'd be split between
+    # ranks. Chunks whose scenes are all finished aren't loaded at all.
+    dataset = get_dataset(cfg.dataset, "test", None)
+    dataset.rank = rank
+    dataset.world_size = cfg.num_processes
+    if isinstance(dataset, DatasetRE10k):
+        chunk_scenes = defaultdict(set)
+        for scene, chunk_path in dataset.index.items():
+            chunk_scenes[chunk_path].add(scene)
+        dataset.chunks = [
+            chunk_path
+            for chunk_path in dataset.chunks
+            if chunk_path not in chunk_scenes
+            or not chunk_scenes[chunk_path] <= finished
+        ]
+
+    data_loader = DataLoader(
+        dataset,
+        batch_size=None,
+        num_workers=cfg.data_loader.test.num_workers,
+        worker_init_fn=worker_init_fn,
+    )
+
+    journal_path = cfg.index_generator.output_path / JOURNAL_DIRECTORY
+    with open_journal(journal_path / f"{rank:0>3}.jsonl") as f:
+        for example in tqdm(data_loader, f"Process {rank}", position=rank):
+            scene = example["scene"]
+            if scene in finished:
+                continue
+            target = apply_float_shim(example)["target"]
+            entry = index_generator.index_scene(
+                scene,
+                target["image"].to(device),
+                target["extrinsics"].to(device),
+                target["intrinsics"].to(device),
+                get_scene_generator(cfg.index_generator.seed, scene),
+            )
+            record = {"scene": scene, "entry": None if entry is None else asdict(entry)}
+            f.write(f"{json.dumps(record)}\n")
+            f.flush()
+
+
+@hydra.main(
+    version_base=None,
+    config_path="../../config",
+    config_name="generate_evaluation_index",
+)
+def generate_evaluation_index(cfg_dict: DictConfig):
+    cfg = load_typed_config(cfg_dict, RootCfg)
+    set_cfg(cfg_dict)
+    torch.manual_seed(cfg.seed)
+
+    # Make sure that an existing journal was written with the same settings.
+    output_path = cfg.index_generator.output_path
+    journal_path = output_path / JOURNAL_DIRECTORY
+    journal_path.mkdir(exist_ok=True, parents=True)
+    settings_path = journal_path / "settings.json"
+    settings = get_settings(cfg)
+    if settings_path.exists():
+        with settings_path.open("r") as f:
+            if json.load(f) != settings:
+                raise ValueError(
+                    f"The journal in {journal_path} was written with different "
+                    "settings. Delete it or change index_generator.output_path."
+                )
+    else:
+        with settings_path.open("w") as f:
+            json.dump(settings, f)
+
+    finished = set(read_journal(journal_path))
+    print(f"Resuming with {len(finished)} indexed scenes.")
+    mp.spawn(
+        index_shard,
+        (cfg, OmegaConf.to_container(cfg_dict), finished),
+        nprocs=cfg.num_processes,
+    )
+
+    # Merge the journals. Sorting the scenes makes the output independent of the
+    # order in which the processes finished them.
+    entries = read_journal(journal_path)
+    with (output_path / "evaluation_index.json").open("w") as f:
+        json.dump({scene: entries[scene] for scene in sorted(entries)}, f)
+    print(f"Indexed {len(entries)} scenes.")
+
+
+if __name__ == "__main__":
+    generate_evaluation_index()
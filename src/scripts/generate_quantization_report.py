@@ -0,0 +1,151 @@
+import json
+from pathlib import Path
+
+import hydra
+import torch
+from einops import rearrange
+from jaxtyping import install_import_hook
+from lightning_fabric.utilities.apply_func import apply_to_collection
+from torch import Tensor
+from torch.utils.data import default_collate
+
+# Configure beartype and jaxtyping.
+with install_import_hook(
+    ("src",),
+    ("beartype", "beartype"),
+):
+    from src.config import load_typed_root_config
+    from src.dataset import get_dataset
+    from src.evaluation.metrics import compute_lpips, compute_psnr, compute_ssim
+    from src.global_cfg import set_cfg
+    from src.misc.benchmarker import Benchmarker
+    from src.misc.wandb_tools import update_checkpoint_path
+    from src.model.decoder import get_decoder
+    from src.model.encoder import get_encoder
+    from src.model.encoder.quantization import CalibrationRecorder, quantize_encoder
+    from src.model.model_wrapper import ModelWrapper
+
+# Run this with the evaluation view sampler so that the subset is fixed, e.g.:
+# python3 -m src.scripts.generate_quantization_report +experiment=re10k \
+#     checkpointing.load=checkpoints/re10k.ckpt dataset/view_sampler=evaluation \
+#     dataset.view_sampler.index_path=assets/evaluation_index_re10k.json
+NUM_SCENES = 50
+RESULT_PATH = Path("outputs/quantization_report")
+
+
+@hydra.main(
+    version_base=None,
+    config_path="../../config",
+    config_name="main",
+)
+def generate_quantization_report(cfg_dict):
+    cfg = load_typed_root_config(cfg_dict)
+    set_cfg(cfg_dict)
+    torch.manual_seed(cfg_dict.seed)
+    cpu = torch.device("cpu")
+    device = torch.device("cuda:0")
+
+    # Prepare the checkpoint for loading.
+    checkpoint_path = update_checkpoint_path(cfg.checkpointing.load, cfg.wandb)
+
+    encoder, encoder_visualizer = get_encoder(cfg.model.encoder)
+    decoder = get_decoder(cfg.model.decoder, cfg.dataset)
+    model_wrapper = ModelWrapper.load_from_checkpoint(
+        checkpoint_path,
+        map_location=cpu,
+        optimizer_cfg=cfg.optimizer,
+        test_cfg=cfg.test,
+        train_cfg=cfg.train,
+        encoder=encoder,
+        encoder_visualizer=encoder_visualizer,
+        decoder=decoder,
+        losses=[],
+        step_tracker=None,
+    )
+    model_wrapper.eval()
+    encoders = {
+        "fp32": model_wrapper.encoder.cpu(),
+        "int8": quantize_encoder(model_wrapper.encoder),
+    }
+    decoder = model_wrapper.decoder.to(device)
+
+    dataset = get_dataset(cfg.dataset, "test", None)
+    benchmarker = Benchmarker()
+    scenes = []
+    with torch.no_grad(), CalibrationRecorder(encoders["fp32"]) as recorder:
+        for example in dataset:
+            if len(scenes) == NUM_SCENES:
+                break
+            batch = model_wrapper.data_shim(default_collate([example]))
+            _, _, _, h, w = batch["target"]["image"].shape
+            context = apply_to_collection(batch["context"], Tensor, lambda x: x.to(cpu))
+            target = apply_to_collection(
+                batch["target"], Tensor, lambda x: x.to(device)
+            )
+            rgb_gt = rearrange(target["image"], "b v c h w -> (b v) c h w")
+
+            # Run both encoders on the CPU and decode the results on the GPU. The
+            # deterministic mode is used so that sampling noise doesn't mask the
+            # difference between the two encoders.
+            scene = {"scene": batch["scene"][0]}
+            for key, encoder in encoders.items():
+                with benchmarker.time(f"encoder_{key}"):
+                    gaussians = encoder(context, 0, deterministic=True)
+                gaussians = apply_to_collection(
+                    gaussians, Tensor, lambda x: x.to(device)
+                )
+                output = decoder.forward(
+                    gaussians,
+                    target["extrinsics"],
+                    target["intrinsics"],
+                    target["near"],
+                    target["far"],
+                    (h, w),
+                )
+                rgb = rearrange(output.color, "b v c h w -> (b v) c h w")
+                scene[f"psnr_{key}"] = compute_psnr(rgb_gt, rgb).mean().item()
+                scene[f"ssim_{key}"] = compute_ssim(rgb_gt, rgb).mean().item()
+                scene[f"lpips_{key}"] = compute_lpips(rgb_gt, rgb).mean().item()
+            for metric in ("psnr", "ssim", "lpips"):
+                scene[f"{metric}_delta"] = (
+                    scene[f"{metric}_int8"] - scene[f"{metric}_fp32"]
+                )
+            scenes.append(scene)
+            print(
+                f"{scene['scene']}: PSNR delta {scene['psnr_delta']:.3f}, "
+                f"SSIM delta {scene['ssim_delta']:.4f}, "
+                f"LPIPS delta {scene['lpips_delta']:.4f}"
+            )
+
+    # Summarize quality and throughput.
+    summary = {
+        key: sum(scene[key] for scene in scenes) / len(scenes)
+        for key in scenes[0].keys()
+        if key != "scene"
+    }
+    for key in encoders.keys():
+        times = benchmarker.execution_times[f"encoder_{key}"]
+        summary[f"encoder_{key}_seconds"] = sum(times) / len(times)
+    summary["speedup"] = (
+        summary["encoder_fp32_seconds"] / summary["encoder_int8_seconds"]
+    )
+    for key, value in summary.items():
+        print(f"{key}: {value:.4f}")
+
+    RESULT_PATH.mkdir(exist_ok=True, parents=True)
+    with (RESULT_PATH / "report.json").open("w") as f:
+        json.dump(
+            {
+                "summary": summary,
+                "scenes": scenes,
+                "activation_ranges": {
+                    name: vars(entry) for name, entry in recorder.ranges.items()
+                },
+            },
+            f,
+            indent=2,
+        )
+
+
+if __name__ == "__main__":
+    generate_quantization_report()
@@ -0,0 +1,81 @@
+from dataclasses import replace
+
+import hydra
+import numpy as np
+from jaxtyping import install_import_hook
+
+# Configure beartype and jaxtyping.
+with install_import_hook(
+    ("src",),
+    ("beartype", "beartype"),
+):
+    from src.config import load_typed_config
+    from src.dataset.dataset_dtu import DatasetDTU, DatasetDTUCfg
+    from src.dataset.dtu_packed import (
+        PackedDTU,
+        get_packed_checksum,
+        verify_packed_dtu,
+        write_packed_dtu,
+    )
+    from src.dataset.view_sampler import get_view_sampler
+
+# Pack the views of all training and test scans at the configured image_shape, e.g.:
+# python3 -m src.scripts.preprocess_dtu +experiment=dtu \
+#     dataset.packed_root=datasets/dtu_packed
+# Then train or test with the same dataset.packed_root.
+STAGES = ("train", "test")
+
+
+@hydra.main(
+    version_base=None,
+    config_path="../../config",
+    config_name="main",
+)
+def preprocess_dtu(cfg_dict):
+    cfg = load_typed_config(cfg_dict.dataset, DatasetDTUCfg)
+    assert cfg.packed_root is not None, "Set dataset.packed_root."
+    packed_root = cfg.packed_root
+    checksum = get_packed_checksum(tuple(cfg.image_shape), cfg.roots[0])
+
+    # Skip packing if an intact packed dataset with the same settings exists.
+    if (packed_root / "metadata.json").exists():
+        try:
+            PackedDTU(packed_root, checksum)
+            if not verify_packed_dtu(packed_root):
+                print(f"{packed_root} is up to date.")
+                return
+        except ValueError:
+            pass
+
+    # The datasets read the raw files, which determines the scans and views to pack.
+    cfg = replace(cfg, packed_root=None)
+    keys = {}
+    for stage in STAGES:
+        view_sampler = get_view_sampler(cfg.view_sampler, stage, False, False, None)
+        dataset = DatasetDTU(cfg, stage, view_sampler)
+        light_indices = sorted({light_idx for _, light_idx, _, _ in dataset.chunks})
+        for scan in dataset.scans:
+            for light_idx in light_indices:
+                for vid in range(dataset.num_all_imgs):
+                    keys[(scan, light_idx, vid)] = None
+    keys = list(keys)
+
+    # Cameras are stored as they're read, since each dataset rescales them itself.
+    cameras = [
+        dataset.read_cam_file(
+            cfg.roots[0] / f"Cameras/train/{vid:08d}_cam.txt",
+        )
+        for vid in range(dataset.num_all_imgs)
+    ]
+    cameras = {
+        "intrinsics": np.stack([intrinsics for intrinsics, _, _ in cameras]),
+        "extrinsics": np.stack([extrinsics for _, extrinsics, _ in cameras]),
+        "near_fars": np.array([near_far for _, _, near_far in cameras]),
+    }
+
+    write_packed_dtu(packed_root, checksum, keys, dataset.read_views, cameras)
+    print(f"Packed {len(keys)} views into {packed_root}.")
+
+
+if __name__ == "__main__":
+    preprocess_dtu()